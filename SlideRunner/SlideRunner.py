@@ -62,6 +62,12 @@ from PyQt6.QtWidgets import QMainWindow, QApplication
 from SlideRunner.general.dependencies import *
 from SlideRunner_dataAccess.annotations import ViewingProfile
 from SlideRunner_dataAccess.slide import SlideReader
+from SlideRunner.dataAccess.spatialindex import SpatialDatabase
+from SlideRunner.processing.compositor import layeredCompositor, boundingRect
+from SlideRunner.processing.resultcache import pluginResultCache
+from SlideRunner.general.pluginProcess import instantiatePlugin
+from SlideRunner.general.types import lazyPlugin
+from SlideRunner.general.startupProfile import profile
 from PyQt6.QtCore import QSettings
 import threading
 import numpy as np
@@ -86,20 +92,39 @@ class imageReceiverThread(threading.Thread):
     def run(self):
         while True:
             (img, procId) = self.queue.get()
+            if isinstance(img, SlideRunnerPlugin.SharedFrame):
+                img = SlideRunnerPlugin.receivedImage(img) # overlayBuffer() slots are reused by the plugin
+                if (img is None): # slot reused already, a newer result follows
+                    continue
+            if not self.selfObj.pluginResults.store(procId, img):
+                continue # result of a view that is not shown any more (but cached)
             self.selfObj.overlayMap[self.pluginName] = img
             self.selfObj.showImage3Request.emit(np.empty(0), procId)
                         
 
 class SlideImageReceiverThread(threading.Thread):
-    def __init__(self, selfObj, readerqueue):
+    def __init__(self, selfObj, readerqueue, statisticsQueue=None):
         threading.Thread.__init__(self)
         self.queue = readerqueue
+        self.statisticsQueue = statisticsQueue
         self.selfObj = selfObj
 
     def run(self):
         while True:
             (img, procId) = self.queue.get()
             self.selfObj.readRegionCompleted.emit(img,procId)
+            self.logStatistics()
+
+    def logStatistics(self):
+        if (self.statisticsQueue is None):
+            return
+        try:
+            while True:
+                stats = self.statisticsQueue.get_nowait()
+                self.selfObj.writeDebug('Region %d: %d tiles read in %.1f ms, tile latencies (ms): %s' % (stats['id'], stats['tilesRead'], stats['duration']*1000,
+                                        ', '.join(['(%d,%d): %.1f' % (tx,ty,1000*latency) for tx,ty,latency in stats['tileLatencies']])))
+        except queue.Empty:
+            pass
 
 # Thread for receiving progress bar events
 class PluginStatusReceiver(threading.Thread):
@@ -143,8 +168,7 @@ class SlideRunnerUI(QMainWindow):
     showImage3Request = pyqtSignal(np. ndarray, int)
     readRegionCompleted = pyqtSignal(np.ndarray, int)
     statusViewChanged = pyqtSignal(str)
-    annotationReceived = pyqtSignal(str,list)
-    updatedCacheAvailable = pyqtSignal(dict)
+    annotationReceived = pyqtSignal(str,object)
     setZoomReceived = pyqtSignal(float)
     setCenterReceived = pyqtSignal(tuple)
     updatePluginConfig = pyqtSignal(str,SlideRunnerPlugin.PluginConfigUpdate)
@@ -154,7 +178,7 @@ class SlideRunnerUI(QMainWindow):
     showException = pyqtSignal(Exception)
     pluginPopupMessageReceived = pyqtSignal(str,str)
     annotator = bool # ID of curent annotator
-    db = Database()
+    db = SpatialDatabase()
     receiverThread = None
     activePlugin = None
     overlayMap = dict()
@@ -171,10 +195,12 @@ class SlideRunnerUI(QMainWindow):
     currentVP = ViewingProfile()
     currentPluginVP = ViewingProfile()
     lastReadRequest = None
-    cachedLocation = None
-    cachedLevel = None
+    lastPrefetchArea = None
+    pluginAnnosVersion = 0 # bumped whenever an annotation list in pluginAnnos is replaced
+    viewingProfileVersion = 0 # bumped whenever class colors or active plugin classes change
+    nextScreeningField = None # (screening position and field size, next field) of the last screening step
+    previewImage = None # coarse preview shown (and used as rawImage) until the full resolution region arrives
     pluginTextLabels = dict()
-    cachedImage = None
     selectedPluginAnno = None
     selectedAnno = None
     annotationClasses={0:{}}
@@ -185,7 +211,8 @@ class SlideRunnerUI(QMainWindow):
     def __init__(self,slideReaderThread, app, version,pluginList):
         super(SlideRunnerUI, self).__init__()
 
-        self.settings = QSettings('Pattern Recognition Lab, FAU Erlangen Nuernberg', 'SlideRunner')
+        with profile.phase('QSettings'):
+            self.settings = QSettings('Pattern Recognition Lab, FAU Erlangen Nuernberg', 'SlideRunner')
 
         # Default value initialization
         self.relativeCoords = np.asarray([0,0], np.float32)
@@ -207,8 +234,6 @@ class SlideRunnerUI(QMainWindow):
         self.annotationsArea = list()
         self.annotationsCircle = list()
         self.annotationsList = list()
-        self.pluginMinCoords = dict()
-        self.pluginMaxCoords = dict()
         self.ui.wandAnnotation = WandAnnotation()
         self.slidename=''
         self.slideUID = 0
@@ -219,6 +244,7 @@ class SlideRunnerUI(QMainWindow):
         self.classButtons = list()
         self.updateTimer = None
         self.displayedImage = None
+        self.compositor = layeredCompositor()
         self.overlayExtremes = None
         self.overviewOverlayHeatmap = False
         self.annotationPolygons=[]
@@ -245,7 +271,6 @@ class SlideRunnerUI(QMainWindow):
         self.showException.connect(self.showPluginException)
         self.updatePluginConfig.connect(self.updatePluginConfiguration)
         self.updatePluginLabels.connect(self.showDatabaseUIelements)
-        self.updatedCacheAvailable.connect(self.updateCache)
         self.setZoomReceived.connect(self.setZoom)
         self.setCenterReceived.connect(self.setCenter)
         self.readRegionCompleted.connect(self.showImage_part2)
@@ -258,7 +283,8 @@ class SlideRunnerUI(QMainWindow):
 
         
     
-        self.slideImageReceiverThread = SlideImageReceiverThread(self, readerqueue=self.slideReaderThread.outputQueue)
+        self.slideImageReceiverThread = SlideImageReceiverThread(self, readerqueue=self.slideReaderThread.outputQueue,
+                                                                statisticsQueue=getattr(self.slideReaderThread, 'statisticsQueue', None))
         self.slideImageReceiverThread.setDaemon(True)
         self.slideImageReceiverThread.start()
 
@@ -292,7 +318,10 @@ class SlideRunnerUI(QMainWindow):
 
         shortcuts.defineMenuShortcuts(self)
 
-        self.checkSettings()
+        with profile.phase('QSettings'):
+            self.checkSettings()
+        self.pluginResults = pluginResultCache(maxBytes=int(self.settings.value('PluginResultCacheMB', 128))*1024*1024,
+                                               spillDirectory=self.settings.value('PluginResultSpillDirectory', '') or None)
         self.currentVP.spotCircleRadius = self.settings.value('SpotCircleRadius')
         self.currentPluginVP.spotCircleRadius = self.settings.value('SpotCircleRadius')
         if (isinstance(self.settings.value('rotateImage',False),str)):
@@ -394,6 +423,25 @@ class SlideRunnerUI(QMainWindow):
             self.settings.setValue('SpotCircleRadius', 25)
         if (self.settings.value('GuidedScreeningThreshold') == None):
             self.settings.setValue('GuidedScreeningThreshold', 'OTSU')
+        if (self.settings.value('ProgressiveRendering') == None):
+            self.settings.setValue('ProgressiveRendering', 1)
+        if (self.settings.value('AnnotationLODDownsample') == None):
+            self.settings.setValue('AnnotationLODDownsample', 16)
+        if (self.settings.value('PluginResultCacheMB') == None):
+            self.settings.setValue('PluginResultCacheMB', 128)
+        if (self.settings.value('PluginResultSpillDirectory') == None):
+            self.settings.setValue('PluginResultSpillDirectory', '')
+
+    @property
+    def progressiveRendering(self) -> bool:
+        return bool(int(self.settings.value('ProgressiveRendering', 1)))
+
+    @property
+    def annotationLODDownsample(self) -> float:
+        """
+            zoom level beyond which annotations are shown as density map (0: never)
+        """
+        return float(self.settings.value('AnnotationLODDownsample', 16))
 
     class NotImplementedException:
         pass
@@ -435,8 +483,10 @@ class SlideRunnerUI(QMainWindow):
         self.showDBstatistics()
 
     def receiveAnno(self, plugin, anno):
+        if not isinstance(anno, SlideRunnerPlugin.PluginAnnotationStore):
+            anno = SlideRunnerPlugin.PluginAnnotationStore(anno)
         self.pluginAnnos[plugin] = anno
-        self.pluginMinCoords[plugin], self.pluginMaxCoords[plugin] = SlideRunnerPlugin.generateMinMaxCoordsList(anno)
+        self.pluginAnnosVersion += 1
         self.showImage_part3(np.empty(shape=(1)), self.processingStep)
 
     #receivePluginInformation
@@ -609,7 +659,32 @@ class SlideRunnerUI(QMainWindow):
     """
     Helper function to toggle Plugin activity
     """
+    def loadPlugin(self, entry:lazyPlugin):
+        """
+            imports a plugin discovered from the manifest and creates its instance,
+            when it is enabled for the first time
+        """
+        if (entry.pluginClass is None):
+            t0 = time.time()
+            try:
+                plugin = entry.load()
+                plugin.instance = instantiatePlugin(plugin, self.progressBarQueue)
+            except Exception as e:
+                entry.pluginClass = None
+                for pluginItem in self.ui.pluginItems:
+                    if (entry.shortName == pluginItem.text()):
+                        pluginItem.setChecked(False)
+                self.popupmessage('Unable to load plugin %s: %s' % (entry.shortName, str(e)))
+                return None
+            self.writeDebug('imported plugin %s in %.1f ms' % (entry.shortName, 1000*(time.time()-t0)))
+        return entry.pluginClass
+
     def togglePlugin(self, plugin:pluginEntry):
+        if isinstance(plugin, lazyPlugin):
+            plugin = self.loadPlugin(plugin)
+            if (plugin is None):
+                return
+
         active = False
         for pluginItem in self.ui.pluginItems:
             if (plugin.shortName == pluginItem.text()):
@@ -686,6 +761,7 @@ class SlideRunnerUI(QMainWindow):
                 self.ui.opacityLabel.setHidden(True)
                 self.ui.opacitySlider.setHidden(True)
             if (self.imageOpened):
+                self.overlayMap[plugin.shortName] = None
                 self.triggerPlugin(plugin.shortName, self.rawImage)
         else:
             self.activePlugin = None
@@ -706,7 +782,7 @@ class SlideRunnerUI(QMainWindow):
             self.ui.overlaySelect.currentIndexChanged.connect(self.changeOverlay)
 
         print('Active plugin is now ', self.activePlugin)
-        self.overlayMap[plugin.shortName] = None
+        self.overlayMap.setdefault(plugin.shortName, None) # a cached result may have arrived already
         self.clearPluginAnnos(plugin.shortName)
         if not active:
             self.showImage()
@@ -773,7 +849,7 @@ class SlideRunnerUI(QMainWindow):
 
         if (self.activePlugins.numberActive>0) and not isinstance(plugin,list):
             print('Plugin triggered...', plugin)
-            self.activePlugins.activePlugins[plugin].inQueue.put(SlideRunnerPlugin.jobToQueueTuple(currentImage=currentImage, slideFilename=self.slidepathname, configuration=self.gatherPluginConfig(plugin), annotations=annotations, trigger=trigger,coordinates=coordinates, actionUID=actionUID, openedDatabase=self.db))
+            self.sendPluginJob(plugin, currentImage, coordinates, annotations=annotations, trigger=trigger, actionUID=actionUID)
 
         elif (self.activePlugins.numberActive>0): # send to all (none particular specified)
             plugins=plugin # multiple plugins omitted
@@ -781,7 +857,30 @@ class SlideRunnerUI(QMainWindow):
             for plugin in plugins:
                 if not isinstance(plugin,str):
                     plugin=plugin.shortName # if the real plugin was omitted
-                self.activePlugins.activePlugins[plugin].inQueue.put(SlideRunnerPlugin.jobToQueueTuple(currentImage=currentImage, slideFilename=self.slidepathname, configuration=self.gatherPluginConfig(plugin), annotations=annotations, trigger=trigger,coordinates=coordinates, actionUID=actionUID, openedDatabase=self.db))
+                self.sendPluginJob(plugin, currentImage, coordinates, annotations=annotations, trigger=trigger, actionUID=actionUID)
+
+    def sendPluginJob(self, plugin:str, currentImage, coordinates, annotations=None, trigger=None, actionUID=None):
+        pluginClass = self.activePlugins.activePlugins[plugin]
+        configuration = self.gatherPluginConfig(plugin)
+        procId = None
+        # results of plain viewport jobs are memoized, actions and annotations are always sent
+        if (getattr(pluginClass, 'cacheResults', False)) and (annotations is None) and (trigger is None) and (actionUID is None) and (currentImage is not None):
+            key = pluginResultCache.key(plugin, pluginClass.version, configuration, self.slidepathname, coordinates, currentImage.shape, self.rotateImage, self.zPosition)
+            cached = self.pluginResults.get(key, plugin)
+            if (cached is not None):
+                self.writeDebug('Plugin %s: result taken from cache' % plugin)
+                pluginClass.outQueue.put((cached, 0))
+                return
+            # a result computed on the preview of the region is not stored under the key of the region
+            procId = self.pluginResults.request(key if (currentImage is not self.previewImage) else None, plugin)
+        pluginClass.inQueue.put(SlideRunnerPlugin.jobToQueueTuple(currentImage=currentImage, slideFilename=self.slidepathname, configuration=configuration, annotations=annotations, trigger=trigger,coordinates=coordinates, actionUID=actionUID, openedDatabase=self.db, procId=procId))
+        self.logPluginQueue(plugin)
+
+    def logPluginQueue(self, plugin:str):
+        inQueue = self.activePlugins.activePlugins[plugin].inQueue
+        if hasattr(inQueue, 'statistics'): # plugins may still use a plain queue
+            stats = inQueue.statistics()
+            self.writeDebug('Plugin %s: queue depth %d (max. %d), %d of %d jobs dropped' % (plugin, stats['depth'], stats['maxDepth'], stats['dropped'], stats['received']))
 
 
 
@@ -1093,6 +1192,7 @@ class SlideRunnerUI(QMainWindow):
 
             if (self.ui.annotationMode==2): #replace polygon object
                 self.db.annotations[self.ui.annotationUID].deleted=False # make visible again
+                self.db.annotationsChanged(self.ui.annotationUID)
             self.ui.annotationMode=0
             self.showImage()
 
@@ -1106,6 +1206,7 @@ class SlideRunnerUI(QMainWindow):
             
             if (self.ui.annotationMode==2): #replace polygon object
                 self.db.annotations[self.ui.annotationUID].deleted=False # make visible again
+                self.db.annotationsChanged(self.ui.annotationUID)
             self.ui.mode = mode
             self.ui.annotationsList = list()
             self.showImage()
@@ -1148,13 +1249,20 @@ class SlideRunnerUI(QMainWindow):
             self.ui.iconWand.setChecked(True)
 
     def toQImage(self, im, copy=False):
+        """
+            Wraps the RGBA buffer of im in a QImage, without copying it (unless copy is set).
+            Rows may be padded (stride is passed on), pixels need to be packed.
+        """
+        if (im.strides[2]!=1) or (im.strides[1]!=4):
+            im = np.ascontiguousarray(im)
         qim = QImage(im.data, im.shape[1], im.shape[0], im.strides[0], QImage.Format.Format_RGBA8888)
-        return qim
+        return qim.copy() if copy else qim
 
     def vidImageToQImage(self, cvImg):
+        if (cvImg.strides[2]!=1) or (cvImg.strides[1]!=3):
+            cvImg = np.ascontiguousarray(cvImg)
         height, width, channel = cvImg.shape
-        bytesPerLine = 3 * width
-        qImg = QImage(cvImg.data, width, height, QtGui.QImage.Format.Format_RGB888)
+        qImg = QImage(cvImg.data, width, height, cvImg.strides[0], QtGui.QImage.Format.Format_RGB888)
         return QtGui.QPixmap.fromImage(qImg)
 
 
@@ -1183,9 +1291,8 @@ class SlideRunnerUI(QMainWindow):
     def clearPluginAnnos(self, plugin:SlideRunnerPlugin):
         if not isinstance(plugin,str):
             plugin=plugin.shortName
-        self.pluginAnnos[plugin] = dict()
-        self.pluginMaxCoords[plugin] = dict()
-        self.pluginMinCoords[plugin] = dict()
+        self.pluginAnnos[plugin] = SlideRunnerPlugin.PluginAnnotationStore()
+        self.pluginAnnosVersion += 1
 
 
     def pressOverviewImage(self,event):
@@ -1358,6 +1465,7 @@ class SlideRunnerUI(QMainWindow):
         # retrieve complete annotation from DB
         annocoords = self.db.annotations[anno_uid].coordinates
         self.db.annotations[anno_uid].deleted=True
+        self.db.annotationsChanged(anno_uid)
         
         annocoords = np.vstack((annocoords[point_idx+1:,:],annocoords[0:point_idx,:]))
 
@@ -1395,6 +1503,7 @@ class SlideRunnerUI(QMainWindow):
             cont = cv2.approxPolyDP(self.db.annotations[annoId].coordinates,epsilon,True)
             cont = cont.squeeze()
             self.db.annotations[annoId].coordinates = cont
+            self.db.annotationsChanged(annoId)
             self.showImage()
 
             reply = QtWidgets.QMessageBox.question(self, 'Question', 'Simplification done. Accept?',QtWidgets.QMessageBox.StandardButton.Yes, QtWidgets.QMessageBox.StandardButton.No)
@@ -1404,6 +1513,7 @@ class SlideRunnerUI(QMainWindow):
                 pass
             else:
                 self.db.annotations[annoId].coordinates = oldC
+                self.db.annotationsChanged(annoId)
                 self.showImage()
 
 
@@ -1653,37 +1763,6 @@ class SlideRunnerUI(QMainWindow):
         subpix_a = np.expand_dims(cv2.warpAffine(self.slideOverview[:,:,3], M, dsize=size),axis=2)
         return np.concatenate((sp, subpix_a), axis=2)
 
-    def image_in_cache(self, location, level, size):
-        readNew = False
-        coords = None
-        if (not(level == self.cachedLevel) or (self.cachedLocation is None)):
-            readNew = True
-        
-        if (self.cachedLocation is not None):
-            x0 = int((location[0]-self.cachedLocation[0])/self.slide.level_downsamples[level])
-            y0 = int((location[1]-self.cachedLocation[1])/self.slide.level_downsamples[level])
-            x1 = x0 + size[0]
-            y1 = y0 + size[1]
-            if (x0<0) or (y0<0): # out of cache
-                readNew = True
-            
-            if ((y1>self.cachedImage.shape[0]) or
-                (x1>self.cachedImage.shape[1])):
-                readNew = True
-
-            coords = (x0,x1,y0,y1)
-        return readNew,coords
-
-
-
-
-    def updateCache(self, newcache):
-        self.cachedImage = newcache['image']
-        self.cachedLevel = newcache['level']
-        self.cachedLocation = newcache['location']
-#        self.showImage()
-
-
     def showImage(self):
         """
             showImage is an important function that is used for refreshing the image display.
@@ -1736,11 +1815,13 @@ class SlideRunnerUI(QMainWindow):
         size_im = (int(imgarea_w[0]/closest_ds), int(imgarea_w[1]/closest_ds))
         location_im = (int(imgarea_p1[0]), int(imgarea_p1[1]))
 
-        # Read from Whole Slide Image Overview
-#        npi = self.prepare_region_from_overview(location_im, act_level, size_im)
-
         self.processingStep += 1
-#        outOfCache,_ = self.image_in_cache(location_im, act_level, size_im)
+        if hasattr(self.slideReaderThread, 'latestRequest'): # TiledSlideReader only: skips stale requests
+            self.slideReaderThread.latestRequest.value = self.processingStep
+
+        # Show the region upsampled from the overview until the slide reader delivers the full resolution
+        if (self.progressiveRendering):
+            self.showImage_preview(self.prepare_region_from_overview(location_im, act_level, size_im))
 
         if 32 in self.slide.level_downsamples:
             level_overview = np.where(np.array(self.slide.level_downsamples)==32)[0][0] # pick overview at 32x
@@ -1748,6 +1829,60 @@ class SlideRunnerUI(QMainWindow):
             level_overview = self.slide.level_count-1
 
         self.slideReaderThread.queue.put((self.slidepathname, location_im, act_level, size_im, self.processingStep, self.rotateImage, self.zPosition))
+        if hasattr(self.slideReaderThread, 'prefetchQueue'): # TiledSlideReader only
+            self.prefetchNeighbourhood(imgarea_p1, imgarea_w, act_level)
+
+    def prefetchNeighbourhood(self, imgarea_p1, imgarea_w, act_level):
+        """
+            Announces the regions that are likely to be viewed next to the slide reader,
+            which reads them into its tile cache while idle. In order of priority: the next
+            field in guided screening, the area ahead in panning direction, and the current
+            view one pyramid level up and down.
+        """
+        regions = list()
+        def addRegion(p1, w, level):
+            ds = self.slide.level_downsamples[level]
+            regions.append((self.slidepathname, (int(p1[0]), int(p1[1])), int(level), (int(w[0]/ds), int(w[1]/ds)), self.rotateImage, self.zPosition))
+
+        if (self.screeningMode) and (self.screeningMap is not None):
+            relOffset = self.mainImageSize / np.asarray(self.slide.level_dimensions[0])
+            key = (tuple(self.lastScreeningLeftUpper), tuple(imgarea_w))
+            if (self.nextScreeningField is None) or (self.nextScreeningField[0]!=key):
+                # once per screening step (or zoom), not on every pan
+                self.nextScreeningField = (key, self.screeningMap.findNextField(self.lastScreeningLeftUpper, imgarea_w, relOffset))
+            leftUpper = self.nextScreeningField[1]
+            if (leftUpper is not None):
+                center = (np.asarray(leftUpper)+relOffset/2)*np.asarray(self.slide.level_dimensions[0])
+                addRegion(center-imgarea_w/2, imgarea_w, act_level)
+
+        if (self.lastPrefetchArea is not None) and (self.lastPrefetchArea[1]==act_level):
+            direction = np.sign(np.asarray(imgarea_p1)-self.lastPrefetchArea[0])
+            if np.any(direction!=0):
+                addRegion(imgarea_p1+direction*imgarea_w*0.5, imgarea_w, act_level)
+        self.lastPrefetchArea = (np.asarray(imgarea_p1), act_level)
+
+        center = np.asarray(imgarea_p1)+imgarea_w/2
+        for level in [act_level-1, act_level+1]:
+            if (level>=0) and (level<self.slide.level_count):
+                w = self.mainImageSize*self.slide.level_downsamples[level]
+                addRegion(center-w/2, w, level)
+
+        try:
+            self.slideReaderThread.prefetchQueue.put_nowait(regions)
+        except queue.Full:
+            pass
+
+    def showImage_preview(self, npi):
+        """
+            Displays a coarse preview of the current region. It is replaced as soon
+            as readRegionCompleted delivers the full resolution region. Until then, it
+            is also the rawImage (e.g. for the wand), which matches the current region.
+        """
+        npi = cv2.resize(npi, dsize=(self.mainImageSize[0],self.mainImageSize[1]))
+        self.compositor.bytesCopied += npi.nbytes
+        self.rawImage = npi
+        self.previewImage = npi
+        self.showImage_part3(npi, self.processingStep)
 
     def closeEvent(self, event):
         self.slideReaderThread.queue.put((-1,0,0,0,0,0,0))
@@ -1767,12 +1902,16 @@ class SlideRunnerUI(QMainWindow):
         else:
             im_size=(int(self.ui.MainImage.frameGeometry().height()*aspectRatio_image),self.ui.MainImage.frameGeometry().height())
 
-        # Resize to real image size
+        # Resize to real image size. The resized region is shared (read-only) as rawImage, cachedLastImage
+        # and with the plugins, so it is allocated anew for every region.
         npi=cv2.resize(npi, dsize=(self.mainImageSize[0],self.mainImageSize[1]))
-        self.rawImage = np.copy(npi)
+        self.compositor.bytesCopied += npi.nbytes
         if ((id<self.processingStep) and 
             ((self.activePlugins.numberActive == 0) or (len(self.activePlugins.imagePlugins)==0))):
-            self.ui.MainImage.setPixmap(QPixmap.fromImage(self.toQImage(self.rawImage)))
+            if (self.progressiveRendering): # preview of the newer region is already shown (and is the rawImage)
+                return
+            self.rawImage = npi
+            self.displayFrame(self.rawImage)
             return
 
         activeOverlays = [x for x in self.overlayMap.keys() if x is not None]
@@ -1784,17 +1923,19 @@ class SlideRunnerUI(QMainWindow):
             if (self.updateTimer is not None):
                 self.updateTimer.cancel()
             
-            self.updateTimer = Timer(0.2, partial(self.triggerPlugin,self.activePlugins.pluginsWithScrollUpdatePolicy, np.copy(npi)))                
+            self.updateTimer = Timer(0.2, partial(self.triggerPlugin,self.activePlugins.pluginsWithScrollUpdatePolicy, npi))                
             self.updateTimer.start()
         
-        self.cachedLastImage = np.copy(npi)
+        self.rawImage = npi
+        self.previewImage = None
+        self.cachedLastImage = npi
         self.showImage_part3(npi, id)
 
     def showImage_part3(self, npi, id):
         activeOverlays = [x for x in self.overlayMap.keys() if x is not None]
 
         if (len(npi.shape)==1): # empty was given as parameter - i.e. trigger comes from plugin
-            npi = np.copy(self.cachedLastImage)
+            npi = self.cachedLastImage
 
         if (self.activePlugins.numberActive > 0) and (len(activeOverlays)==0) and (len(self.activePlugins.RGBimagePlugins)>0):
             return
@@ -1806,6 +1947,8 @@ class SlideRunnerUI(QMainWindow):
                     olm = self.overlayMap[self.activePlugins.activeOverlay.shortName]
                     # Heatmap
                     if ((len(olm.shape)==2) or ((len(olm.shape)==3) and (olm.shape[2]==1))) and np.all(npi.shape[0:2] == olm.shape[0:2]): 
+                        if (olm.dtype == np.float16): # cv2.resize does not support half floats
+                            olm = np.float32(olm)
                         self.overlayExtremes = [np.min(olm), np.max(olm)+np.finfo(np.float32).eps]
                         # Normalize overlay
                         if (self.overlayMap is not None):
@@ -1817,6 +1960,7 @@ class SlideRunnerUI(QMainWindow):
                             colorMap = cm(olm)
                             # alpha blend
                             npi = np.uint8(npi * (1-self.opacity) + colorMap * 255 * (self.opacity))
+                            self.compositor.bytesCopied += npi.nbytes
 
                     else:
                         print('Overlay map shape not proper')
@@ -1826,6 +1970,7 @@ class SlideRunnerUI(QMainWindow):
                     olm = self.overlayMap[self.activePlugins.activeOverlay.shortName]
                     if olm is not None:
                         self.overlayExtremes = None
+                        npi = self.compositor.writableCopy('overlay', npi) # keep the region (cachedLastImage) untouched
                         if (len(olm.shape)==3) and (olm.shape[2]==3) and np.all(npi.shape[0:2] == olm.shape[0:2]): 
                             if (self.activePlugins.activeOverlay.outputType == SlideRunnerPlugin.PluginOutputType.RGB_IMAGE):
                                 for c in range(3):
@@ -1853,56 +1998,9 @@ class SlideRunnerUI(QMainWindow):
             self.ui.OverviewLabel.setPixmap(self.vidImageToQImage(self.overviewimage))
 
 
-        # Draw annotations by the plugin
-        for plugin in self.activePlugins.activePlugins.values():
-            labels = plugin.instance.getAnnotationLabels()
-            if (len(self.pluginAnnos[plugin.shortName])>0) and (plugin.shortName in self.annotationClasses):
-                for anno in SlideRunnerPlugin.getVisibleAnnotations(leftUpper=self.region[0], rightLower=self.region[0]+self.region[1], 
-                                                                    annotations=self.pluginAnnos[plugin.shortName], minCoords=self.pluginMinCoords[plugin.shortName], maxCoords=self.pluginMaxCoords[plugin.shortName]):
-                    if (anno.pluginAnnotationLabel is None) or (anno.pluginAnnotationLabel.uid in self.annotationClasses[plugin.shortName]):
-                        if (self.annotationClasses[plugin.shortName][anno.pluginAnnotationLabel.uid]['Active']):
-                            anno.draw(image=npi, leftUpper=self.region[0], 
-                                    zoomLevel=self.getZoomValue(), thickness=2, vp=self.currentPluginVP,
-                                    selected=(self.selectedPluginAnno==anno.uid))
-
-
-        # Overlay Annotations by the user
-        if (self.db.isOpen()):
-            self.db.annotateImage(npi, self.region[0], self.region[0]+self.region[1], self.getZoomValue(), self.currentVP, self.selectedAnno, annotationClasses=self.annotationClasses[0])
-
-
-        # Show the current polygon (if in polygon annotation mode)
-        if (self.db.isOpen()) & (self.ui.mode==UIMainMode.MODE_ANNOTATE_POLYGON) & (self.ui.annotationMode>0):
-            npi = self.showPolygon(npi, self.ui.annotationsList, color=[0,0,0,255])
-
-        if (self.ui.wandAnnotation.x is not None):
-            # Wand annotation is active
-            mask = np.zeros( (npi.shape[0]+2, npi.shape[1]+2), dtype=np.uint8)
-            seed_point = self.ui.wandAnnotation.seed_point()
-            seedPoint_screen = self.slideToScreen(seed_point)
-            flags = 4 | 255 << 8   # bit shift
-            flags |= cv2.FLOODFILL_FIXED_RANGE | cv2.FLOODFILL_MASK_ONLY
-            flood_image = self.rawImage[...,0:3].copy()
-            tol = (int(self.ui.wandAnnotation.tolerance),)*3
-            try:
-                cv2.floodFill(image=flood_image, mask=mask, seedPoint=seedPoint_screen, newVal=(1,1,1),
-                        loDiff=tol, upDiff=tol, flags=flags)
-                self.ui.wandAnnotation.mask = 255-mask
-                polygons = cv2.findContours(self.ui.wandAnnotation.mask, cv2.RETR_LIST,
-                                            cv2.CHAIN_APPROX_SIMPLE)
-                polygons = polygons[0]
-
-                lenpoly = [len(x) for x in polygons]
-                polygon = polygons[np.argmax(lenpoly)]
-                cv2.polylines(npi, [polygon], True, [255,255,255])
-
-                npi[mask[1:-1,1:-1]!=0,0:3] = 255 - npi[mask[1:-1,1:-1]!=0,0:3]
-            except Exception as e:
-                print('Floodfill did not work!',str(e))
-
-        if (self.ui.wandAnnotation.polygon is not None):
-            npi = self.showPolygon(npi, self.ui.wandAnnotation.polygon, color=[0,0,0,255])
-
+        # Annotations are drawn into a separate layer, which is only redrawn when they or the viewport changed
+        self.compositor.annotationLayer(npi.shape, self.annotationLayerKey(), self.drawAnnotations)
+        npi = self.compositor.composeAnnotations(npi)
 
         # Copy displayed image
         self.displayedImage = npi
@@ -1975,8 +2073,121 @@ class SlideRunnerUI(QMainWindow):
             cv2.putText(npi, '%.2f' % self.overlayExtremes[1], (positionColorLegendX+colorLegendWidth+10, positionColorLegendY+5),cv2.FONT_HERSHEY_PLAIN , 0.7,(0,0,0),1,cv2.LINE_AA)
             cv2.putText(npi, '%.2f' % self.overlayExtremes[0], (positionColorLegendX+colorLegendWidth+10, positionColorLegendY+colorLegendHeight),cv2.FONT_HERSHEY_PLAIN , 0.7,(0,0,0),1,cv2.LINE_AA)
 
-        # Display image in GUI
-        self.ui.MainImage.setPixmap(QPixmap.fromImage(self.toQImage(self.displayedImage)))
+        # Display image in GUI, with the interactive layer on top
+        self.compositor.setComposed(self.displayedImage)
+        self.showInteractiveLayer()
+        self.writeDebug('Frame %d: %.1f MB copied' % (id, self.compositor.resetStatistics()/1E6))
+
+    def annotationLayerKey(self) -> tuple:
+        """
+            everything the annotation layer depends on. The layer is redrawn only if this changes.
+        """
+        classes = tuple([(plugin, label, entry['Active']) for plugin in self.annotationClasses for label,entry in self.annotationClasses[plugin].items()])
+        pluginAnnos = tuple([(plugin, len(annos)) for plugin,annos in self.pluginAnnos.items()])
+        vp = self.currentVP
+        return (tuple(np.asarray(self.region[0]).tolist()), tuple(np.asarray(self.region[1]).tolist()), self.getZoomValue(),
+                self.db.isOpen(), self.db.densityVersion, self.selectedAnno, self.selectedPluginAnno,
+                classes, self.pluginAnnosVersion, pluginAnnos, tuple(self.activePlugins.activePlugins.keys()), self.annotationLODDownsample,
+                vp.blindMode, vp.annotator, vp.majorityClassVote, vp.spotCircleRadius, self.viewingProfileVersion)
+
+    def drawAnnotations(self, npi):
+        """
+            draws the annotations of the database and of all active plugins into the annotation layer
+        """
+        # Draw annotations by the plugin
+        for plugin in self.activePlugins.activePlugins.values():
+            labels = plugin.instance.getAnnotationLabels()
+            pluginAnnos = self.pluginAnnos[plugin.shortName]
+            if (len(pluginAnnos)>0) and (plugin.shortName in self.annotationClasses):
+                if (self.annotationLODDownsample>0) and (self.getZoomValue()>=self.annotationLODDownsample):
+                    activeLabels = [uid for uid in self.annotationClasses[plugin.shortName] if self.annotationClasses[plugin.shortName][uid]['Active']]
+                    pluginAnnos.densityMap().render(npi, self.region[0], self.region[0]+self.region[1], 
+                                                    colors={label.uid:label.color for label in labels}, activeClasses=activeLabels)
+                    continue
+                for idx in pluginAnnos.visibleIndices(leftUpper=self.region[0], rightLower=self.region[0]+self.region[1]):
+                    anno = pluginAnnos[idx]
+                    if (anno.pluginAnnotationLabel is None) or (anno.pluginAnnotationLabel.uid in self.annotationClasses[plugin.shortName]):
+                        if (self.annotationClasses[plugin.shortName][anno.pluginAnnotationLabel.uid]['Active']):
+                            anno.draw(image=npi, leftUpper=self.region[0], 
+                                    zoomLevel=self.getZoomValue(), thickness=2, vp=self.currentPluginVP,
+                                    selected=(self.selectedPluginAnno==anno.uid))
+
+
+        # Overlay Annotations by the user
+        if (self.db.isOpen()):
+            self.db.annotateImage(npi, self.region[0], self.region[0]+self.region[1], self.getZoomValue(), self.currentVP, self.selectedAnno, annotationClasses=self.annotationClasses[0],
+                                 lodDownsample=self.annotationLODDownsample)
+
+    def drawInteractiveLayer(self, npi) -> tuple:
+        """
+            draws the polygon in progress and the wand annotation, returns the rectangle drawn into
+        """
+        damage = list()
+        # Show the current polygon (if in polygon annotation mode)
+        if (self.db.isOpen()) & (self.ui.mode==UIMainMode.MODE_ANNOTATE_POLYGON) & (self.ui.annotationMode>0):
+            npi = self.showPolygon(npi, self.ui.annotationsList, color=[0,0,0,255])
+            damage += [boundingRect([self.slideToScreen(pt) for pt in self.ui.annotationsList], margin=8)]
+
+        if (self.ui.wandAnnotation.x is not None):
+            # Wand annotation is active
+            mask = np.zeros( (npi.shape[0]+2, npi.shape[1]+2), dtype=np.uint8)
+            seed_point = self.ui.wandAnnotation.seed_point()
+            seedPoint_screen = self.slideToScreen(seed_point)
+            flags = 4 | 255 << 8   # bit shift
+            flags |= cv2.FLOODFILL_FIXED_RANGE | cv2.FLOODFILL_MASK_ONLY
+            flood_image = self.rawImage[...,0:3].copy()
+            tol = (int(self.ui.wandAnnotation.tolerance),)*3
+            try:
+                cv2.floodFill(image=flood_image, mask=mask, seedPoint=seedPoint_screen, newVal=(1,1,1),
+                        loDiff=tol, upDiff=tol, flags=flags)
+                self.ui.wandAnnotation.mask = 255-mask
+                polygons = cv2.findContours(self.ui.wandAnnotation.mask, cv2.RETR_LIST,
+                                            cv2.CHAIN_APPROX_SIMPLE)
+                polygons = polygons[0]
+
+                lenpoly = [len(x) for x in polygons]
+                polygon = polygons[np.argmax(lenpoly)]
+                cv2.polylines(npi, [polygon], True, [255,255,255])
+
+                npi[mask[1:-1,1:-1]!=0,0:3] = 255 - npi[mask[1:-1,1:-1]!=0,0:3]
+                damage += [(0, 0, npi.shape[1], npi.shape[0])] # outline of the inverted mask may touch the border
+            except Exception as e:
+                print('Floodfill did not work!',str(e))
+
+        if (self.ui.wandAnnotation.polygon is not None):
+            npi = self.showPolygon(npi, self.ui.wandAnnotation.polygon, color=[0,0,0,255])
+            damage += [boundingRect([self.slideToScreen(pt) for pt in self.ui.wandAnnotation.polygon], margin=8)]
+
+        damage = [rect for rect in damage if rect is not None]
+        if (len(damage)==0):
+            return None
+        return boundingRect(np.reshape(damage, (-1,2)))
+
+    def interactiveLayerActive(self) -> bool:
+        return (((self.ui.mode==UIMainMode.MODE_ANNOTATE_POLYGON) and (self.ui.annotationMode>0)) or 
+                (self.ui.wandAnnotation.x is not None) or (self.ui.wandAnnotation.polygon is not None))
+
+    def showInteractiveLayer(self, draw=None):
+        """
+            redraws only the interactive layer of the displayed image (e.g. a rubber band, given as draw function)
+        """
+        if (draw is None) and not (self.interactiveLayerActive()):
+            # nothing to draw on top: show the composed image itself
+            if (self.compositor.composed is not None):
+                self.displayFrame(self.compositor.composed)
+            return
+        frame = self.compositor.drawInteractive(self.drawInteractiveLayer if draw is None else draw)
+        if (frame is not None):
+            self.displayFrame(frame)
+
+    def displayFrame(self, frame:np.ndarray):
+        """
+            displays an RGBA frame in the main image. Converting it to a pixmap is the only copy.
+        """
+        self.compositor.bytesCopied += frame.nbytes
+        self.ui.MainImage.setPixmap(QPixmap.fromImage(self.toQImage(frame)))
+        if (self.imageOpened):
+            profile.mark('first frame painted')
 
     def toggleOneClass(self, row):
         if (self.db.isOpen()==False):
@@ -2032,6 +2243,7 @@ class SlideRunnerUI(QMainWindow):
 
         self.pluginItemsSelected=items
         self.currentPluginVP.activeClasses = items
+        self.viewingProfileVersion += 1
         self.showImage()
 
 
@@ -2053,7 +2265,8 @@ class SlideRunnerUI(QMainWindow):
             if (filename is None):
                 filename = SLIDE_DIRNAME + os.sep + 'Slides.sqlite'
                 self.settings.setValue('DefaultDatabase', filename)
-        success = self.db.open(filename)
+        with profile.phase('database open'):
+            success = self.db.open(filename)
         
         if not success:
             reply = QtWidgets.QMessageBox.information(self, 'Message',
@@ -2180,7 +2393,7 @@ class SlideRunnerUI(QMainWindow):
 
     def closeDatabase(self):
         self.ui.action_CloseDB.setEnabled(False)
-        self.db = Database()
+        self.db = SpatialDatabase()
         try:
             self.ui.annotatorComboBox.currentIndexChanged.disconnect()
         except:
@@ -2291,45 +2504,39 @@ class SlideRunnerUI(QMainWindow):
     def threadedExportAndSync(self, exm, imageset_id, product_id, slidesToSync:list=[], **kwargs):
         try:
             self.setProgressBar(0)
-            newDB = Database().open(self.db.dbfilename)
-            for cnt, (slideid, filename, pathname) in enumerate(slidesToSync):
-                newDB.loadIntoMemory(slideid)
-                slidepathname=pathname+os.sep+filename
-                exm.set_progress_properties(denominator=len(slidesToSync), offset=float(cnt)/len(slidesToSync))
-                obj = exm.upload_image_to_imageset(imageset_id=imageset_id, filename=slidepathname)
-
-                image_id = obj[0].id
-                exact_id = f'{image_id}/{product_id}/{imageset_id}'
-                newDB.execute(f'UPDATE Slides set exactImageID="{exact_id}" where uid=={slideid}')
-                exm.sync(dataset_id=image_id, imageset_id=imageset_id, product_id=product_id, slideuid=slideid, database=newDB)
-            self.progressBarQueue.put((SlideRunnerPlugin.StatusInformation.POPUP_MESSAGEBOX,'Slide(s) exported successfully.'))
+            scheduler = ExactSyncScheduler(exm, self.db.dbfilename, statusqueue=self.progressBarQueue)
+            failed = scheduler.export(imageset_id, product_id, slidesToSync)
+            filenames = {slideid:filename for slideid, filename, pathname in slidesToSync}
+            if len(failed)>0:
+                self.progressBarQueue.put((SlideRunnerPlugin.StatusInformation.POPUP_MESSAGEBOX,'Unable to export slide(s): '+', '.join([f'{filenames[uid]} ({str(e)})' for uid, e in failed])))
+            else:
+                self.progressBarQueue.put((SlideRunnerPlugin.StatusInformation.POPUP_MESSAGEBOX,'Slide(s) exported successfully.'))
             self.progressBarQueue.put((SlideRunnerPlugin.StatusInformation.REFRESH_VIEW,None))
             self.progressBarQueue.put((SlideRunnerPlugin.StatusInformation.REFRESH_DATABASE,None))
         except Exception as e:
                 self.progressBarQueue.put((SlideRunnerPlugin.StatusInformation.POPUP_MESSAGEBOX,'Unable to proceed: '+str(e)))
                 raise(e)
                 return
-        exm.terminate()
+        finally:
+            exm.terminate()
         
     def threadedSync(self, exm, allSlides,  **kwargs):
         try:
-            for cnt, (slideid, exact_id) in enumerate(allSlides):
-                print('Syncing ',slideid,exact_id)
-                image_id,product_id,imageset_id = [int(x) for x in exact_id.split('/')]
-                newDB = Database().open(self.db.dbfilename)
-                newDB.loadIntoMemory(slideid)
-                exm.set_progress_properties(denominator=len(allSlides), offset=float(cnt)/len(allSlides))
-                exm.sync(dataset_id=image_id, imageset_id=imageset_id, product_id=product_id, slideuid=slideid, database=newDB)
+            scheduler = ExactSyncScheduler(exm, self.db.dbfilename, statusqueue=self.progressBarQueue)
+            failed = scheduler.sync(allSlides)
             self.progressBarQueue.put((SlideRunnerPlugin.StatusInformation.REFRESH_VIEW,None))
-            self.progressBarQueue.put((SlideRunnerPlugin.StatusInformation.POPUP_MESSAGEBOX,'Sync completed.'))
+            if len(failed)>0:
+                self.progressBarQueue.put((SlideRunnerPlugin.StatusInformation.POPUP_MESSAGEBOX,'Sync failed for slide(s): '+', '.join([f'{uid} ({str(e)})' for uid, e in failed])))
+            else:
+                self.progressBarQueue.put((SlideRunnerPlugin.StatusInformation.POPUP_MESSAGEBOX,'Sync completed.'))
             self.progressBarQueue.put((SlideRunnerPlugin.StatusInformation.REFRESH_DATABASE,None))
 
         except Exception as e:
             self.progressBarQueue.put((SlideRunnerPlugin.StatusInformation.POPUP_MESSAGEBOX,'Unable to proceed: '+str(e)))
             raise(e)
             return
-
-        exm.terminate()
+        finally:
+            exm.terminate()
         
 
     def syncWithExact(self, allSlides:bool=False):
@@ -2571,6 +2778,7 @@ class SlideRunnerUI(QMainWindow):
 
             self.db.updateViewingProfile(self.currentVP)
             self.db.updateViewingProfile(self.currentPluginVP)
+            self.viewingProfileVersion += 1
 
         self.ui.inspectorTableView.setVisible(True)
         self.ui.annotationTypeTableView.setVisible(True)
@@ -2692,6 +2900,7 @@ class SlideRunnerUI(QMainWindow):
 
         if (self.activePlugin is not None):
             self.currentPluginVP.activeClasses = self.pluginItemsSelected
+            self.viewingProfileVersion += 1
 
         self.ui.annotationTypeTableView.verticalHeader().setVisible(False)
         vheader = self.ui.annotationTypeTableView.verticalHeader()
@@ -2857,15 +3066,12 @@ class SlideRunnerUI(QMainWindow):
 
         try:
             print('Opening ',filename)
-            self.slide = RotatableOpenSlide(filename, rotate=self.rotateImage)
+            with profile.phase('slide open'):
+                self.slide = RotatableOpenSlide(filename, rotate=self.rotateImage)
         except Exception as e:
             self.show_exception("Unable to open"+filename, *sys.exc_info())
             return
 
-        # Clear cache
-        self.cachedLocation = None
-        self.cachedLevel = None
-
         self.ui.frameSlider.valueChanged.disconnect()
         self.ui.frameSlider.setNumberOfFrames(self.slide.numberOfFrames)
         self.ui.frameSlider.setFPS(self.slide.fps)
@@ -2955,6 +3161,9 @@ def main(slideReaderThread,app,splash,version,pluginList):
 
     myapp.show()
     myapp.raise_()
+    profile.mark('main window shown')
+    # startup is complete with the first frame of the slide given on the command line
+    profile.finishWhen(['main window shown'] + (['first frame painted'] if myapp.imageOpened else []))
     sys.excepthook = myapp.exceptionHook
     threading.excepthook = myapp.exceptionHook_threading
     splash.finish(myapp)
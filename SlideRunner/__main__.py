@@ -1,10 +1,18 @@
-import rollbar
-import multiprocessing
-from SlideRunner_dataAccess.slide import SlideReader
-import PyQt6
-from PyQt6 import QtWidgets
-from SlideRunner.gui import splashScreen
 import sys
+from SlideRunner.general.startupProfile import profile
+
+# --profile-startup[=filename.json]: record and report a timeline of the startup
+for arg in [arg for arg in sys.argv[1:] if arg.split('=')[0]=='--profile-startup']:
+    sys.argv.remove(arg)
+    profile.enable(*arg.split('=',1)[1:])
+
+with profile.phase('imports'):
+    import rollbar
+    import multiprocessing
+    from SlideRunner.processing.tiledreader import TiledSlideReader
+    import PyQt6
+    from PyQt6 import QtWidgets
+    from SlideRunner.gui import splashScreen
 
 version = '2.2.0'
 
@@ -13,14 +21,16 @@ def main():
     try:
         multiprocessing.freeze_support()
         multiprocessing.set_start_method('spawn')
-        slideReaderThread = SlideReader()
+        slideReaderThread = TiledSlideReader()
         slideReaderThread.start()
-        app = QtWidgets.QApplication(sys.argv)
-        splash = splashScreen.splashScreen(app, version)
-        import SlideRunner.general.pluginFinder
-        pluginList = SlideRunner.general.pluginFinder.pluginList
-        from SlideRunner import SlideRunner
-        SlideRunner.main(slideReaderThread=slideReaderThread, app=app, splash=splash, 
+        with profile.phase('splash screen'):
+            app = QtWidgets.QApplication(sys.argv)
+            splash = splashScreen.splashScreen(app, version)
+        with profile.phase('imports'):
+            from SlideRunner import SlideRunner
+        with profile.phase('plugin discovery'):
+            from SlideRunner.general.pluginFinder import pluginList
+        SlideRunner.main(slideReaderThread=slideReaderThread, app=app, splash=splash,
                          version=version, pluginList=pluginList)
 
     except Exception as e:
@@ -7,9 +7,16 @@ import time
 import datetime
 import re
 import sys
+import os
+import hashlib
+import mimetypes
 from functools import partial
+from contextlib import contextmanager
 import threading
 import queue
+from concurrent.futures import ThreadPoolExecutor
+import urllib3
+import dateutil.parser
 from requests_toolbelt.multipart import encoder
 
 from exact_sync.v1.api.annotations_api import AnnotationsApi
@@ -21,7 +28,7 @@ from exact_sync.v1.api.teams_api import TeamsApi
 from exact_sync.v1.api.users_api import UsersApi
 
 from exact_sync.v1.models import ImageSet, Team, Product, AnnotationType as ExactAnnotationType, Image, Annotation, AnnotationMediaFile
-from exact_sync.v1.rest import ApiException
+from exact_sync.v1.rest import ApiException, RESTResponse
 from exact_sync.v1.configuration import Configuration
 from exact_sync.v1.api_client import ApiClient
 
@@ -75,6 +82,101 @@ def get_filename_from_cd(cd):
     return fname[0]
 
 
+def parse_timestamp(isotime:str) -> float:
+    """
+        unix time of an ISO 8601 time stamp, as parsed by the API client (dateutil), but faster for the common formats
+    """
+    try:
+        return datetime.datetime.fromisoformat(isotime).timestamp()
+    except ValueError:
+        return dateutil.parser.parse(isotime).timestamp()
+
+def notProcessed(error:Exception) -> bool:
+    """
+        True if a failed request can not have been processed by the server: rate limited (429),
+        not sent (status 0) or no connection.
+    """
+    if isinstance(error, ApiException):
+        return error.status in (0, 429)
+    if isinstance(error, urllib3.exceptions.MaxRetryError):
+        error = error.reason
+    return isinstance(error, urllib3.exceptions.ConnectTimeoutError) # includes NewConnectionError
+
+def group_by_uuid(annos:list) -> dict:
+    """
+        Groups remote annotations (all versions of an annotation) by their unique identifier, in one pass
+    """
+    annodict = dict()
+    for anno in annos:
+        annodict.setdefault(anno.unique_identifier, []).append(anno)
+    return annodict
+
+@contextmanager
+def transaction(database:Database):
+    """
+        Collects the commits of all database operations within into a single commit. If an exception
+        is raised within, all of them are rolled back (and the annotations in memory are reloaded).
+    """
+    database.commit = lambda: None # instance attribute shadows Database.commit
+    try:
+        yield
+    except BaseException:
+        del database.commit
+        database.db.rollback()
+        if (getattr(database, 'annotationsSlide', None) is not None):
+            database.loadIntoMemory(database.annotationsSlide, zLevel=None)
+        raise
+    del database.commit
+    database.commit()
+
+# watermarks of the last complete sync of a slide with an EXACT image:
+# most recent remote last_edit_time seen (unix time, informational only: edit times are set by the
+# clients, so remote changes are found per uuid) and local time the sync started
+SYNC_TABLE = 'CREATE TABLE IF NOT EXISTS ExactSync (slide INTEGER PRIMARY KEY, image INTEGER, remoteWatermark REAL, localWatermark REAL)'
+
+def get_sync_watermark(database:Database, slideuid:int, image_id:int):
+    """
+        (remote, local) watermark of the last complete sync of the slide with the image, or None
+    """
+    database.execute(SYNC_TABLE)
+    return database.execute(f'SELECT remoteWatermark, localWatermark FROM ExactSync WHERE slide=={slideuid} AND image=={image_id}').fetchone()
+
+def set_sync_watermark(database:Database, slideuid:int, image_id:int, remote:float, local:float):
+    database.execute(SYNC_TABLE)
+    database.execute(f'INSERT OR REPLACE INTO ExactSync (slide, image, remoteWatermark, localWatermark) VALUES ({slideuid},{image_id},{remote},{local})')
+    database.commit()
+
+# images uploaded to EXACT, by SHA-256 of the file and image set
+UPLOAD_TABLE = 'CREATE TABLE IF NOT EXISTS ExactUploads (checksum TEXT, imageset INTEGER, image INTEGER, PRIMARY KEY (checksum, imageset))'
+
+def file_checksum(filename:str, blocksize:int=8*1024*1024) -> str:
+    """
+        SHA-256 (hex) of a file, read block by block into one buffer
+    """
+    checksum = hashlib.sha256()
+    block = bytearray(blocksize)
+    view = memoryview(block)
+    with open(filename, 'rb') as f:
+        length = f.readinto(block)
+        while (length>0):
+            checksum.update(view[0:length])
+            length = f.readinto(block)
+    return checksum.hexdigest()
+
+def get_uploaded_image(database:Database, checksum:str, imageset_id:int):
+    """
+        id of the image the file with the checksum was uploaded to the image set as, or None
+    """
+    database.execute(UPLOAD_TABLE)
+    image = database.execute(f'SELECT image FROM ExactUploads WHERE checksum=="{checksum}" AND imageset=={imageset_id}').fetchone()
+    return image[0] if image is not None else None
+
+def set_uploaded_image(database:Database, checksum:str, imageset_id:int, image_id:int):
+    database.execute(UPLOAD_TABLE)
+    database.execute(f'INSERT OR REPLACE INTO ExactUploads (checksum, imageset, image) VALUES ("{checksum}",{imageset_id},{image_id})')
+    database.commit()
+
+
 class ExactImageList():
     def __init__(self, imagelist):
         self._list = imagelist
@@ -108,34 +210,122 @@ class ExactManager():
 
     def progress(self, value:float, callback:callable=None):
         value=value/self.progress_denominator+self.offset
-        if (self.statusqueue is not None):
-            self.statusqueue.put((0, value*100 if value<1 else -1))
         if (callback is not None):
-            callback(value*100)
+            callback(value*100) # takes over progress reporting, e.g. ExactSyncScheduler merging several slides
+        elif (self.statusqueue is not None):
+            self.statusqueue.put((0, value*100 if value<1 else -1))
 
     def set_progress_properties(self, denominator:float, offset:float):
         self.progress_denominator=float(denominator)
         self.offset=float(offset)
 
-    def upload_image_to_imageset(self, imageset_id:int, filename:str):
-        apic = self.APIs.images_api.create_image(file_path=filename, image_type=0, image_set=imageset_id)
-        pass
-        return apic.results
+    def upload_image_to_imageset(self, imageset_id:int, filename:str, database:Database=None, callback:callable=None) -> list:
+        """
+            Uploads an image file to an image set (retried, see request). If a database is given, files uploaded
+            before are recognized by their SHA-256 and not uploaded again, if the image still exists in the image set.
+        """
+        if (database is not None):
+            checksum = file_checksum(filename)
+            image_id = get_uploaded_image(database, checksum, imageset_id)
+            if (image_id is not None):
+                try:
+                    image = self.request(partial(self.APIs.images_api.retrieve_image, image_id))
+                    if (image.image_set==imageset_id):
+                        self.log(1, f'{filename} has been uploaded before as image {image_id}')
+                        self.progress(1, callback=callback)
+                        return [image]
+                except ApiException as e:
+                    if (e.status!=404):
+                        raise
+        name = os.path.basename(filename)
+        imageset = self.request(partial(self.APIs.image_sets_api.retrieve_image_set, imageset_id, expand='images'))
+        known = [image['id'] for image in imageset.images if image['name']==name]
+
+        def recover():
+            # the image of the upload, if the server received it (but the reply was lost)
+            imageset = self.request(partial(self.APIs.image_sets_api.retrieve_image_set, imageset_id, expand='images'))
+            created = [image['id'] for image in imageset.images if (image['name']==name) and (image['id'] not in known)]
+            return [self.request(partial(self.APIs.images_api.retrieve_image, created[0]))] if len(created)>0 else None
+
+        images = self.request(partial(self.upload_file, imageset_id, filename, callback=callback), recover=recover)
+        if (database is not None):
+            set_uploaded_image(database, checksum, imageset_id, images[0].id)
+        return images
+
+    def upload_file(self, imageset_id:int, filename:str, callback:callable=None) -> list:
+        """
+            Uploads an image file to an image set in one request, streamed from the file through upload_monitor.
+            Unlike ImagesApi.create_image, the connection pool of the client is used and failed uploads raise
+            an ApiException (and are thus retried by request).
+        """
+        name = os.path.basename(filename)
+        with open(filename, 'rb') as f:
+            body = encoder.MultipartEncoder({'image_type' : '0', 'image_set' : str(imageset_id),
+                                             'file_path' : (name, f, mimetypes.guess_type(name)[0] or 'application/octet-stream')})
+            monitor = encoder.MultipartEncoderMonitor(body, partial(self.upload_monitor, callback=callback))
+            monitor.name = name
+            monitor.started = monitor.reported = time.time()
+            headers = {'Content-Type' : monitor.content_type, 'Content-Length' : str(monitor.len), 'Accept' : 'application/json',
+                       'Authorization' : self.configuration.get_basic_auth_token()}
+            response = self.client.rest_client.pool_manager.request('POST', self.configuration.host+'/api/v1/images/images/',
+                                                                    body=monitor, headers=headers, retries=False)
+        if not (200 <= response.status < 300):
+            raise ApiException(status=response.status, reason=response.reason)
+        return self.client.deserialize(RESTResponse(response), 'Images').results
+
+    def request(self, job:callable, recover:callable=None):
+        """
+            Performs a request (a callable of the EXACT API). Connection errors, server errors (5xx)
+            and rate limiting (429) are retried up to self.retries times with exponential backoff.
+            At most self.num_threads requests of all threads using this manager are in flight.
+
+            Requests creating an object are given recover, which returns the object if it has been
+            created (or None). They are sent again right away only if they can not have been processed
+            (429, connection failed). Otherwise, the server may have created the object and only the
+            reply was lost, so recover() is asked first and the request is only sent again if it
+            returns None.
+        """
+        for attempt in range(self.retries+1):
+            try:
+                with self.requestSlots:
+                    return job()
+            except ApiException as e:
+                if (e.status not in (0, 429)) and not (e.status>=500) or (attempt==self.retries):
+                    raise
+                error = e
+            except urllib3.exceptions.HTTPError as e:
+                if (attempt==self.retries):
+                    raise
+                error = e
+            delay = self.backoff*2**attempt
+            self.log(1, f'Request failed ({str(error).strip()}), retrying in {delay:.1f} s')
+            time.sleep(delay)
+            if (recover is not None) and not (notProcessed(error)):
+                created = recover()
+                if (created is not None):
+                    self.log(1, 'Request has been processed before, not sent again')
+                    return created
 
     def queueWorker(self):
         while (True):
             status, newjob, context = self.jobqueue.get()
             if (status==-1):
                 break
-            ret = newjob()
-            self.resultQueue.put((ret, context))
+            try:
+                ret = self.request(newjob, recover=context.get('recover'))
+            except Exception as e:
+                ret = e # handed to the consumer of the replies, the worker keeps running
+            context.get('replies', self.resultQueue).put((ret, context))
 
-    def __init__(self, username:str=None, password:str=None, serverurl:str=None, logfile=sys.stdout, loglevel:int=1, statusqueue:queue.Queue=None):
+    def __init__(self, username:str=None, password:str=None, serverurl:str=None, logfile=sys.stdout, loglevel:int=1, statusqueue:queue.Queue=None,
+                 num_threads:int=10, max_in_flight:int=50, retries:int=3, backoff:float=0.5, writeback_batch:int=500, page_size:int=1000):
 
         configuration = Configuration()
         configuration.username = username
         configuration.password = password
         configuration.host = serverurl
+        # one keep-alive connection per request in flight
+        configuration.connection_pool_maxsize = max(configuration.connection_pool_maxsize, num_threads)
 
         self.client = ApiClient(configuration=configuration)
         self.APIs = ExactAPIs(self.client)
@@ -145,7 +335,14 @@ class ExactManager():
         self.progress_offset = 0
         self.set_progress_properties(1,0)
         self.multi_threaded=True
-        self.num_threads=10
+        self.num_threads=num_threads
+        self.max_in_flight=max_in_flight # create/update requests queued or running at any time during sync
+        self.retries=retries
+        self.backoff=backoff
+        self.writeback_batch=writeback_batch # exact_ids of created annotations stored per transaction
+        self.page_size=page_size # remote annotations per request and annotation uuids imported per transaction
+        self.requestSlots = threading.BoundedSemaphore(num_threads)
+        self.annotationTypeLock = threading.RLock() # concurrent syncs must not create the same annotation type twice
         if (self.multi_threaded):
             self.jobqueue = queue.Queue()
             self.resultQueue = queue.Queue()
@@ -172,11 +369,76 @@ class ExactManager():
             self.jobqueue.put((-1,0,0))
 
 
-    def upload_monitor(self, monitor:encoder.MultipartEncoderMonitor):
-        self.progress(float(monitor.bytes_read)/monitor.len)
+    def upload_monitor(self, monitor:encoder.MultipartEncoderMonitor, callback:callable=None):
+        now = time.time()
+        if (now-monitor.reported<1) and (monitor.bytes_read<monitor.len):
+            return
+        monitor.reported = now
+        self.progress(float(monitor.bytes_read)/monitor.len, callback=callback)
+        self.log(2, f'Uploading {monitor.name}: {monitor.bytes_read/2**20:.0f} of {monitor.len/2**20:.0f} MB ({monitor.bytes_read/2**20/max(now-monitor.started, 1e-3):.1f} MB/s)')
+
+
+    def list_annotations(self, dataset_id:int, expand:str='annotation_type,last_editor', uuids:list=None) -> list:
+        """
+            Retrieves all annotations of an image, or only those with the given uuids (50 uuids per
+            request), page by page (self.page_size per request).
+        """
+        filters = [dict()] if (uuids is None) else [{'unique_identifier__in' : ','.join(uuids[k:k+50])} for k in range(0, len(uuids), 50)]
+        annos = list()
+        for filt in filters:
+            offset = 0
+            while (True):
+                page = self.request(partial(self.APIs.annotations_api.list_annotations, image=dataset_id, expand=expand, limit=self.page_size, offset=offset, **filt))
+                annos += page.results
+                offset += len(page.results)
+                if (page.next is None) or (len(page.results)==0):
+                    break
+        return annos
+
+    def find_annotation(self, dataset_id:int, annotation:Annotation) -> Annotation:
+        """
+            The remote annotation with the uuid and annotation type of annotation, or None.
+        """
+        found = [anno for anno in self.list_annotations(dataset_id, expand='', uuids=[annotation.unique_identifier])
+                 if anno.annotation_type==annotation.annotation_type]
+        return found[0] if len(found)>0 else None
+
+    def list_annotation_edits(self, dataset_id:int) -> dict:
+        """
+            Most recent edit time (unix time) per annotation uuid of an image. Only uuid and edit time
+            of the annotations are transferred.
+        """
+        edits = dict()
+        offset = 0
+        while (True):
+            response = self.request(partial(self.APIs.annotations_api.list_annotations, image=dataset_id, fields='unique_identifier,last_edit_time',
+                                            limit=self.page_size, offset=offset, _preload_content=False))
+            page = json.loads(response.data)
+            for anno in page['results']:
+                edit = parse_timestamp(anno['last_edit_time']) if (anno['last_edit_time'] is not None) else 0
+                edits[anno['unique_identifier']] = max(edit, edits.get(anno['unique_identifier'], edit))
+            offset += len(page['results'])
+            if (page['next'] is None) or (len(page['results'])==0):
+                return edits
+
+    def _retrieve_and_insert(self, dataset_id:int, slideuid:int, database:Database,  callback:callable=None, uuids:list=None, **kwargs ):
 
+        self.progress(0, callback=callback)
+        if (slideuid is None):
+            raise ExactProcessError('Slide not in database. Please add it first.')
+
+        annos = self.list_annotations(dataset_id, uuids=uuids)
+        self.log(0, f'Found {len(annos)} annotations for dataset {dataset_id}')
 
-    def _retrieve_and_insert(self, dataset_id:int, slideuid:int, database:Database,  callback:callable=None, **kwargs ):
+        self.import_annotations(annos, slideuid=slideuid, database=database, callback=callback, **kwargs)
+
+    def import_annotations(self, annos:list, slideuid:int, database:Database, callback:callable=None, **kwargs):
+        """
+            Inserts remote annotations into the local database or updates the local annotations.
+            Changes are committed in one transaction per self.page_size annotation uuids.
+        """
+        if (len(annos)==0):
+            return
 
         def createDatabaseObject():
             zLevel = anno.vector['frame']-1 if 'frame' in anno.vector else 0
@@ -199,138 +461,139 @@ class ExactManager():
                 raise NotImplementedError('Vector Type %d is unknown.' % vector_type)
             
             if (anno.deleted):
-                database.removeAnnotation(database.guids[uuid],onlyMarkDeleted=True)
+                database.removeAnnotation(annoId,onlyMarkDeleted=True)
             
             return annoId
 
-        self.progress(0, callback=callback)
-        annos = np.array(self.APIs.annotations_api.list_annotations(image=dataset_id, expand='annotation_type,last_editor', pagination=False).results)
-        #print('Annos: ',annos)
-        self.log(0, f'Found {len(annos)} annotations for dataset {dataset_id}')
-
         createClasses = True if 'createClasses' not in kwargs else kwargs['createClasses']
-        
-        if (slideuid is None):
-            raise ExactProcessError('Slide not in database. Please add it first.')
 
-        classes = {y:x for x,y,col,clckbl in database.getAllClasses()}
+        # one map of class and person names to database ids, extended by newly created entries
         classes_rev = {x:y for x,y,col,clckbl in database.getAllClasses()}
-        classes_col = {y:col for x,y,col,clckbl in database.getAllClasses()}
-
         persons = {x:y for x,y in database.getAllPersons()}
         
         exactPersonId, _ = database.getExactPerson()
         persons[self.configuration.username] = exactPersonId
 
+        # labels are looked up by annotation for every inserted label, which is a full table scan without an index
+        database.execute('CREATE INDEX IF NOT EXISTS Annotations_label_annoId ON Annotations_label (annoId)')
         database.loadIntoMemory(slideuid, zLevel=None)
 
         # reformat to dict according to uuid
-        uuids = np.array([anno.unique_identifier for anno in annos])
-
-        annodict = {uuid:annos[np.where(uuids==uuid)] for uuid in uuids}
+        annodict = group_by_uuid(annos)
+        uuids = list(annodict.keys())
         # TODO: resolve conflict if one guid has multiple shapes
 
-        for cntr, uuid in enumerate(uuids):
-            self.progress(float(cntr)*0.5/(len(uuids)+0.001), callback=callback)
-            le_array = [sanno.last_edit_time for sanno in annodict[uuid]]
-            lastedit = np.max(le_array) # maximum last_edit time is most recent for uuid
-
-
-            # TODO: expand this in the first place
-            for anno in annodict[uuid]:
-                class_name = anno.annotation_type['name']
-                person_name = anno.last_editor['username'] if anno.last_editor is not None and 'username' in anno.last_editor else 'unknown'
-                exact_id = anno.id
-
-                # check if annotator exists already, if not, create
-                if person_name not in persons.keys():
-                    database.insertAnnotator(person_name)
-                    self.log(1,f'Adding annotator {person_name} found in EXACT')
-                    persons = {x:y for x,y in database.getAllPersons()}
-                    persons[self.configuration.username] = exactPersonId
-                    
-
-                # check if class exists already in DB, if not, create
-                if (class_name not in classes.values()):
-                    if not createClasses:
-                        raise AccessViolationError('Not permitted to create new classes, but class %d not found' % anno.annotation_type['name'])
-                    else:
-                        database.insertClass(class_name)
-                        classes = {x:y for y,x,col,clckbl in database.getAllClasses()}
-                        classes_rev = {x:y for x,y,col,clckbl in database.getAllClasses()}
-                        classes_col = {y:col for x,y,col,clckbl in database.getAllClasses()}
-                
-                vector_type = anno.annotation_type['vector_type']
-                vlen = int(len(anno.vector)/2)
-                
-                #lastedit = datetime.datetime.strptime(anno['last_edit_time'], "%Y-%m-%dT%H:%M:%S.%f")
-
-                # reformat coords               
-#                coords = np.array(anno.vector).T.tolist()
-                coords = [[anno.vector['x%d' % (x+1)] for x in range(vlen)],[anno.vector['y%d' % (x+1)]for x in range(vlen)]]
-                coords = np.array(coords).T.tolist() # transpose
-
-                # TODO: The last edited object defines currently the coords --> this is a problem.
-
-                if (uuid not in database.guids.keys()) and (vlen>0):
-                    # Is new - woohay!
-                    annoId = createDatabaseObject()
-                    database.setGUID(annoid=annoId, guid=uuid)
-                    database.setLastModified(annoid=annoId, lastModified=lastedit.timestamp())
-                    self.log(1, f'Importing remote object with guid {uuid}, last edit: {lastedit.timestamp()}')
-                    
-                elif (vlen>0):
-#                    print('Object exists, last edit was: ',lastedit.timestamp(), database.annotations[database.guids[uuid]].lastModified)
-                    if (lastedit.timestamp()-EPS_TIME_CONVERSION>database.annotations[database.guids[uuid]].lastModified):
-                        self.log(1,f'Recreating local object with guid {uuid}, remote was more recent')
-                        database.removeAnnotation(database.guids[uuid],onlyMarkDeleted=False)
-                        createDatabaseObject()
-                        database.setGUID(annoid=annoId, guid=uuid)
-                        database.setLastModified(annoid=annoId, lastModified=lastedit.timestamp())
+        # the viewport lookup table is rebuilt once after the import instead of growing with each annotation
+        database.appendToMinMaxCoordsList = lambda anno: None
+        try:
+            for start in range(0, len(uuids), self.page_size):
+                self.progress(float(start)*0.5/(len(uuids)+0.001), callback=callback)
+                with transaction(database):
+                    for uuid in uuids[start:start+self.page_size]:
+                        lastedit = max([sanno.last_edit_time for sanno in annodict[uuid]]) # maximum last_edit time is most recent for uuid
+
+                        # TODO: expand this in the first place
+                        for anno in annodict[uuid]:
+                            class_name = anno.annotation_type['name']
+                            person_name = anno.last_editor['username'] if anno.last_editor is not None and 'username' in anno.last_editor else 'unknown'
+                            exact_id = anno.id
+
+                            # check if annotator exists already, if not, create
+                            if person_name not in persons:
+                                persons[person_name] = database.insertAnnotator(person_name)
+                                self.log(1,f'Adding annotator {person_name} found in EXACT')
+
+                            # check if class exists already in DB, if not, create
+                            if (class_name not in classes_rev):
+                                if not createClasses:
+                                    raise AccessViolationError('Not permitted to create new classes, but class %s not found' % class_name)
+                                else:
+                                    classes_rev[class_name] = database.insertClass(class_name)
                         
-                    elif abs(lastedit.timestamp()-database.annotations[database.guids[uuid]].lastModified)<EPS_TIME_CONVERSION:
-                        # equal time stamp --> maybe further annotation with same guid, let's check.
-#                        print('Time stamps difference: ', lastedit.timestamp()-database.annotations[database.guids[uuid]].lastModified)
-#                        print('Last edit (online): ',lastedit.timestamp())
-#                        print('Last modified (DB): ',database.annotations[database.guids[uuid]].lastModified)
-                        labels_exactids = [lab.exact_id for lab in database.annotations[database.guids[uuid]].labels]
-                        if anno.id not in labels_exactids: 
-                            # need to create in local DB
-                            database.addAnnotationLabel(classId=classes_rev[class_name], person=persons[person_name], annoId=database.guids[uuid], exact_id=anno.id)
-                            self.log(1,'Adding new local label for annotation uuid = ',uuid,classes_rev[class_name],persons[person_name])
-                    else:
-                        # remote is older --> but maybe a remote label is not yet known
-                        labels_exactids = [lab.exact_id for lab in database.annotations[database.guids[uuid]].labels]
-                        if anno.id not in labels_exactids: 
-                            # need to create in local DB
-                            database.addAnnotationLabel(classId=classes_rev[class_name], person=persons[person_name], annoId=database.guids[uuid], exact_id=anno.id)
-                            self.log(1,'Adding new label for annotation uuid = ',uuid,classes_rev[class_name],persons[person_name])
-        
+                            vector_type = anno.annotation_type['vector_type']
+                            vlen = int(len(anno.vector)/2)
+                        
+                            # reformat coords               
+                            coords = [[anno.vector['x%d' % (x+1)] for x in range(vlen)],[anno.vector['y%d' % (x+1)]for x in range(vlen)]]
+                            coords = np.array(coords).T.tolist() # transpose
+
+                            # TODO: The last edited object defines currently the coords --> this is a problem.
+
+                            if (uuid not in database.guids) and (vlen>0):
+                                # Is new - woohay!
+                                annoId = createDatabaseObject()
+                                database.setGUID(annoid=annoId, guid=uuid)
+                                database.setLastModified(annoid=annoId, lastModified=lastedit.timestamp())
+                                self.log(1, f'Importing remote object with guid {uuid}, last edit: {lastedit.timestamp()}')
+                            
+                            elif (vlen>0):
+                                if (lastedit.timestamp()-EPS_TIME_CONVERSION>database.annotations[database.guids[uuid]].lastModified):
+                                    self.log(1,f'Recreating local object with guid {uuid}, remote was more recent')
+                                    database.removeAnnotation(database.guids[uuid],onlyMarkDeleted=False)
+                                    annoId = createDatabaseObject()
+                                    database.setGUID(annoid=annoId, guid=uuid)
+                                    database.setLastModified(annoid=annoId, lastModified=lastedit.timestamp())
+                                
+                                else:
+                                    # equal time stamp --> maybe further annotation with same guid, let's check.
+                                    # remote is older --> but maybe a remote label is not yet known
+                                    labels_exactids = [lab.exact_id for lab in database.annotations[database.guids[uuid]].labels]
+                                    if anno.id not in labels_exactids: 
+                                        # need to create in local DB
+                                        database.addAnnotationLabel(classId=classes_rev[class_name], person=persons[person_name], annoId=database.guids[uuid], exact_id=anno.id)
+                                        self.log(1,'Adding new label for annotation uuid = ',uuid,classes_rev[class_name],persons[person_name])
+        finally:
+            del database.appendToMinMaxCoordsList
+            database.generateMinMaxCoordsList()
+
 
     def retrieve_imagesets(self):
         imagesets = self.APIs.image_sets_api.list_image_sets(pagination=False, expand='product_set').results
         return imagesets
 
-    def sync(self, dataset_id:int,imageset_id:int, product_id:int, slideuid:int, database:Database, image_id:str=None, callback:callable=None, **kwargs ):
+    def sync(self, dataset_id:int,imageset_id:int, product_id:int, slideuid:int, database:Database, image_id:str=None, callback:callable=None, incremental:bool=True, dropTriggers:bool=True, **kwargs ):
+        """
+            Synchronizes the annotations of a slide with an EXACT image in both directions. If incremental,
+            only remote annotations unknown locally or more recent than the local version are retrieved and only local
+            annotations changed since then (Annotations.lastModified, kept by the database triggers) are sent.
+            The triggers are dropped while syncing, unless dropTriggers is False (i.e. the caller does so).
+        """
 
         annotypedict = dict()
         mergeLocalClasses=dict()
 
-        database.deleteTriggers()
-
-        self._retrieve_and_insert(dataset_id=dataset_id, slideuid=slideuid, database=database, callback=callback)
+        watermark = get_sync_watermark(database, slideuid, dataset_id) if incremental else None
+        syncStart = time.time()
+        remoteEdits = self.list_annotation_edits(dataset_id)
+        if (watermark is not None):
+            localEdits = {guid : (edit or 0) for guid, edit in database.execute(f'SELECT guid, lastModified FROM Annotations WHERE slide=={slideuid}').fetchall()}
+            # remote annotations unknown locally or more recent than the local version. The edit times are set
+            # by the clients, thus an annotation edited before the last sync may have been pushed since then.
+            changedRemote = [uuid for uuid, edit in remoteEdits.items() if (uuid not in localEdits) or (edit > localEdits[uuid]+EPS_TIME_CONVERSION)]
+            changedLocal = len([edit for edit in localEdits.values() if edit > watermark[1]])
+            self.log(0, f'Since last sync: {len(changedRemote)} remote and {changedLocal} local annotations changed')
+            if (len(changedRemote)==0) and (changedLocal==0):
+                set_sync_watermark(database, slideuid, dataset_id, watermark[0], syncStart)
+                self.progress(1, callback=callback)
+                return
+
+        if (dropTriggers):
+            database.deleteTriggers()
+
+        self._retrieve_and_insert(dataset_id=dataset_id, slideuid=slideuid, database=database, callback=callback, uuids=changedRemote if (watermark is not None) else None)
 
         def getAnnotationTypes():
-            annotypes = self.APIs.annotation_types_api.list_annotation_types(product=product_id, pagination=False).results
+            annotypes = self.request(partial(self.APIs.annotation_types_api.list_annotation_types, product=product_id, pagination=False)).results
 
             annotypedictret = {annotype.name:annotype for annotype in annotypes}
             return annotypedictret 
 
-        def get_or_create_annotationtype(labelId:int, annotationType:AnnotationType):
+        def get_or_create_annotationtype(labelId:int, annotationType:AnnotationType, refreshed:bool=False):
 
             """
                 Retrieve the correct annotation_type_id from the annotation type dictionary. If non-existent,
-                create it.
+                create it (holding the lock, after refreshing the dictionary, since concurrent syncs of the
+                same product may have created it meanwhile).
             """
             nonlocal annotypedict#, classToSend, mergeLocalClasses
             name = classes[labelId][0:20]
@@ -346,17 +609,23 @@ class ExactManager():
             elif ((name in annotypedict.keys()) and (annotypedict[name].vector_type != annotationtype_to_vectortype[annotationType])
                 and (name_alt in annotypedict.keys()) and (annotypedict[name_alt].vector_type == annotationtype_to_vectortype[annotationType])):
                 return annotypedict[name_alt].id # alternative name matches 
+            elif not (refreshed):
+                with self.annotationTypeLock:
+                    annotypedict = getAnnotationTypes()
+                    return get_or_create_annotationtype(labelId, annotationType, refreshed=True)
             elif (name not in annotypedict.keys()):
                 # nonexistant type --> create
                 annotation_type = ExactAnnotationType(name=name, vector_type=annotationtype_to_vectortype[annotationType], product=product_id, color_code=classes_col[classToSend], sort_order=classToSend)
-                annotypeID = self.APIs.annotation_types_api.create_annotation_type(body=annotation_type)
+                annotypeID = self.request(partial(self.APIs.annotation_types_api.create_annotation_type, body=annotation_type),
+                                          recover=lambda: getAnnotationTypes().get(name))
                 print('CREATING NEW ANNOTATION TYPE A:',annotation_type)
                 annotypedict = getAnnotationTypes()
                 return annotypeID.id
             elif (name_alt not in annotypedict.keys()): # non matching type for original name -> create alterntive name
 #                self.create_annotationtype(product_id=product_id,name=name_alt, vector_type=annotationtype_to_vectortype[annotationType], color_code=classes_col[classToSend], sort_order=classToSend)
                 annotation_type = ExactAnnotationType(name=name_alt, vector_type=annotationtype_to_vectortype[annotationType], product=product_id, color_code=classes_col[classToSend], sort_order=classToSend)
-                annotypeID = self.APIs.annotation_types_api.create_annotation_type(body=annotation_type)
+                annotypeID = self.request(partial(self.APIs.annotation_types_api.create_annotation_type, body=annotation_type),
+                                          recover=lambda: getAnnotationTypes().get(name_alt))
                 print('CREATING NEW ANNOTATION TYPE B:',annotation_type)
                 annotypedict = getAnnotationTypes()
                 mergeLocalClasses[(annotationType,labelId)] = name_alt
@@ -366,7 +635,7 @@ class ExactManager():
 
         filename = database.slideFilenameForID(slideuid)
 
-        imageset_details = self.APIs.image_sets_api.retrieve_image_set(imageset_id, expand='images')
+        imageset_details = self.request(partial(self.APIs.image_sets_api.retrieve_image_set, imageset_id, expand='images'))
         
         for imset in imageset_details.images:
             if (imset['name']==filename):
@@ -376,31 +645,68 @@ class ExactManager():
             raise ExactProcessError('No matching image found.')
 
 #        annos = self.APIs.annotations_api.list_annotations(id=image_id).results
-        annos = np.array(self.APIs.annotations_api.list_annotations(image=dataset_id, expand=['last_editor','annotation_type'], pagination=False).results)
-
         # retrieve all annotation types
         annotypedict = getAnnotationTypes()
 
-        # reformat to dict according to uuid
-        uuids = np.array([anno.unique_identifier for anno in annos])
-
-        annodict = {uuid:annos[np.where(uuids==uuid)] for uuid in uuids}
-
-
-        classes = {y:x for x,y,col,clckbl in database.getAllClasses()}
-        classes_col = {y:col for x,y,col,clckbl in database.getAllClasses()}
-        classes_rev = {x:y for x,y,col,clckbl in database.getAllClasses()}
+        allClasses = database.getAllClasses()
+        classes = {y:x for x,y,col,clckbl in allClasses}
+        classes_col = {y:col for x,y,col,clckbl in allClasses}
 
         uidToSend, nameToSend = database.getExactPerson()
         pending_requests=0
+        replies=queue.Queue() # of the requests of this sync
+        writebacks=list() # (exact_id, label uid) of created remote annotations
+        failed=list()
+
+        def flushWritebacks():
+            # store the exact_ids of created remote annotations in the local labels, in one transaction
+            if len(writebacks)>0:
+                database.db.executemany('UPDATE Annotations_label SET exact_id=? WHERE uid==?', writebacks)
+                database.commit()
+                writebacks.clear()
+
+        def handleReply(res, context):
+            if isinstance(res, Exception):
+                failed.append(res)
+                self.log(1, f'Request for annotation {context["annouid"]} failed: {str(res).strip()}')
+                return
+            if ('labeluid' in context):
+                # created: remember the new exact_id of the label
+                label = database.annotations[context['annouid']].labels[context['labeluid']]
+                label.exact_id = res.id
+                writebacks.append((res.id, label.uid))
+                if (len(writebacks)>=self.writeback_batch):
+                    flushWritebacks()
+
+        def submit(job:callable, context:dict):
+            """
+                Sends a create or update request. Up to self.max_in_flight requests are handled by the
+                worker threads at the same time, replies are processed once the window is full.
+            """
+            nonlocal pending_requests
+            if not (self.multi_threaded):
+                try:
+                    res = self.request(job, recover=context.get('recover'))
+                except Exception as e:
+                    res = e
+                handleReply(res, context)
+                return
+            context['replies'] = replies
+            self.jobqueue.put((0, job, context))
+            pending_requests+=1
+            while (pending_requests>=self.max_in_flight):
+                handleReply(*replies.get())
+                pending_requests-=1
 
         database.loadIntoMemory(slideuid, zLevel=None)
-        self.log(0,f'Checking all {len(database.annotations.keys())} entries of DB slide {slideuid}')
+        annokeys = [key for key, anno in database.annotations.items() if (watermark is None) or (anno.lastModified > watermark[1])]
+        numAnnos = len(annokeys)
+        self.log(0,f'Checking {numAnnos} of {len(database.annotations)} entries of DB slide {slideuid}')
 #            print('Loading zLevel: ',zLevel,'annos=',len(database.annotations.keys()))
-       
-        for cntr,annokey in enumerate(database.annotations.keys()):
-            if not (self.multi_threaded):
-                self.progress(0.5+(float(cntr)*0.5/(len(database.annotations.keys())+0.0001)), callback=callback)
+
+        for cntr,annokey in enumerate(annokeys):
+            if (cntr % 100 == 0):
+                self.progress(0.5+(float(cntr)*0.45/(numAnnos+0.0001)), callback=callback)
             dbanno = database.annotations[annokey]
             # look through annotations
             labelToSend = [lab.classId for lab in dbanno.labels if lab.annnotatorId==uidToSend]
@@ -410,109 +716,206 @@ class ExactManager():
                 # not from expert marked as exact user --> ignore
                 continue
 #                print('DB ANNO: ',dbanno.guid,'ANNO DICT:',annodict.keys())
-            if (dbanno.guid in annodict.keys()):
-                le_array = [_anno.last_edit_time for _anno in annodict[dbanno.guid]]
-                lastedit = np.max(le_array) # maximum last_edit time is most recent for uuid
+            if (dbanno.guid in remoteEdits):
+                lastedit = remoteEdits[dbanno.guid] # maximum last_edit time is most recent for uuid
                 # highlander rule --> whoever edited last will win (for the complete annotation)
 
-                if (lastedit.timestamp()>dbanno.lastModified):
+                if (lastedit>dbanno.lastModified):
                     pass
-                    print('A more recent version of ',dbanno.guid,'is available',lastedit.timestamp(), dbanno.lastModified)
+                    print('A more recent version of ',dbanno.guid,'is available',lastedit, dbanno.lastModified)
                     # more recent version exists online
                     # TODO: Implement storing of my version in case of creation
-                elif (lastedit.timestamp()+EPS_TIME_CONVERSION<dbanno.lastModified):
+                elif (lastedit+EPS_TIME_CONVERSION<dbanno.lastModified):
                     # local annotation is more recent --> update
                     IdToSend = [lab.exact_id for lab in dbanno.labels if lab.annnotatorId==uidToSend]
                     for lts, idts,i in zip(labelToSend,IdToSend,labelToSendIdx):
                         # case: exact_id is known
                         classToSend=lts # used in embedded function
+                        lastModified=datetime.datetime.fromtimestamp(dbanno.lastModified).strftime( "%Y-%m-%dT%H:%M:%S.%f")
+                        annotationtype = get_or_create_annotationtype(lts, dbanno.annotationType)
+                        vector = list_to_exactvector(dbanno.coordinates.tolist(),zLevel=dbanno.zLevel)
                         if (idts is not None) and (idts>0):
-#                            print('Remote ID known:',idts,'=> Forcing update, remote is:', lastedit.timestamp(), 'local is:',dbanno.lastModified)
-                            lastModified=datetime.datetime.fromtimestamp(dbanno.lastModified).strftime( "%Y-%m-%dT%H:%M:%S.%f")
-                            vector = list_to_exactvector(dbanno.coordinates.tolist(),zLevel=dbanno.zLevel)
-                            self.APIs.annotations_api.partial_update_annotation(id=idts, annotation_type=get_or_create_annotationtype(lts,dbanno.annotationType), last_edit_time=lastModified, vector=vector, deleted=dbanno.deleted, unique_identifier=dbanno.guid, description=dbanno.text)
-#                            self.update_annotation(,annotation_id=idts, )      
-#                            print(f'UPDATING Annotation {idts}', lastedit.timestamp()+EPS_TIME_CONVERSION, dbanno.lastModified)           
+#                            print('Remote ID known:',idts,'=> Forcing update, remote is:', lastedit, 'local is:',dbanno.lastModified)
+                            submit(partial(self.APIs.annotations_api.partial_update_annotation, id=idts, annotation_type=annotationtype, last_edit_time=lastModified, vector=vector, deleted=dbanno.deleted, unique_identifier=dbanno.guid, description=dbanno.text),
+                                   {'annouid': dbanno.uid})
                         else:
                             # case: exact_id is unknown
                             # can have the following causes:
                             # 1. label is new for annotation --> in this case, it has to be created
                             # 2. exact_id is missing in database --> avoided by first receiving from server
-                            annotationtype = get_or_create_annotationtype(lts, dbanno.annotationType)
-                            vector = list_to_exactvector(dbanno.coordinates.tolist(),zLevel=dbanno.zLevel)
-                            
-                            lastModified=datetime.datetime.fromtimestamp(dbanno.lastModified).strftime( "%Y-%m-%dT%H:%M:%S.%f")
                             annotation = Annotation(annotation_type=annotationtype, vector=vector, image=image_id, unique_identifier=dbanno.guid, last_edit_time=lastModified, time=lastModified, description=dbanno.text, deleted=dbanno.deleted)
-                            if (self.multi_threaded):
-                                context = {'labeluid': i, 'annouid': dbanno.uid}
-                                self.jobqueue.put((0,partial(self.APIs.annotations_api.create_annotation, body=annotation ),context))
-                                pending_requests+=1
-                            else:
-                                det = self.APIs.annotations_api.create_annotation(body=annotation)
-#                                det = self.create_annotation(image_id=image_id, annotationtype_id=get_or_create_annotationtype(lts, dbanno.annotationType), deleted=dbanno.deleted,last_modified=dbanno.lastModified, vector=dbanno.coordinates.tolist(), guid=dbanno.guid, description=dbanno.text)
-                                # add new exact_id to DB field
-                                label = dbanno.labels[i]
-                                database.setAnnotationLabel(classId=label.classId,  person=label.annnotatorId, entryId=label.uid, annoIdx=dbanno.uid, exact_id=det['id'])
-                                label.exact_id = det['annotations']['id']
-                                self.log(1,'Updating local exact_id (previously unknown)')
+                            submit(partial(self.APIs.annotations_api.create_annotation, body=annotation),
+                                   {'labeluid': i, 'annouid': dbanno.uid, 'recover': partial(self.find_annotation, image_id, annotation)})
                 else:
                     # Equal time stamps --> ignore
-#                    print('EQUAL TIME STAMPS FOR ',dbanno.guid,'is available',lastedit.timestamp(), dbanno.lastModified)
+#                    print('EQUAL TIME STAMPS FOR ',dbanno.guid,'is available',lastedit, dbanno.lastModified)
                     pass
             else: # database annotation not in 
                 for i, classToSend in zip(labelToSendIdx,labelToSend):
                     lastModified=datetime.datetime.fromtimestamp(dbanno.lastModified).strftime( "%Y-%m-%dT%H:%M:%S.%f")
-                    if (self.multi_threaded):
-                        context = {'labeluid': i, 'annouid': dbanno.uid}
-                        annotationtype = get_or_create_annotationtype(classToSend, dbanno.annotationType)
-                        vector = list_to_exactvector(dbanno.coordinates.tolist(),zLevel=dbanno.zLevel)
-                        annotation = Annotation(annotation_type=annotationtype, vector=vector, image=image_id, unique_identifier=str(dbanno.guid), last_edit_time=lastModified, time=lastModified,   description=dbanno.text, deleted=dbanno.deleted)
-#                        self.jobqueue.put((0,partial(self.create_annotation, image_id=image_id, annotationtype_id=get_or_create_annotationtype(classToSend, dbanno.annotationType), deleted=dbanno.deleted,last_modified=dbanno.lastModified, vector=dbanno.coordinates.tolist(), guid=dbanno.guid, description=dbanno.text),context))
-                        self.jobqueue.put((0,partial(self.APIs.annotations_api.create_annotation, body=annotation ),context))
-                        pending_requests+=1
-                    else:
-                        annotationtype=get_or_create_annotationtype(classToSend, dbanno.annotationType)
-#                        det = self.create_annotation(image_id=image_id, annotationtype_id=annotationtype, deleted=dbanno.deleted, last_modified=dbanno.lastModified, vector=dbanno.coordinates.tolist(), guid=dbanno.guid, description=dbanno.text)
-                        vector = list_to_exactvector(dbanno.coordinates.tolist(), zLevel=dbanno.zLevel)
-                        annotation = Annotation(annotation_type=annotationtype, vector=vector, image=image_id, unique_identifier=dbanno.guid, last_edit_time=lastModified, time=lastModified, description=dbanno.text, deleted=dbanno.deleted)
-                        det = self.APIs.annotations_api.create_annotation(body=annotation)
-
-                        # add new exact_id to DB field
-                        label = dbanno.labels[i]
-                        # for local update, do not set Annotation.lastModified
-                        database.setAnnotationLabel(classId=label.classId,  person=label.annnotatorId, entryId=label.uid, annoIdx=dbanno.uid, exact_id=det['annotations']['id'])
-                        label.exact_id = det['annotations']['id']
-
-            # make updates to local database until final.
-            while (pending_requests>0):
-                self.progress(1.0-(float(pending_requests)*0.5/(len(database.annotations.keys())+0.0001)), callback=callback)
-                res, context = self.resultQueue.get()
-                dbanno = database.annotations[context['annouid']]
-                pending_requests-=1
-                i = context['labeluid']
-                label = dbanno.labels[i]
-                print('Received reply:',res)
-                database.setAnnotationLabel(classId=label.classId,  person=label.annnotatorId, entryId=label.uid, annoIdx=dbanno.uid, exact_id=res.id)
-                label.exact_id = res.id
-
-            # finally, lets find out if we need to make modifications to the 
-            # local database due to annotation type conversions
-            if len(list(mergeLocalClasses.keys()))>0:
-                self.log(1,'Need to make adjustments to local DB due to annotation type conversion..')
-                for key in mergeLocalClasses:
-                    (annoType, oldId) = key
-                    newname = mergeLocalClasses[key]
-                    if (database.findClassidOfClass(newname) is not None):
-                        # we need to add the new class
-                        newId = database.insertClass(newname)
-                        self.log(1,f'Changing all annotation labels of old type = {oldId}, with annotation Type={annoType}, to new type: {newId}')
-                        database.changeAllAnnotationLabelsOfType(oldId, annoType, newId)
-                        # reload slide
-                        database.loadIntoMemory(database.annotationsSlide,zLevel=None)
-
-        database.addTriggers()
+                    annotationtype = get_or_create_annotationtype(classToSend, dbanno.annotationType)
+                    vector = list_to_exactvector(dbanno.coordinates.tolist(),zLevel=dbanno.zLevel)
+                    annotation = Annotation(annotation_type=annotationtype, vector=vector, image=image_id, unique_identifier=str(dbanno.guid), last_edit_time=lastModified, time=lastModified,   description=dbanno.text, deleted=dbanno.deleted)
+                    submit(partial(self.APIs.annotations_api.create_annotation, body=annotation),
+                           {'labeluid': i, 'annouid': dbanno.uid, 'recover': partial(self.find_annotation, image_id, annotation)})
+
+        # collect the remaining replies and make updates to local database until final.
+        while (pending_requests>0):
+            self.progress(1.0-(float(pending_requests)*0.05/self.max_in_flight), callback=callback)
+            handleReply(*replies.get())
+            pending_requests-=1
+        flushWritebacks()
+
+        # finally, lets find out if we need to make modifications to the 
+        # local database due to annotation type conversions
+        if len(list(mergeLocalClasses.keys()))>0:
+            self.log(1,'Need to make adjustments to local DB due to annotation type conversion..')
+            for key in mergeLocalClasses:
+                (annoType, oldId) = key
+                newname = mergeLocalClasses[key]
+                if (database.findClassidOfClass(newname) is not None):
+                    # we need to add the new class
+                    newId = database.insertClass(newname)
+                    self.log(1,f'Changing all annotation labels of old type = {oldId}, with annotation Type={annoType}, to new type: {newId}')
+                    database.changeAllAnnotationLabelsOfType(oldId, annoType, newId)
+                    # reload slide
+                    database.loadIntoMemory(database.annotationsSlide,zLevel=None)
+
+        if len(failed)==0:
+            set_sync_watermark(database, slideuid, dataset_id, max(remoteEdits.values(), default=0), syncStart)
+
+        if (dropTriggers):
+            database.addTriggers()
+
+        if len(failed)>0:
+            raise ExactProcessError(f'{len(failed)} annotation(s) could not be synchronized: {str(failed[0]).strip()}')
 
         self.progress(1, callback=callback)
 
 
 
+class ExactSyncScheduler():
+    """
+        Synchronizes several slides of a database with EXACT concurrently (at most max_slides at a time).
+        All slides share the worker threads, connection pool and request limit of one ExactManager, each
+        slide uses its own connection to the database file. The database triggers are dropped once for
+        all slides, and the progress of all slides is merged into the status queue.
+    """
+    def __init__(self, exm:ExactManager, dbfilename:str, statusqueue:queue.Queue=None, max_slides:int=4, busy_timeout:float=60):
+        self.exm = exm
+        self.dbfilename = dbfilename
+        self.statusqueue = statusqueue
+        self.max_slides = max_slides
+        self.busy_timeout = busy_timeout # seconds to wait for the database while another slide writes
+        self.lock = threading.Lock()
+        self.slideProgress = dict()
+        self.lastReport = 0
+
+    def report(self, slideuid:int, value:float):
+        with self.lock:
+            self.slideProgress[slideuid] = min(value, 100)
+            now = time.time()
+            if (self.statusqueue is not None) and (now-self.lastReport>0.1):
+                self.lastReport = now
+                self.statusqueue.put((0, sum(self.slideProgress.values())/len(self.slideProgress)))
+
+    def open(self) -> Database:
+        database = Database().open(self.dbfilename)
+        database.db.execute(f'PRAGMA busy_timeout={int(self.busy_timeout*1000)}')
+        return database
+
+    def sync_slide(self, slideuid:int, exact_id:str, database:Database=None, offset:float=0):
+        image_id, product_id, imageset_id = [int(x) for x in exact_id.split('/')]
+        opened = database is None
+        if (opened):
+            database = self.open()
+        try:
+            self.exm.sync(dataset_id=image_id, imageset_id=imageset_id, product_id=product_id, slideuid=slideuid, database=database,
+                          callback=lambda value: self.report(slideuid, offset+value*(100-offset)/100), dropTriggers=False)
+        finally:
+            if (opened):
+                database.db.close()
+
+    def export_slide(self, slideuid:int, filename:str, imageset_id:int, product_id:int):
+        database = self.open()
+        try:
+            image_id = self.exm.upload_image_to_imageset(imageset_id=imageset_id, filename=filename, database=database,
+                                                         callback=lambda value: self.report(slideuid, value/2))[0].id
+            exact_id = f'{image_id}/{product_id}/{imageset_id}'
+            database.execute(f'UPDATE Slides set exactImageID="{exact_id}" where uid=={slideuid}')
+            database.db.commit()
+            self.sync_slide(slideuid, exact_id, database, offset=50)
+        finally:
+            database.db.close()
+
+    def run(self, jobs:dict) -> list:
+        """
+            Runs the jobs ({slideuid: callable}) and returns the failed slides as list of (slideuid, exception)
+        """
+        self.slideProgress = {slideuid:0 for slideuid in jobs}
+        self.exm.set_progress_properties(1, 0) # shared by all slides
+        database = self.open()
+        database.deleteTriggers()
+        database.db.commit()
+        failed = list()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_slides) as executor:
+                futures = {slideuid:executor.submit(job) for slideuid, job in jobs.items()}
+            for slideuid, future in futures.items():
+                if (future.exception() is not None):
+                    self.exm.log(1, f'Sync of slide {slideuid} failed: {future.exception()}')
+                    failed.append((slideuid, future.exception()))
+        finally:
+            database.addTriggers()
+            database.db.commit()
+            database.db.close()
+            if (self.statusqueue is not None):
+                self.statusqueue.put((0, -1))
+        return failed
+
+    def sync(self, slides:list) -> list:
+        """
+            Synchronizes the slides, given as list of (slideuid, exact_id), exact_id being image/product/imageset
+        """
+        return self.run({slideuid:partial(self.sync_slide, slideuid, exact_id) for slideuid, exact_id in slides})
+
+    def export(self, imageset_id:int, product_id:int, slides:list) -> list:
+        """
+            Uploads the slides, given as list of (slideuid, filename, pathname), to the image set and synchronizes them
+        """
+        return self.run({slideuid:partial(self.export_slide, slideuid, pathname+os.sep+filename, imageset_id, product_id)
+                         for slideuid, filename, pathname in slides})
+
+
+if __name__ == '__main__':
+    # Benchmark: import of synthetic remote annotations (bounding boxes, every tenth with a second
+    # label by another annotator) into a new database file.
+    # usage: python -m SlideRunner.dataAccess.exact [number of annotations ...]
+    import os
+    import tempfile
+    import uuid
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    for size in sizes:
+        now = datetime.datetime.now()
+        annos = list()
+        for k in range(size):
+            guid = str(uuid.uuid4()) if (k % 10 != 1) else annos[-1].unique_identifier
+            annos.append(Annotation(id=k+1, annotation_type={'name':'Mitosis', 'vector_type':1, 'closed':True}, image=1,
+                                    vector={'x1':k, 'y1':k, 'x2':k+20, 'y2':k+20}, last_editor={'username':'expert%d' % (k % 2)},
+                                    last_edit_time=now, deleted=False, description='', unique_identifier=guid))
+
+        with tempfile.TemporaryDirectory() as tempdir, open(os.devnull, 'w') as logfile:
+            database = Database().create(tempdir+os.sep+'benchmark.sqlite')
+            slideuid = database.insertNewSlide('benchmark.svs', '')
+            database.deleteTriggers() # as in sync
+            exm = ExactManager('benchmark', serverurl='http://localhost', logfile=logfile)
+            start = time.perf_counter()
+            annodict = group_by_uuid(annos)
+            grouping = time.perf_counter()-start
+            start = time.perf_counter()
+            exm.import_annotations(annos, slideuid=slideuid, database=database)
+            total = time.perf_counter()-start
+            exm.terminate()
+            database.db.close()
+        print(f'{size:8d} remote annotations ({len(annodict)} uuids): grouping {grouping:.3f} s, import {total:.1f} s ({size/total:.0f} annotations/s)')
@@ -0,0 +1,137 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images
+        Bildverarbeitung fuer die Medizin 2018, Springer Verlag, Berlin-Heidelberg
+
+
+   This file: Overlay maps (e.g. segmentation or classification results) in HDF5 files
+
+   A map is read chunk by chunk: only the chunks intersecting the viewport are
+   read and decoded, and decoded chunks are kept in a byte-bounded LRU cache.
+
+   Maps may be stored as multi-resolution pyramids: besides the dataset name
+   (full resolution), datasets name_<downsample> (e.g. segmentation_4,
+   segmentation_16) hold versions downsampled by an integer factor, see
+   writePyramid(). For each viewport, the coarsest level that still has at
+   least one map pixel per screen pixel is read. Levels coarser than the
+   stored ones are read strided from the closest stored level (the chunks of
+   the stored level are decoded, but only the strided version is cached).
+
+"""
+import re
+import threading
+import h5py
+import numpy as np
+from SlideRunner.processing.tilecache import tileCache
+
+
+class mapLevel(object):
+    """
+        One resolution of the map, sliced like an array (map[y1:y2, x1:x2]) and read through the chunk cache
+    """
+    def __init__(self, source, dataset, downsample:int, step:int=1):
+        self.source = source
+        self.dataset = dataset
+        self.downsample = downsample
+        self.step = step
+        self.shape = (int(np.ceil(dataset.shape[0]/step)), int(np.ceil(dataset.shape[1]/step))) + dataset.shape[2:]
+        self.dtype = dataset.dtype
+        # chunk grid: chunks of the dataset (or of its strided version), default for contiguous datasets
+        self.chunkShape = dataset.chunks[0:2] if (dataset.chunks is not None) else (512, 512)
+
+    def chunk(self, cy:int, cx:int) -> np.ndarray:
+        key = (self.downsample, cy, cx)
+        data = self.source.cache.get(key)
+        if (data is None):
+            ch, cw = self.chunkShape
+            s = self.step
+            with self.source.lock: # h5py serializes access anyway
+                data = self.dataset[cy*ch*s:(cy+1)*ch*s:s, cx*cw*s:(cx+1)*cw*s:s]
+            self.source.cache.put(key, data)
+        return data
+
+    def __getitem__(self, key) -> np.ndarray:
+        rows, cols = key
+        y1, y2, _ = rows.indices(self.shape[0])
+        x1, x2, _ = cols.indices(self.shape[1])
+        region = np.empty((max(0,y2-y1), max(0,x2-x1)) + self.shape[2:], self.dtype)
+        ch, cw = self.chunkShape
+        for cy in range(y1//ch, (y2-1)//ch+1 if y2>y1 else 0):
+            for cx in range(x1//cw, (x2-1)//cw+1 if x2>x1 else 0):
+                data = self.chunk(cy, cx)
+                sy1, sy2 = max(y1, cy*ch), min(y2, cy*ch+data.shape[0])
+                sx1, sx2 = max(x1, cx*cw), min(x2, cx*cw+data.shape[1])
+                region[sy1-y1:sy2-y1, sx1-x1:sx2-x1] = data[sy1-cy*ch:sy2-cy*ch, sx1-cx*cw:sx2-cx*cw]
+        return region
+
+
+class hdf5OverlaySource(object):
+
+    def __init__(self, filename:str, name:str, cacheBytes:int=64*1024*1024):
+        self.file = h5py.File(filename, 'r')
+        self.name = name
+        self.cache = tileCache(cacheBytes)
+        self.lock = threading.Lock()
+        levels = {1 : self.file[name]}
+        for key in self.file.keys():
+            match = re.match('^%s_(\\d+)$' % re.escape(name), key)
+            if (match is not None) and (int(match.group(1))>1):
+                levels[int(match.group(1))] = self.file[key]
+        self.levels = [mapLevel(self, levels[downsample], downsample) for downsample in sorted(levels.keys())]
+        self.stridedLevels = dict()
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    def level(self, downsample:float) -> mapLevel:
+        """
+            coarsest level with a downsample (relative to the full resolution map) of at most downsample
+        """
+        stored = [level for level in self.levels if level.downsample <= max(downsample, 1)][-1]
+        step = 1
+        while (stored.downsample*step*2 <= downsample):
+            step *= 2
+        if (step == 1):
+            return stored
+        if (stored.downsample, step) not in self.stridedLevels:
+            self.stridedLevels[(stored.downsample, step)] = mapLevel(self, stored.dataset, stored.downsample*step, step)
+        return self.stridedLevels[(stored.downsample, step)]
+
+    def view(self, coordinates, factor:float, shape):
+        """
+            level to render the viewport (x,y,w,h, level 0 coordinates of the slide) to shape (h,w), and
+            its factor (slide pixels per map pixel), given the factor of the full resolution map
+        """
+        level = self.level(coordinates[2]/factor/shape[1])
+        return level, factor*level.downsample
+
+    def close(self):
+        self.cache.clear()
+        self.file.close()
+
+
+def writePyramid(h5file, name:str, downsamples=(4,16,64), chunks=(256,256), bandHeight:int=256):
+    """
+        stores downsampled versions (nearest neighbour, i.e. suitable for label maps) of the dataset
+        name in h5file (opened for writing), reading the dataset in bands
+    """
+    dataset = h5file[name]
+    for downsample in downsamples:
+        shape = (int(np.ceil(dataset.shape[0]/downsample)), int(np.ceil(dataset.shape[1]/downsample))) + dataset.shape[2:]
+        levelName = '%s_%d' % (name, downsample)
+        if levelName in h5file:
+            del h5file[levelName]
+        level = h5file.create_dataset(levelName, shape=shape, dtype=dataset.dtype, compression='gzip',
+                                      chunks=(min(chunks[0], shape[0]), min(chunks[1], shape[1])) + dataset.shape[2:])
+        for y in range(0, shape[0], bandHeight):
+            level[y:y+bandHeight] = dataset[y*downsample:(y+bandHeight)*downsample:downsample, ::downsample]
@@ -0,0 +1,275 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images
+        Bildverarbeitung fuer die Medizin 2018, Springer Verlag, Berlin-Heidelberg
+
+
+   This file: Spatial index for annotations in the render path
+
+"""
+
+import copy
+import itertools
+import cv2
+import numpy as np
+from SlideRunner_dataAccess.database import Database, AnnotationType
+from SlideRunner.processing.densitymap import annotationDensityMap
+
+
+class gridIndex(object):
+    """
+        Uniform grid index over axis-aligned bounding boxes (x1,y1,x2,y2).
+
+        Each box is registered in all grid cells it overlaps, so that a query only
+        needs to look at the cells covered by the queried rectangle. Boxes covering
+        more than maxCellsPerBox cells (or with infinite extent, like image
+        annotations) are returned for every query.
+    """
+
+    def __init__(self, cellSize:int=2048, maxCellsPerBox:int=1024):
+        self.cellSize = cellSize
+        self.maxCellsPerBox = maxCellsPerBox
+        self.cells = dict()
+        self.boxes = dict()
+        self.large = set()
+
+    def cellRange(self, x1, y1, x2, y2):
+        cs = self.cellSize
+        return int(np.floor(x1/cs)), int(np.floor(y1/cs)), int(np.floor(x2/cs)), int(np.floor(y2/cs))
+
+    def insert(self, uid, box):
+        if uid in self.boxes:
+            self.remove(uid)
+        self.boxes[uid] = box
+        if not np.all(np.isfinite(box)):
+            self.large.add(uid)
+            return
+        cx1, cy1, cx2, cy2 = self.cellRange(*box)
+        if ((cx2-cx1+1)*(cy2-cy1+1) > self.maxCellsPerBox):
+            self.large.add(uid)
+            return
+        for cx in range(cx1, cx2+1):
+            for cy in range(cy1, cy2+1):
+                self.cells.setdefault((cx,cy), set()).add(uid)
+
+    def remove(self, uid):
+        if uid not in self.boxes:
+            return
+        box = self.boxes.pop(uid)
+        if uid in self.large:
+            self.large.remove(uid)
+            return
+        cx1, cy1, cx2, cy2 = self.cellRange(*box)
+        for cx in range(cx1, cx2+1):
+            for cy in range(cy1, cy2+1):
+                cell = self.cells[(cx,cy)]
+                cell.discard(uid)
+                if (len(cell)==0):
+                    del self.cells[(cx,cy)]
+
+    def query(self, leftUpper, rightLower) -> list:
+        """
+            returns the (sorted) uids of all boxes overlapping the rectangle
+        """
+        cx1, cy1, cx2, cy2 = self.cellRange(leftUpper[0], leftUpper[1], rightLower[0], rightLower[1])
+        candidates = set(self.large)
+        if ((cx2-cx1+1)*(cy2-cy1+1) > len(self.cells)):
+            # zoomed far out: cheaper to walk the occupied cells
+            for (cx,cy),cell in self.cells.items():
+                if (cx1<=cx<=cx2) and (cy1<=cy<=cy2):
+                    candidates.update(cell)
+        else:
+            for cx in range(cx1, cx2+1):
+                for cy in range(cy1, cy2+1):
+                    if (cx,cy) in self.cells:
+                        candidates.update(self.cells[(cx,cy)])
+
+        visible = list()
+        for uid in candidates:
+            x1, y1, x2, y2 = self.boxes[uid]
+            if (x2 > leftUpper[0]) and (x1 < rightLower[0]) and (y2 > leftUpper[1]) and (y1 < rightLower[1]):
+                visible.append(uid)
+        return sorted(visible)
+
+    def __len__(self):
+        return len(self.boxes)
+
+
+# versions of the annotations in memory, unique over all databases (e.g. after opening another one)
+annotationVersions = itertools.count(1)
+
+
+class SpatialDatabase(Database):
+    """
+        Database keeping a grid index of the annotations loaded into memory.
+
+        Replaces the linear scan over minCoords/maxCoords in getVisibleAnnotations.
+        The index is built in loadIntoMemory and updated on insert, move and delete.
+
+        When zoomed out beyond lodDownsample, annotateImage blends a per-class
+        density raster instead of drawing each annotation. Below that, polygons
+        are drawn simplified to the screen resolution.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.spatialIndex = gridIndex()
+        self.visibleRegion = ((0,0),(0,0))
+        self.densityVersion = next(annotationVersions)
+        self.density = (None, None)
+        self.simplifiedPolygons = dict()
+
+    @property
+    def VA(self) -> dict:
+        # visible annotations are only gathered on demand (e.g. on a click) when drawing the density map
+        if (self._VA is None):
+            self._VA = self.getVisibleAnnotations(*self.visibleRegion)
+        return self._VA
+
+    @VA.setter
+    def VA(self, value:dict):
+        self._VA = value
+
+    def annotationsChanged(self, annoId=None):
+        self.densityVersion = next(annotationVersions)
+        if (annoId is None):
+            self.simplifiedPolygons = dict()
+        else:
+            self.simplifiedPolygons.pop(annoId, None)
+
+    def indexAnnotation(self, anno):
+        minC, maxC = anno.minCoordinates(), anno.maxCoordinates()
+        self.spatialIndex.insert(anno.uid, (minC.x, minC.y, maxC.x, maxC.y))
+        self.annotationsChanged(anno.uid)
+
+    def generateMinMaxCoordsList(self):
+        self.spatialIndex = gridIndex()
+        for anno in self.annotations.values():
+            self.indexAnnotation(anno)
+        self.annotationsChanged()
+
+    def densityMap(self, vp) -> annotationDensityMap:
+        """
+            returns the density map of all annotations, labelled as colored by the viewing profile.
+            It is rebuilt only after the annotations or the labelling mode changed.
+        """
+        key = (self.densityVersion, vp.blindMode, vp.annotator, vp.majorityClassVote)
+        if (self.density[0] != key):
+            centers, labels = list(), list()
+            for uid,(x1,y1,x2,y2) in self.spatialIndex.boxes.items():
+                anno = self.annotations.get(uid)
+                if (anno is None) or (anno.deleted):
+                    continue
+                if (vp.blindMode):
+                    labels.append(anno.labelBy(vp.annotator))
+                elif (vp.majorityClassVote):
+                    labels.append(anno.majorityLabel())
+                else:
+                    labels.append(anno.agreedLabel())
+                centers.append(((x1+x2)/2, (y1+y2)/2))
+            self.density = (key, annotationDensityMap(np.array(centers).reshape(-1,2), np.array(labels, dtype=np.int64)))
+        return self.density[1]
+
+    def simplifiedPolygon(self, anno, zoomLevel:float):
+        """
+            returns a copy of a polygon annotation, with its outline simplified to
+            half a screen pixel at the zoom level. Copies are cached per power-of-two zoom.
+        """
+        if (anno.annotationType != AnnotationType.POLYGON) or (zoomLevel < 2) or (anno.coordinates.shape[0] < 32):
+            return anno
+        zoomBucket = int(np.log2(zoomLevel))
+        cached = self.simplifiedPolygons.get(anno.uid)
+        if (cached is None) or (cached[0] != zoomBucket):
+            simplified = copy.copy(anno)
+            simplified.coordinates = cv2.approxPolyDP(np.float32(anno.coordinates), epsilon=0.5*2**zoomBucket, closed=True).reshape(-1,2)
+            cached = (zoomBucket, simplified)
+            self.simplifiedPolygons[anno.uid] = cached
+        return cached[1]
+
+    def annotateImage(self, img: np.ndarray, leftUpper: list, rightLower:list, zoomLevel:float, vp, selectedAnnoID:int, annotationClasses, lodDownsample:float=None):
+        if (lodDownsample is not None) and (lodDownsample>0) and (zoomLevel >= lodDownsample):
+            self.visibleRegion = (leftUpper, rightLower)
+            self.VA = None
+            colors = vp.COLORS_CLASSES if isinstance(vp.COLORS_CLASSES, dict) else dict(enumerate(vp.COLORS_CLASSES))
+            activeClasses = [label for label in annotationClasses if annotationClasses[label]['Active']]
+            self.densityMap(vp).render(img, leftUpper, rightLower, colors=colors, activeClasses=activeClasses)
+            if (selectedAnnoID in self.annotations):
+                self.annotations[selectedAnnoID].draw(img, leftUpper, zoomLevel, thickness=2, vp=vp, selected=True)
+            return
+
+        annos = self.getVisibleAnnotations(leftUpper, rightLower)
+        self.VA = annos
+        for idx,anno in annos.items():
+            label = anno.agreedLabel()
+            if (label in annotationClasses) and (annotationClasses[label]['Active']) and not anno.deleted:
+                if (selectedAnnoID!=anno.uid):
+                    anno = self.simplifiedPolygon(anno, zoomLevel)
+                anno.draw(img, leftUpper, zoomLevel, thickness=2, vp=vp, selected=(selectedAnnoID==anno.uid))
+
+    def appendToMinMaxCoordsList(self, anno):
+        self.indexAnnotation(anno)
+
+    def getVisibleAnnotations(self, leftUpper:list, rightLower:list) -> dict:
+        return {uid:self.annotations[uid] for uid in self.spatialIndex.query(leftUpper, rightLower) if uid in self.annotations}
+
+    def exchangePolygonCoordinates(self, annoId, slideUID, annoList, zLevel):
+        self.annotations[annoId].annotationType = AnnotationType.POLYGON
+        self.annotations[annoId].coordinates = np.asarray(annoList)
+        self.indexAnnotation(self.annotations[annoId])
+
+        self.execute('DELETE FROM Annotations_coordinates where annoId == %d' % annoId)
+        self.commit()
+
+        self.insertCoordinates(np.array(annoList), slideUID, annoId, zLevel)
+
+    def setPolygonCoordinates(self, annoId, coords, slideUID, zLevel):
+        super().setPolygonCoordinates(annoId, coords, slideUID, zLevel)
+        if annoId in self.annotations:
+            self.indexAnnotation(self.annotations[annoId])
+
+    def updatePolygonPoint(self, annoId, orderIdx, coords):
+        super().updatePolygonPoint(annoId, orderIdx, coords)
+        if annoId in self.annotations:
+            self.indexAnnotation(self.annotations[annoId])
+
+    def removePolygonPoint(self, annoId:int, coord_idx:int):
+        super().removePolygonPoint(annoId, coord_idx)
+        self.indexAnnotation(self.annotations[annoId])
+
+    def changeAnnotationID(self, annoId:int, newAnnoID:int):
+        if not super().changeAnnotationID(annoId, newAnnoID):
+            return False
+        self.spatialIndex.remove(annoId)
+        self.annotationsChanged(annoId)
+        return True
+
+    def removeAnnotation(self, annoId, onlyMarkDeleted:bool=True):
+        super().removeAnnotation(annoId, onlyMarkDeleted)
+        if not (onlyMarkDeleted):
+            self.spatialIndex.remove(annoId)
+        self.annotationsChanged(annoId)
+
+    def setAgreedClass(self, classId, annoIdx):
+        super().setAgreedClass(classId, annoIdx)
+        self.annotationsChanged(annoIdx)
+
+    def setAnnotationLabel(self, classId, person, entryId, annoIdx, **kwargs):
+        super().setAnnotationLabel(classId, person, entryId, annoIdx, **kwargs)
+        self.annotationsChanged(annoIdx)
+
+    def addAnnotationLabel(self, classId, person, annoId, exact_id:int=None):
+        super().addAnnotationLabel(classId, person, annoId, exact_id=exact_id)
+        self.annotationsChanged(annoId)
+
+    def removeAnnotationLabel(self, labelIdx, annoIdx):
+        super().removeAnnotationLabel(labelIdx, annoIdx)
+        self.annotationsChanged(annoIdx)
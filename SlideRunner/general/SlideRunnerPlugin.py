@@ -1,11 +1,17 @@
 """
       Definition of the class SlideRunnerPlugin, used to derive plugins
 """
-from queue import Queue
+from queue import Queue, Empty
+from multiprocessing import shared_memory
+import atexit
+import os
+import threading
+import weakref
 import numpy as np 
 import cv2
 from typing import List, Tuple
-from SlideRunner_dataAccess.annotations import PluginAnnotationLabel
+from SlideRunner_dataAccess.annotations import PluginAnnotationLabel, annotation, rectangularAnnotation, spotAnnotation, circleAnnotation, polygonAnnotation
+from SlideRunner.processing.densitymap import annotationDensityMap
 
 
 
@@ -43,6 +49,10 @@ class JobDescription(enumerate):
       PROCESS = 0
       QUIT_PLUGIN_THREAD = 99
 
+class PluginExecutionMode(enumerate):
+      THREAD = 0      # queueWorker runs in a thread of the SlideRunner process
+      PROCESS = 1     # queueWorker runs in a separate process (see SlideRunner.general.pluginProcess)
+
 
 class pluginJob():
       jobDescription = None
@@ -55,9 +65,23 @@ class pluginJob():
       configuration = list()
       
       actionUID = None
+      cancellation = None
+      frame = None
       
       def __init__(self, queueTuple):
-            self.jobDescription, self.currentImage, self.slideFilename, self.coordinates, self.configuration, self.annotations, self.procId, self.trigger, self.actionUID, self.openedDatabase = queueTuple
+            self.jobDescription, self.currentImage, self.slideFilename, self.coordinates, self.configuration, self.annotations, self.procId, self.trigger, self.actionUID, self.openedDatabase = queueTuple[0:10]
+            self.cancellation = queueTuple[10] if len(queueTuple)>10 else CancellationToken()
+            if isinstance(self.currentImage, SharedFrame):
+                  # image published in shared memory, mapped without copying
+                  self.frame = self.currentImage
+                  self.currentImage = self.frame.array()
+
+      @property
+      def cancelled(self) -> bool:
+            """
+                True, if a newer job of the same kind has been sent, i.e. the result of this job is not needed any more
+            """
+            return self.cancellation.cancelled
 
       def __str__(self):
             return """<SlideRunner.general.SlideRunnerPlugin.pluginJob object>
@@ -69,7 +93,291 @@ class pluginJob():
       
 
 def jobToQueueTuple(description=JobDescription.PROCESS, currentImage=None, coordinates=None, configuration=list(), slideFilename=None, annotations=None, procId=None, trigger=None, actionUID=None, openedDatabase=None):
-      return (description, currentImage, slideFilename, coordinates, configuration, annotations, procId, trigger, actionUID, openedDatabase)
+      return (description, currentImage, slideFilename, coordinates, configuration, annotations, procId, trigger, actionUID, openedDatabase, CancellationToken())
+
+
+class CancellationToken():
+      """
+          Set by the mailbox when a job is superseded by a newer job of the same kind.
+          queueWorker loops may check it (job.cancelled) to abandon work early.
+      """
+      def __init__(self):
+            self.cancelled = False
+
+      def cancel(self):
+            self.cancelled = True
+
+
+class PluginMailbox():
+      """
+          Bounded job queue for plugins, with latest-wins semantics.
+
+          Drop-in replacement for the plugin's inQueue (put/get/empty/qsize).
+          A new job replaces a pending job of the same kind (job description, 
+          trigger, action and annotations), e.g. only the newest view is processed
+          after scrolling. The superseded job and a job of the same kind that is
+          currently processed are cancelled. A job counts as processed until its
+          worker asks for the next one. If the mailbox is full, the oldest 
+          pending job is dropped. Quit requests are never dropped and discard all
+          pending jobs.
+      """
+      def __init__(self, maxsize:int=4):
+            self.maxsize = maxsize
+            self.pending = list()
+            self.inProgress = dict()
+            self.condition = threading.Condition()
+            self.received = 0
+            self.dropped = 0
+            self.maxDepth = 0
+
+      @staticmethod
+      def jobKey(item):
+            if not isinstance(item, tuple) or (len(item)<10) or (item[0] != JobDescription.PROCESS):
+                  return None
+            annotations = item[5] if item[5] is not None else list()
+            return (item[0], id(item[7]) if item[7] is not None else None, item[8], tuple([getattr(anno, 'uid', id(anno)) for anno in annotations]))
+
+      @staticmethod
+      def cancel(item):
+            if isinstance(item, tuple) and (len(item)>10):
+                  item[10].cancel()
+
+      def put(self, item, block=True, timeout=None):
+            key = self.jobKey(item)
+            with self.condition:
+                  self.received += 1
+                  if isinstance(item, tuple) and (len(item)>=10) and (item[0] == JobDescription.QUIT_PLUGIN_THREAD):
+                        for pendingKey, pendingItem in self.pending:
+                              self.cancel(pendingItem)
+                        self.dropped += len(self.pending)
+                        self.pending = list()
+                  if (key is not None):
+                        if (key in self.inProgress):
+                              self.cancel(self.inProgress[key][1])
+                        for idx,(pendingKey, pendingItem) in enumerate(self.pending):
+                              if (pendingKey == key):
+                                    self.cancel(pendingItem)
+                                    self.pending.pop(idx)
+                                    self.dropped += 1
+                                    break
+                        while (len(self.pending) >= self.maxsize):
+                              droppable = [idx for idx,(pendingKey,_) in enumerate(self.pending) if pendingKey is not None]
+                              if (len(droppable)==0):
+                                    break
+                              self.cancel(self.pending.pop(droppable[0])[1])
+                              self.dropped += 1
+                  self.pending.append((key, item))
+                  self.maxDepth = max(self.maxDepth, len(self.pending))
+                  self.condition.notify()
+
+      def put_nowait(self, item):
+            self.put(item, block=False)
+
+      def get(self, block=True, timeout=None):
+            with self.condition:
+                  # the jobs this worker got before are finished now
+                  consumer = threading.get_ident()
+                  self.inProgress = {key:entry for key,entry in self.inProgress.items() if entry[0] != consumer}
+                  if not (block):
+                        if (len(self.pending)==0):
+                              raise Empty
+                  elif not self.condition.wait_for(lambda: len(self.pending)>0, timeout=timeout):
+                        raise Empty
+                  key, item = self.pending.pop(0)
+                  if (key is not None):
+                        self.inProgress[key] = (consumer, item)
+                  return item
+
+      def get_nowait(self):
+            return self.get(block=False)
+
+      def empty(self) -> bool:
+            with self.condition:
+                  return len(self.pending)==0
+
+      def qsize(self) -> int:
+            with self.condition:
+                  return len(self.pending)
+
+      def statistics(self) -> dict:
+            with self.condition:
+                  return {'depth' : len(self.pending), 'maxDepth' : self.maxDepth, 'received' : self.received, 'dropped' : self.dropped}
+
+
+class SharedFrame():
+      """
+          Reference to an image in a slot of a SharedFrameRing. Only the reference is
+          pickled, the receiver maps the image from shared memory.
+      """
+      attached = dict()
+
+      def __init__(self, name:str, frameId:int, shape, dtype):
+            self.name = name
+            self.frameId = frameId
+            self.shape = tuple(shape)
+            self.dtype = np.dtype(dtype).str
+
+      def array(self) -> np.ndarray:
+            """
+                returns the image (not a copy), or None if the slot has been reused for a newer frame
+            """
+            if (self.name not in SharedFrame.attached):
+                  try:
+                        SharedFrame.attached[self.name] = shared_memory.SharedMemory(name=self.name)
+                  except FileNotFoundError:
+                        return None
+            buf = SharedFrame.attached[self.name].buf
+            if (np.ndarray((1,), np.int64, buffer=buf)[0] != self.frameId):
+                  return None
+            return np.ndarray(self.shape, np.dtype(self.dtype), buffer=buf, offset=SharedFrameRing.headerSize)
+
+      def copy(self) -> np.ndarray:
+            """
+                returns a copy of the image, or None if the slot has been reused (before or while copying)
+            """
+            image = self.array()
+            if (image is None):
+                  return None
+            image = image.copy()
+            return image if (self.array() is not None) else None
+
+
+class SharedFrameRing():
+      """
+          Ring of image slots in named shared memory, to hand images between SlideRunner
+          and plugins without copying them for every plugin (or pickling them for plugins
+          in a worker process).
+
+          publish(image) copies an image once into the next slot. The returned SharedFrame
+          can be sent to any number of plugins, which map the same memory. Publishing the
+          same array again returns the same frame.
+
+          allocate(shape, dtype) returns a writable image in the next slot, e.g. for the
+          overlay of a plugin. find(array) returns the frame of such an image.
+
+          Slots are reused round-robin and grown if needed. A retained slot is skipped
+          until it is released. Each slot starts with the id of the frame it contains,
+          so that references to reused slots are detected.
+      """
+      headerSize = 64
+      rings = weakref.WeakSet()
+
+      def __init__(self, slots:int=4):
+            self.memory = [None]*slots
+            self.frames = [None]*slots
+            self.retained = [0]*slots
+            self.retired = list()
+            self.next = 0
+            self.frameId = 0
+            self.lastPublished = (None, None)
+            self.bytesPublished = 0
+            self.lock = threading.RLock()
+            SharedFrameRing.rings.add(self)
+            atexit.register(self.close)
+
+      def slot(self, nbytes:int) -> int:
+            idx = None
+            for k in range(len(self.memory)):
+                  if (self.retained[(self.next+k) % len(self.memory)] == 0):
+                        idx = (self.next+k) % len(self.memory)
+                        break
+            if (idx is None):
+                  # all slots retained
+                  idx = len(self.memory)
+                  self.memory.append(None)
+                  self.frames.append(None)
+                  self.retained.append(0)
+            self.next = (idx+1) % len(self.memory)
+
+            shm = self.memory[idx]
+            if (shm is None) or (shm.size < self.headerSize+nbytes):
+                  if (shm is not None):
+                        # still mapped by readers of older frames, unlinking only removes the name
+                        shm.unlink()
+                        self.retired.append(shm)
+                  shm = shared_memory.SharedMemory(create=True, size=self.headerSize+max(nbytes,1))
+                  SharedFrame.attached[shm.name] = shm
+                  self.memory[idx] = shm
+            return idx
+
+      def allocateFrame(self, shape, dtype=np.uint8) -> Tuple[SharedFrame, np.ndarray]:
+            dtype = np.dtype(dtype)
+            with self.lock:
+                  idx = self.slot(int(np.prod(shape))*dtype.itemsize)
+                  shm = self.memory[idx]
+                  self.frameId += 1
+                  np.ndarray((1,), np.int64, buffer=shm.buf)[0] = self.frameId
+                  self.frames[idx] = SharedFrame(shm.name, self.frameId, shape, dtype)
+                  return self.frames[idx], np.ndarray(shape, dtype, buffer=shm.buf, offset=self.headerSize)
+
+      def allocate(self, shape, dtype=np.uint8) -> np.ndarray:
+            return self.allocateFrame(shape, dtype)[1]
+
+      def publish(self, image:np.ndarray) -> SharedFrame:
+            with self.lock:
+                  source, frame = self.lastPublished
+                  if (source is image) and (frame in self.frames):
+                        return frame
+                  frame, array = self.allocateFrame(image.shape, image.dtype)
+                  np.copyto(array, image)
+                  self.bytesPublished += array.nbytes
+                  self.lastPublished = (image, frame)
+                  return frame
+
+      def reference(self, array:np.ndarray) -> SharedFrame:
+            """
+                returns the frame of an image allocated in this ring, or None
+            """
+            pointer = array.__array_interface__['data'][0]
+            with self.lock:
+                  for shm, frame in zip(self.memory, self.frames):
+                        if (frame is not None) and (frame.name == shm.name) and (frame.shape == array.shape) and (frame.dtype == array.dtype.str) \
+                           and (pointer == np.ndarray((1,), np.uint8, buffer=shm.buf, offset=self.headerSize).__array_interface__['data'][0]) \
+                           and (np.ndarray((1,), np.int64, buffer=shm.buf)[0] == frame.frameId):
+                              return frame
+            return None
+
+      @staticmethod
+      def find(array:np.ndarray) -> SharedFrame:
+            for ring in list(SharedFrameRing.rings):
+                  frame = ring.reference(array)
+                  if (frame is not None):
+                        return frame
+            return None
+
+      def retain(self, frame:SharedFrame):
+            with self.lock:
+                  if (frame in self.frames):
+                        self.retained[self.frames.index(frame)] += 1
+
+      def release(self, frame:SharedFrame):
+            with self.lock:
+                  if (frame in self.frames):
+                        idx = self.frames.index(frame)
+                        self.retained[idx] = max(0, self.retained[idx]-1)
+
+      def close(self):
+            with self.lock:
+                  for shm in self.memory:
+                        if (shm is not None):
+                              try:
+                                    shm.unlink()
+                              except FileNotFoundError:
+                                    pass
+                  self.retired += [shm for shm in self.memory if shm is not None]
+                  self.memory = [None]*len(self.memory)
+                  self.frames = [None]*len(self.frames)
+
+def receivedImage(img):
+      """
+            image returned by a plugin, as kept by SlideRunner (e.g. shown as overlay and cached).
+            Images in a SharedFrameRing (overlayBuffer, passed as SharedFrame) are copied, since their
+            slot is reused by later results while this one may still be shown. None if the slot has
+            been reused already.
+      """
+      if isinstance(img, SharedFrame):
+            return img.copy()
+      return img
 
 class PluginConfigurationType(enumerate):
       SLIDER_WITH_FLOAT_VALUE = 0
@@ -180,6 +488,8 @@ class SlideRunnerPlugin:
       statusQueue = None
       outputType = PluginOutputType.HEATMAP
       pluginType = PluginTypes.IMAGE_PLUGIN
+      executionMode = PluginExecutionMode.THREAD
+      cacheResults = False # results only depend on image, viewport and configuration, and may be memoized by the UI
       configurationList = list()
       
       def __init__(self,statusQueue:Queue):
@@ -223,11 +533,23 @@ class SlideRunnerPlugin:
 
       # Return an image to SlideRunner UI
       def returnImage(self, img : np.ndarray, procId = None):
+            if isinstance(img, np.ndarray):
+                  # images from overlayBuffer() are passed as reference to their slot, see receivedImage
+                  frame = SharedFrameRing.find(img)
+                  img = frame if frame is not None else img
             self.outQueue.put((img, procId))
       
       def resetImage(self):
             self.outQueue.put((None, -1))
 
+      # Preallocated image (e.g. uint8 or float16) in shared memory, to be filled and passed to returnImage.
+      # Buffers are reused round-robin: the content is valid until three more buffers have been requested,
+      # SlideRunner copies it once when received (see receivedImage).
+      def overlayBuffer(self, shape, dtype=np.uint8) -> np.ndarray:
+            if (getattr(self, 'overlayRing', None) is None):
+                  self.overlayRing = SharedFrameRing(slots=3)
+            return self.overlayRing.allocate(shape, dtype)
+
 
       def exceptionHandlerOnExit(self):
             return
@@ -266,20 +588,141 @@ class SlideRunnerPlugin:
             print('Sent empty annotation list.')
             return list()
 
+class WholeSlideTilePlugin(SlideRunnerPlugin):
+      """
+          Base class for whole-slide plugins defined by a per-tile function.
+
+          Derived plugins implement processTile(tile, configuration), mapping an RGBA tile
+          (tileSize x tileSize pixels on tileLevel) to a result block of resultSize (w,h)
+          pixels with resultChannels channels of resultType. The function is run over the
+          whole slide in the background (see SlideRunner.processing.tiledplugin), and the
+          overlay of the viewport is served from the cached results. Like every plugin,
+          derived classes declare their own inQueue and outQueue.
+      """
+      pluginType = PluginTypes.WHOLESLIDE_PLUGIN
+      outputType = PluginOutputType.HEATMAP
+      tileSize = 512
+      tileLevel = 0
+      resultSize = (16,16)
+      resultChannels = 1
+      resultType = np.float32
+      tissueOnly = True
+      numWorkers = None
+      interpolation = cv2.INTER_LINEAR
+      refreshInterval = 1.0 # seconds between overlay updates while the slide is processed
+
+      def __init__(self, statusQueue:Queue):
+            self.statusQueue = statusQueue
+            self.processor = None
+            self.processorKey = None
+            self.fingerprints = dict()
+            self.p = threading.Thread(target=self.queueWorker, daemon=True)
+            self.p.start()
+
+      def getAnnotationUpdatePolicy():
+            return AnnotationUpdatePolicy.UPDATE_ON_SCROLL_CHANGE
+
+      def processTile(self, tile:np.ndarray, configuration:dict) -> np.ndarray:
+            raise NotImplementedError
+
+      def reportError(self, tx:int, ty:int, error:Exception):
+            self.setMessage('%s: processing of tile (%d,%d) failed, skipped: %s' % (self.shortName, tx, ty, str(error)))
+
+      def reportProgress(self, done:int, total:int, tilesPerSecond:float):
+            self.setProgressBar(int(100*done/max(total,1)) if (done<total) else -1)
+            self.setMessage('%s: %d of %d tiles (%.1f tiles/s)' % (self.shortName, done, total, tilesPerSecond))
+
+      def slideProcessor(self, job:pluginJob) -> 'tiledSlideProcessor':
+            # imported on first use, so that importing plugins does not load openslide and the screening
+            from SlideRunner.processing.tiledplugin import tiledSlideProcessor, slideFingerprint, resultKey
+            stat = os.stat(job.slideFilename)
+            if (self.fingerprints.get(job.slideFilename, (None,None))[0] != (stat.st_size, stat.st_mtime)):
+                  self.fingerprints[job.slideFilename] = ((stat.st_size, stat.st_mtime), slideFingerprint(job.slideFilename))
+            parameters = (self.tileSize, self.tileLevel, tuple(self.resultSize), self.resultChannels, np.dtype(self.resultType).str, self.tissueOnly)
+            key = resultKey(self.fingerprints[job.slideFilename][1], self.shortName, self.version, job.configuration, parameters)
+            if (key != self.processorKey):
+                  if (self.processor is not None):
+                        self.processor.stop()
+                  self.processor = tiledSlideProcessor(job.slideFilename, self.processTile, key, configuration=job.configuration,
+                                                       tileSize=self.tileSize, tileLevel=self.tileLevel, resultSize=self.resultSize,
+                                                       channels=self.resultChannels, dtype=self.resultType, tissueOnly=self.tissueOnly,
+                                                       numWorkers=self.numWorkers, progress=self.reportProgress, error=self.reportError)
+                  self.processorKey = key
+            return self.processor
+
+      def returnOverlay(self, job:pluginJob):
+            self.returnImage(self.processor.overlay(job.coordinates, job.currentImage.shape[0:2], interpolation=self.interpolation), job.procId)
+
+      def queueWorker(self):
+            lastJob = None
+            while (True):
+                  try:
+                        job = pluginJob(self.inQueue.get(timeout=self.refreshInterval))
+                  except Empty:
+                        # more tiles have been processed in the meantime
+                        if (lastJob is not None) and (self.processor is not None) and (self.processor.changed.is_set()):
+                              self.processor.changed.clear()
+                              self.returnOverlay(lastJob)
+                        continue
+
+                  if (job.jobDescription == JobDescription.QUIT_PLUGIN_THREAD):
+                        if (self.processor is not None):
+                              self.processor.stop()
+                        return
+
+                  if (job.slideFilename is None) or (job.currentImage is None) or (job.coordinates is None):
+                        continue
+
+                  try:
+                        processor = self.slideProcessor(job)
+                  except Exception as e:
+                        self.setMessage('%s: unable to process slide: %s' % (self.shortName, str(e)))
+                        continue
+                  processor.prioritize(job.coordinates)
+                  processor.changed.clear()
+                  self.returnOverlay(job)
+                  lastJob = job
+
+
 class NonePlugin(SlideRunnerPlugin):
       outputType = PluginOutputType.NO_OVERLAY
       pluginType = PluginTypes.NONE_PLUGIN
 
+def annotationBoxes(annos:list) -> np.ndarray:
+      """
+          bounding boxes (x1,y1,x2,y2) of annotations, as given by their minCoordinates() and maxCoordinates().
+          For the annotation classes of SlideRunner_dataAccess (exactly these classes, not subclasses),
+          the boxes are computed per class in one array operation: coordinates of spots, circles and
+          rectangles are gathered into one array each, polygons are reduced together over their
+          concatenated coordinates.
+      """
+      boxes = np.zeros(shape=(len(annos),4))
+      byClass = dict()
+      for idx, anno in enumerate(annos):
+            byClass.setdefault(type(anno), []).append(idx)
+      for annoClass, indices in byClass.items():
+            group = [annos[idx] for idx in indices]
+            if (annoClass is rectangularAnnotation):
+                  boxes[indices] = np.array([(anno.x1, anno.y1, anno.x2, anno.y2) for anno in group], dtype=np.float64)
+            elif (annoClass is spotAnnotation):
+                  centers = np.array([(anno.x1, anno.y1) for anno in group], dtype=np.float64)
+                  boxes[indices] = np.hstack((centers-25, centers+25)) # as spotAnnotation.minCoordinates/maxCoordinates
+            elif (annoClass is circleAnnotation):
+                  circles = np.array([(anno.x1, anno.y1, anno.r) for anno in group], dtype=np.float64)
+                  boxes[indices] = np.hstack((circles[:,0:2]-circles[:,2:3], circles[:,0:2]+circles[:,2:3]))
+            elif (annoClass is polygonAnnotation):
+                  coordinates = [np.asarray(anno.coordinates)[:,0:2] for anno in group]
+                  starts = np.cumsum([0]+[len(coords) for coords in coordinates[:-1]])
+                  coordinates = np.concatenate(coordinates)
+                  boxes[indices] = np.hstack((np.minimum.reduceat(coordinates, starts), np.maximum.reduceat(coordinates, starts)))
+            else:
+                  boxes[indices] = [anno.minCoordinates().tolist()+anno.maxCoordinates().tolist() for anno in group]
+      return boxes
+
 def generateMinMaxCoordsList( annoList) -> Tuple[np.ndarray, np.ndarray]:
       # MinMaxCoords lists shows extreme coordinates from object, to decide if an object shall be shown
-      minCoords = np.zeros(shape=(len(annoList),2))
-      maxCoords = np.zeros(shape=(len(annoList),2))
-      for annokey in range(len(annoList)):
-            annotation = annoList[annokey]
-            minCoords[annokey] = np.asarray(annotation.minCoordinates().tolist())
-            maxCoords[annokey] = np.asarray(annotation.maxCoordinates().tolist())
-
-      return minCoords, maxCoords
+      boxes = annotationBoxes(annoList)
+      return boxes[:,0:2], boxes[:,2:4]
 
 def getVisibleAnnotations(leftUpper:list, rightLower:list, annotations:np.ndarray, minCoords:np.ndarray, maxCoords:np.ndarray) -> list:
 #      print('Getting visible annotations from: ',annotations, minCoords, maxCoords)
@@ -289,6 +732,75 @@ def getVisibleAnnotations(leftUpper:list, rightLower:list, annotations:np.ndarra
                               (maxCoords[:,1] > leftUpper[1]) & (minCoords[:,1] < rightLower[1]) )
       return np.array(annotations)[np.where(potentiallyVisible)[0]].tolist()
 
+class PluginAnnotationStore(object):
+      """
+          Array-backed list of plugin annotations.
+
+          The bounding boxes of all annotations are kept in contiguous numpy arrays,
+          which grow by doubling their capacity, so appending annotations does not
+          require a rebuild. Visibility queries return index arrays.
+      """
+      def __init__(self, annotations:list=None):
+            self.annotations = list()
+            self.minCoords = np.zeros(shape=(0,2))
+            self.maxCoords = np.zeros(shape=(0,2))
+            self.labels = np.zeros(shape=(0,), dtype=np.int64)
+            self.density = (None, None)
+            if (annotations is not None):
+                  self.extend(annotations)
+
+      def _reserve(self, size:int):
+            if (size <= self.minCoords.shape[0]):
+                  return
+            capacity = max(size, 2*self.minCoords.shape[0], 64)
+            minCoords = np.zeros(shape=(capacity,2))
+            maxCoords = np.zeros(shape=(capacity,2))
+            minCoords[:len(self.annotations)] = self.minCoords[:len(self.annotations)]
+            maxCoords[:len(self.annotations)] = self.maxCoords[:len(self.annotations)]
+            labels = np.zeros(shape=(capacity,), dtype=np.int64)
+            labels[:len(self.annotations)] = self.labels[:len(self.annotations)]
+            self.minCoords, self.maxCoords, self.labels = minCoords, maxCoords, labels
+
+      def append(self, anno:annotation):
+            self.extend([anno])
+
+      def extend(self, annos:list):
+            count = len(self.annotations)
+            self._reserve(count+len(annos))
+            boxes = annotationBoxes(annos)
+            self.minCoords[count:count+len(annos)] = boxes[:,0:2]
+            self.maxCoords[count:count+len(annos)] = boxes[:,2:4]
+            self.labels[count:count+len(annos)] = np.fromiter((-1 if anno.pluginAnnotationLabel is None else anno.pluginAnnotationLabel.uid for anno in annos),
+                                                              dtype=np.int64, count=len(annos))
+            # the annotations are appended last, so concurrent readers only see complete entries
+            self.annotations.extend(annos)
+
+      def visibleIndices(self, leftUpper:list, rightLower:list) -> np.ndarray:
+            count = len(self.annotations)
+            minCoords, maxCoords = self.minCoords[:count], self.maxCoords[:count]
+            potentiallyVisible =  ( (maxCoords[:,0] > leftUpper[0]) & (minCoords[:,0] < rightLower[0]) & 
+                                    (maxCoords[:,1] > leftUpper[1]) & (minCoords[:,1] < rightLower[1]) )
+            return np.where(potentiallyVisible)[0]
+
+      def densityMap(self) -> annotationDensityMap:
+            """
+                per-label density of all annotations, rebuilt when annotations were added
+            """
+            count = len(self.annotations)
+            if (self.density[0] != count):
+                  centers = (self.minCoords[:count]+self.maxCoords[:count])/2
+                  self.density = (count, annotationDensityMap(centers, self.labels[:count]))
+            return self.density[1]
+
+      def __getitem__(self, idx):
+            return self.annotations[idx]
+
+      def __iter__(self):
+            return iter(self.annotations)
+
+      def __len__(self):
+            return len(self.annotations)
+
 class activePlugins:
       """
           List of active SlideRunner plugins, and the capabilities to manage them
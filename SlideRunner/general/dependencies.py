@@ -99,9 +99,11 @@ def check_all_dependencies():
 
 import sys
 import traceback
-check_qt_dependencies()
+from SlideRunner.general.startupProfile import profile
+with profile.phase('dependency checks'):
+    check_qt_dependencies()
 
-check_all_dependencies()
+    check_all_dependencies()
 
 # The rest should now load fine
 
@@ -119,7 +121,7 @@ from SlideRunner.gui.dialogs.question import YesNoAbortDialog
 from SlideRunner.gui.dialogs.settings import settingsDialog
 from SlideRunner.gui.dialogs.dbmanager import DatabaseManager
 from SlideRunner.gui.dialogs.exactLinkDialog import ExactLinkDialog
-from SlideRunner.dataAccess.exact import ExactManager, ExactProcessError
+from SlideRunner.dataAccess.exact import ExactManager, ExactProcessError, ExactSyncScheduler
 from SlideRunner.gui.dialogs.exactDownloadDialog import ExactDownloadDialog
 from SlideRunner_dataAccess.slide import RotatableOpenSlide
 from SlideRunner.gui.dialogs.getCoordinates import getCoordinatesDialog
@@ -0,0 +1,69 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images.
+        In: Bildverarbeitung für die Medizin 2018.
+        Springer Vieweg, Berlin, Heidelberg, 2018. pp. 309-314.
+
+
+   This file: Rendering of class maps (e.g. segmentation or classification
+              results) as overlays for plugins
+
+   The part of the class map covering the viewport is cropped (and padded
+   where the viewport extends beyond the map) in one step, colourized by
+   indexing the palette with the labels, and scaled to the viewport with
+   nearest-neighbour interpolation into a preallocated buffer. All steps
+   work on the resolution of the class map, except for the final resize.
+
+"""
+import cv2
+import numpy as np
+
+
+class classMapRenderer(object):
+    """
+        Renders a class map with a palette of colors (RGB or RGBA per class). Classes
+        with alpha 0 are transparent, i.e. show the background image if one is given.
+    """
+    def __init__(self, colors, channels:int=3, border=(0,0,0,255)):
+        colors = np.uint8(colors)
+        # last entry: outside of the class map
+        self.palette = np.vstack((colors[:, 0:channels], np.uint8(border)[0:channels]))
+        self.transparent = np.append(colors[:,3]==0, False) if (colors.shape[1]>3) else np.zeros(len(self.palette), bool)
+        self.channels = channels
+
+    def labels(self, classMap, coordinates, factor:float) -> np.ndarray:
+        """
+            labels of the viewport (x,y,w,h, level 0 coordinates) in the class map (downsampled by factor,
+            numpy array or h5py dataset). Labels outside of the map point to the border entry of the palette.
+        """
+        x, y = int(coordinates[0]/factor), int(coordinates[1]/factor)
+        w, h = max(1, int(coordinates[2]/factor)), max(1, int(coordinates[3]/factor))
+        window = np.full((h, w), len(self.palette)-1, np.int32)
+        sx1, sy1 = max(x, 0), max(y, 0)
+        sx2, sy2 = min(x+w, classMap.shape[1]), min(y+h, classMap.shape[0])
+        if (sx2>sx1) and (sy2>sy1):
+            window[sy1-y:sy2-y, sx1-x:sx2-x] = np.clip(classMap[sy1:sy2, sx1:sx2], 0, len(self.palette)-2)
+        return window
+
+    def render(self, classMap, coordinates, factor:float, shape, dst:np.ndarray=None, background:np.ndarray=None) -> np.ndarray:
+        """
+            colourized viewport, scaled to shape (h,w). Written to dst (uint8, (h,w,channels)) if given.
+        """
+        window = self.labels(classMap, coordinates, factor)
+        dsize = (shape[1], shape[0])
+        image = cv2.resize(self.palette[window], dsize=dsize, dst=dst, interpolation=cv2.INTER_NEAREST)
+        if (background is not None) and np.any(self.transparent[window]):
+            mask = cv2.resize(np.uint8(self.transparent[window]), dsize=dsize, interpolation=cv2.INTER_NEAREST)
+            if (background.shape[2]==4) and (self.channels==3):
+                background = cv2.cvtColor(background, cv2.COLOR_RGBA2RGB)
+            cv2.copyTo(background, mask, image)
+        return image
@@ -1,9 +1,53 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images.
+        In: Bildverarbeitung für die Medizin 2018.
+        Springer Vieweg, Berlin, Heidelberg, 2018. pp. 309-314.
+
+
+   This file: Discovery of plugins
+
+   Plugins are discovered without importing them (their dependencies, e.g.
+   scipy, sklearn or h5py, take long to import): the class attributes of the
+   Plugin class needed for the menu (shortName, version, pluginType,
+   outputType, configurationList, ...) are read by a static parse of the
+   module source. The results are kept in a manifest file, which stays valid
+   as long as the plugin module is unchanged. The module is imported when the
+   plugin is enabled for the first time (lazyPlugin.load()).
+
+   Plugins whose attributes can not be parsed statically are imported at
+   startup. Set SLIDERUNNER_PLUGIN_DISCOVERY=import to import all plugins at
+   startup. Discovery times of both modes are compared by running
+   python -m SlideRunner.general.pluginFinder
+
+"""
 import SlideRunner.plugins
+import SlideRunner.general.SlideRunnerPlugin as SlideRunnerPlugin
+import ast
 import pkgutil
 import importlib
 import inspect
+import logging
+import os
+import pickle
+import time
+
+from SlideRunner.general.types import lazyPlugin
 
-from SlideRunner.general.types import pluginEntry
+defaultManifestFile = os.path.join(os.path.expanduser('~'), '.sliderunner', 'pluginmanifest.p')
+
+# attributes of the Plugin class stored in the manifest
+manifestAttributes = ['shortName', 'version', 'description', 'pluginType', 'outputType', 'configurationList',
+                      'initialOpacity', 'updateTimer', 'executionMode', 'cacheResults']
 
 def iter_namespace(ns_pkg):
     # Specifying the second argument (prefix) to iter_modules makes the
@@ -12,33 +56,137 @@ def iter_namespace(ns_pkg):
     # the name.
     return pkgutil.iter_modules(ns_pkg.__path__, ns_pkg.__name__ + ".")
 
-sliderunner_plugins={}
 
-for finder, name, ispkg in sorted(iter_namespace(SlideRunner.plugins)):
+def parsePlugin(filename:str) -> dict:
+    """
+        reads the manifest attributes of the Plugin class from the module source, without
+        importing it. Attribute values may only refer to the SlideRunnerPlugin module.
+        Returns None if the module does not contain a Plugin class that can be parsed this way.
+    """
+    with open(filename, 'rb') as f:
+        tree = ast.parse(f.read(), filename)
+
+    namespace = {'__builtins__' : {}, 'SlideRunnerPlugin' : SlideRunnerPlugin, 'list' : list, 'tuple' : tuple, 'dict' : dict}
+    def evaluate(node):
+        return eval(compile(ast.Expression(node), filename, 'eval'), namespace)
+
+    for node in tree.body:
+        if (isinstance(node, ast.ClassDef)) and (node.name == 'Plugin'):
+            try:
+                bases = [evaluate(base) for base in node.bases]
+                attributes = {name : getattr(bases[0], name) for name in manifestAttributes if hasattr(bases[0], name)} if len(bases)>0 else dict()
+                for statement in node.body:
+                    if (isinstance(statement, ast.Assign)):
+                        for target in statement.targets:
+                            if (isinstance(target, ast.Name)) and (target.id in manifestAttributes):
+                                attributes[target.id] = evaluate(statement.value)
+            except Exception:
+                return None
+            return attributes if 'shortName' in attributes else None
+    return None
+
+
+def loadManifest(filename:str) -> dict:
+    try:
+        with open(filename, 'rb') as f:
+            manifest = pickle.load(f)
+    except Exception:
+        return dict()
+    return manifest if isinstance(manifest, dict) else dict()
+
+
+def saveManifest(filename:str, manifest:dict):
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename+'.tmp', 'wb') as f:
+            pickle.dump(manifest, f)
+        os.replace(filename+'.tmp', filename)
+    except OSError as e:
+        print('Unable to write plugin manifest: ',e)
+
+
+def importPlugin(name:str):
+    """
+        imports the plugin module and returns its Plugin class (or None)
+    """
     try:
         mod = importlib.import_module(name)
-        sliderunner_plugins[name] = mod
     except Exception as e:
         print('+++ Unable to active plugin: '+name,e)
-        pass
+        return None
+    classes = dict(inspect.getmembers(mod, inspect.isclass))
+    return classes.get('Plugin', None)
+
 
+def discoverPlugins(mode:str='manifest', manifestFile:str=defaultManifestFile) -> list:
+    """
+        mode: 'manifest' (plugins are imported on first use) or 'import' (all plugins are imported)
+    """
+    # the manifest depends on the defaults of the plugin base classes, too
+    baseStat = os.stat(SlideRunnerPlugin.__file__)
+    baseKey = (baseStat.st_mtime_ns, baseStat.st_size)
+    manifest = loadManifest(manifestFile) if (mode == 'manifest') else dict()
+    if (manifest.get('__base__') != baseKey):
+        manifest = dict()
+    updated = {'__base__' : baseKey}
+    changed = (len(manifest) == 0)
 
-pluginList = list()
-shortNames=[]
+    pluginList = list()
+    shortNames = []
+    for finder, name, ispkg in sorted(iter_namespace(SlideRunner.plugins), key=lambda module: module[1]):
+        plugin = None
+        if (mode == 'manifest'):
+            filename = os.path.join(finder.path, name.split('.')[-1], '__init__.py') if ispkg else os.path.join(finder.path, name.split('.')[-1]+'.py')
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                stat = None
+            if (stat is not None):
+                fileKey = (filename, stat.st_mtime_ns, stat.st_size)
+                if (name in manifest) and (manifest[name][0] == fileKey):
+                    attributes = manifest[name][1]
+                else:
+                    try:
+                        attributes = parsePlugin(filename)
+                    except (OSError, SyntaxError, ValueError):
+                        attributes = None
+                    changed = True
+                updated[name] = (fileKey, attributes)
+                if (attributes is not None):
+                    plugin = lazyPlugin(name, attributes)
+        if (plugin is None):
+            plugin = importPlugin(name)
+        if (plugin is None):
+            continue
+        if plugin.shortName in shortNames:
+            print('++++ ERROR: Plugin has duplicate short name: ',plugin.shortName)
+            continue
+        shortNames.append(plugin.shortName)
+        pluginList.append(plugin)
 
-for plugin in sorted(sliderunner_plugins.keys()):
-    newPlugin = pluginEntry()
-    classes = inspect.getmembers(sliderunner_plugins[plugin], inspect.isclass)
-    for classIdx in range(len(classes)):
-        if (classes[classIdx][0] == 'Plugin'):
-            newPlugin = classes[classIdx][1]
-            if newPlugin.shortName in shortNames:
-                print('++++ ERROR: Plugin has duplicate short name: ',newPlugin.shortName)
-                continue
-            pluginList.append(newPlugin)
+    if (mode == 'manifest') and (changed or (updated.keys() != manifest.keys())):
+        saveManifest(manifestFile, updated)
+    return pluginList
 
 
-print('List of available plugins:')
+discoveryMode = os.environ.get('SLIDERUNNER_PLUGIN_DISCOVERY', 'manifest')
+t0 = time.time()
+pluginList = discoverPlugins(discoveryMode)
+discoveryTime = time.time()-t0
+
+# the discovery time is part of the startup profile (phase 'plugin discovery', see __main__)
+logger = logging.getLogger(__name__)
+logger.info('Plugin discovery (%s): %.1f ms, %d plugins', discoveryMode, 1000*discoveryTime, len(pluginList))
 for entry in pluginList:
-    print('%20s   Version %s' % (entry.shortName, entry.version))
+    logger.debug('%20s   Version %s', entry.shortName, entry.version)
+
 
+if __name__ == '__main__':
+    # compare discovery times: cold (no manifest), cached manifest and importing all plugins
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        manifestFile = os.path.join(directory, 'pluginmanifest.p')
+        for label, mode in [('static parse', 'manifest'), ('cached manifest', 'manifest'), ('import', 'import')]:
+            t0 = time.time()
+            plugins = discoverPlugins(mode, manifestFile)
+            print('%-16s %3d plugins  %8.1f ms' % (label, len(plugins), 1000*(time.time()-t0)))
@@ -0,0 +1,266 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images.
+        In: Bildverarbeitung für die Medizin 2018.
+        Springer Vieweg, Berlin, Heidelberg, 2018. pp. 309-314.
+
+
+   This file: Execution of plugins in a worker process
+
+   Plugins with executionMode = PluginExecutionMode.PROCESS keep the UI
+   responsive while running CPU-heavy, GIL-holding code. The plugin class is
+   instantiated a second time in a worker process (spawned, so that no Qt
+   state is inherited), where its queueWorker runs unchanged:
+
+       inQueue    jobs are forwarded from the plugin's mailbox, one at a time,
+                  when the worker asks for the next one. Pending jobs are thus
+                  coalesced in the mailbox while the worker is busy.
+       outQueue   returned images are sent back to the plugin's outQueue
+       statusQueue  status messages are forwarded to SlideRunner's status queue
+
+   Images are passed as SharedFrame references (see SharedFrameRing), only the
+   reference is pickled. Job images are published once into viewerFrameRing()
+   and retained until the worker asks for the next job, i.e. a worker must not
+   keep job images beyond its current job. Returned images are sent without
+   pickling if they were allocated with overlayBuffer(), and copied once on
+   receipt, since the worker reuses the slot. All other parts of a job are pickled, except for
+   the opened database, which can not be shared between processes and is
+   passed as None. Cancellation of the job in progress (job.cancelled) is
+   propagated to the worker.
+
+   The plugin instance in the SlideRunner process serves the UI (labels,
+   annotations, click handling). It is updated with the annotations and labels
+   sent by the worker.
+
+"""
+import importlib
+import multiprocessing
+import queue
+import threading
+import numpy as np
+import SlideRunner.general.SlideRunnerPlugin as SlideRunnerPlugin
+
+
+viewerFrames = None
+
+def viewerFrameRing() -> SlideRunnerPlugin.SharedFrameRing:
+    """
+        ring the viewport images are published in, shared by all plugins in process
+        execution mode: an image sent to several plugins is copied only once
+    """
+    global viewerFrames
+    if (viewerFrames is None):
+        viewerFrames = SlideRunnerPlugin.SharedFrameRing(slots=8)
+    return viewerFrames
+
+
+class remoteCancellationToken(object):
+    """
+        Cancellation token of a job in the worker process, cancelled by the SlideRunner process
+    """
+    def __init__(self, sequence:int, cancelledJob):
+        self.sequence = sequence
+        self.cancelledJob = cancelledJob
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancelledJob.value == self.sequence
+
+    def cancel(self):
+        self.cancelledJob.value = self.sequence
+
+
+class workerInbox(object):
+    """
+        inQueue of the plugin in the worker process. Asks the SlideRunner process
+        for the next job on get(), i.e. when the plugin has finished the previous one.
+    """
+    def __init__(self, requestQueue, jobQueue, cancelledJob):
+        self.requestQueue = requestQueue
+        self.jobQueue = jobQueue
+        self.cancelledJob = cancelledJob
+        self.requested = False
+        self.quit = threading.Event()
+
+    def get(self, block=True, timeout=None):
+        if not (self.requested):
+            self.requestQueue.put(True)
+            self.requested = True
+        sequence, item = self.jobQueue.get(block, timeout)
+        self.requested = False
+        if (item is None):
+            return None
+        item = list(item)
+        if (item[0] == SlideRunnerPlugin.JobDescription.QUIT_PLUGIN_THREAD):
+            self.quit.set()
+        return tuple(item) + (remoteCancellationToken(sequence, self.cancelledJob),)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def empty(self) -> bool:
+        return self.jobQueue.empty()
+
+
+class workerOutbox(object):
+    """
+        outQueue of the plugin in the worker process
+    """
+    def __init__(self, resultQueue):
+        self.resultQueue = resultQueue
+        self.frames = SlideRunnerPlugin.SharedFrameRing(slots=3)
+
+    def put(self, item, block=True, timeout=None):
+        img, procId = item
+        if isinstance(img, np.ndarray):
+            frame = SlideRunnerPlugin.SharedFrameRing.find(img)
+            img = frame if frame is not None else self.frames.publish(img)
+        self.resultQueue.put((img, procId))
+
+    def put_nowait(self, item):
+        self.put(item)
+
+
+class workerStatusQueue(object):
+    """
+        statusQueue of the plugin in the worker process. Label updates carry the
+        labels, since they are requested by the UI from the SlideRunner-side instance.
+    """
+    def __init__(self, statusQueue):
+        self.statusQueue = statusQueue
+        self.instance = None
+
+    def put(self, item, block=True, timeout=None):
+        shortName, status, value = item
+        if (status == SlideRunnerPlugin.StatusInformation.UPDATE_LABELS) and (self.instance is not None):
+            value = self.instance.getAnnotationLabels()
+        self.statusQueue.put((shortName, status, value))
+
+    def put_nowait(self, item):
+        self.put(item)
+
+
+def workerMain(moduleName:str, className:str, requestQueue, jobQueue, cancelledJob, resultQueue, statusQueue):
+    pluginClass = getattr(importlib.import_module(moduleName), className)
+    inbox = workerInbox(requestQueue, jobQueue, cancelledJob)
+    pluginClass.inQueue = inbox
+    pluginClass.outQueue = workerOutbox(resultQueue)
+    status = workerStatusQueue(statusQueue)
+    instance = pluginClass(status)
+    status.instance = instance
+
+    inbox.quit.wait()
+    for thread in threading.enumerate():
+        if (thread is not threading.current_thread()) and (thread.name != 'QueueFeederThread'):
+            thread.join(timeout=5)
+
+
+class pluginProcessHost(object):
+    """
+        Runs the queueWorker of pluginClass in a worker process and connects it
+        to the plugin's inQueue/outQueue and the SlideRunner status queue.
+    """
+    def __init__(self, pluginClass, statusQueue, instance):
+        self.pluginClass = pluginClass
+        self.statusQueue = statusQueue
+        self.instance = instance
+        self.mailbox = pluginClass.inQueue
+        self.pendingFrame = None
+
+        context = multiprocessing.get_context('spawn')
+        self.requestQueue = context.Queue()
+        self.jobQueue = context.Queue()
+        self.cancelledJob = context.Value('l', 0)
+        self.resultQueue = context.Queue()
+        self.workerStatusQueue = context.Queue()
+        self.process = context.Process(target=workerMain, daemon=True,
+                                       args=(pluginClass.__module__, pluginClass.__name__, self.requestQueue, self.jobQueue, self.cancelledJob, self.resultQueue, self.workerStatusQueue))
+        self.process.start()
+
+        for target in [self.forwardJobs, self.receiveResults, self.receiveStatus]:
+            threading.Thread(target=target, daemon=True).start()
+
+    def releasePendingFrame(self):
+        if (self.pendingFrame is not None):
+            viewerFrameRing().release(self.pendingFrame)
+            self.pendingFrame = None
+
+    def forwardJobs(self):
+        sequence, token = 0, None
+        while (True):
+            try:
+                self.requestQueue.get(timeout=0.05)
+            except queue.Empty:
+                # job in progress was superseded in the mailbox
+                if (token is not None) and (token.cancelled):
+                    self.cancelledJob.value = sequence
+                    token = None
+                continue
+            # the worker is done with the previous image, when it asks for the next job
+            self.releasePendingFrame()
+            item = self.mailbox.get()
+            sequence += 1
+            if (item is None):
+                self.jobQueue.put((sequence, None))
+                continue
+            token = item[10] if len(item)>10 else None
+            job = list(item[0:10])
+            if isinstance(job[1], np.ndarray):
+                frames = viewerFrameRing()
+                with frames.lock:
+                    job[1] = self.pendingFrame = frames.publish(job[1])
+                    frames.retain(self.pendingFrame)
+            job[9] = None # the opened database can not be passed to another process
+            self.jobQueue.put((sequence, tuple(job)))
+            if (job[0] == SlideRunnerPlugin.JobDescription.QUIT_PLUGIN_THREAD):
+                return
+
+    def receiveResults(self):
+        while (True):
+            img, procId = self.resultQueue.get()
+            if isinstance(img, SlideRunnerPlugin.SharedFrame):
+                img = SlideRunnerPlugin.receivedImage(img)
+                if (img is None): # slot reused already, a newer result follows
+                    continue
+            self.pluginClass.outQueue.put((img, procId))
+
+    def receiveStatus(self):
+        while (True):
+            shortName, status, value = self.workerStatusQueue.get()
+            if (status == SlideRunnerPlugin.StatusInformation.ANNOTATIONS):
+                self.instance.getAnnotations = lambda annotations=value: annotations
+            elif (status == SlideRunnerPlugin.StatusInformation.UPDATE_LABELS):
+                if (value is not None):
+                    self.instance.getAnnotationLabels = lambda labels=value: labels
+                value = None
+            self.statusQueue.put((shortName, status, value))
+
+
+def instantiatePlugin(pluginClass, statusQueue):
+    """
+        creates the plugin instance used by the UI. For plugins in process
+        execution mode, the queueWorker is started in a worker process.
+    """
+    if (getattr(pluginClass, 'executionMode', SlideRunnerPlugin.PluginExecutionMode.THREAD) != SlideRunnerPlugin.PluginExecutionMode.PROCESS):
+        return pluginClass(statusQueue)
+
+    # The worker thread started by the constructor of the plugin waits on a mailbox that
+    # never receives a job, the jobs of the plugin's inQueue are processed by the worker process.
+    mailbox, idle = pluginClass.inQueue, SlideRunnerPlugin.PluginMailbox()
+    pluginClass.inQueue = idle
+    try:
+        instance = pluginClass(statusQueue)
+    finally:
+        pluginClass.inQueue = mailbox
+    instance.inQueue = idle
+    instance.processHost = pluginProcessHost(pluginClass, statusQueue, instance)
+    return instance
@@ -0,0 +1,137 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images.
+        In: Bildverarbeitung für die Medizin 2018.
+        Springer Vieweg, Berlin, Heidelberg, 2018. pp. 309-314.
+
+
+   This file: Timeline of the startup of SlideRunner
+
+   Started with --profile-startup[=filename.json], SlideRunner records the
+   phases of its startup (imports, dependency checks, plugin discovery,
+   QSettings, database and slide opening) and the time the main window is
+   shown and the first frame of the slide is painted. When startup is
+   complete, the timeline is printed as a table and written as JSON
+   (default: sliderunner_startup.json).
+
+   Durations are checked against the budget in startupBudget.json (seconds
+   per phase, summed over phases of the same name, and for the marks the
+   time since start), so that regressions show up.
+
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+
+defaultBudgetFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startupBudget.json')
+
+
+class startupProfiler(object):
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.enabled = False
+        self.finished = False
+        self.filename = None
+        self.phases = list()
+        self.marks = dict()
+        self.depth = 0
+        self.finishMarks = None
+
+    def enable(self, filename:str='sliderunner_startup.json'):
+        self.enabled = True
+        self.filename = filename
+
+    def now(self) -> float:
+        return time.perf_counter()-self.start
+
+    @contextmanager
+    def phase(self, name:str):
+        if not (self.enabled) or (self.finished):
+            yield
+            return
+        start = self.now()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            self.phases.append({'phase' : name, 'start' : start, 'duration' : self.now()-start, 'depth' : self.depth})
+
+    def mark(self, name:str):
+        """
+            records the time of an event (e.g. first frame painted), once
+        """
+        if not (self.enabled) or (self.finished) or (name in self.marks):
+            return
+        self.marks[name] = self.now()
+        if (self.finishMarks is not None) and all([mark in self.marks for mark in self.finishMarks]):
+            self.finish()
+
+    def finishWhen(self, marks:list):
+        """
+            startup is complete when all marks have been recorded
+        """
+        self.finishMarks = list(marks)
+        if all([mark in self.marks for mark in self.finishMarks]):
+            self.finish()
+
+    def durations(self) -> dict:
+        durations = dict()
+        for phase in self.phases:
+            durations[phase['phase']] = durations.get(phase['phase'], 0) + phase['duration']
+        durations.update(self.marks)
+        return durations
+
+    def checkBudget(self, budget:dict) -> dict:
+        """
+            returns phases and marks exceeding the budget, with their duration and budget
+        """
+        durations = self.durations()
+        return {name : (durations[name], limit) for name, limit in budget.items() if (name in durations) and (durations[name] > limit)}
+
+    def table(self) -> str:
+        events = sorted([(phase['start'], phase['start']+phase['duration'], '  '*phase['depth']+phase['phase']) for phase in self.phases] +
+                        [(at, at, mark) for mark, at in self.marks.items()], key=lambda event: (event[0], -event[1]))
+        lines = ['%-32s %10s %10s' % ('Phase', 'Start [s]', 'Duration [s]')]
+        for start, end, name in events:
+            lines.append('%-32s %10.3f %10s' % (name, start, ('%.3f' % (end-start)) if end>start else '-'))
+        return '\n'.join(lines)
+
+    def finish(self, budgetFile:str=defaultBudgetFile):
+        if not (self.enabled) or (self.finished):
+            return
+        self.finished = True
+        try:
+            with open(budgetFile, 'r') as f:
+                budget = json.load(f)
+        except (OSError, ValueError) as e:
+            print('Unable to read startup budget: ',e)
+            budget = dict()
+        exceeded = self.checkBudget(budget)
+
+        print('Startup profile:')
+        print(self.table())
+        for name, (duration, limit) in exceeded.items():
+            print('+++ Startup budget exceeded: %s took %.3f s (budget: %.3f s)' % (name, duration, limit))
+
+        try:
+            with open(self.filename, 'w') as f:
+                json.dump({'phases' : self.phases, 'marks' : self.marks, 'budget' : budget,
+                           'exceeded' : {name : duration for name, (duration, limit) in exceeded.items()}}, f, indent=2)
+            print('Startup profile written to ',self.filename)
+        except OSError as e:
+            print('Unable to write startup profile: ',e)
+
+
+profile = startupProfiler()
@@ -1,3 +1,5 @@
+import importlib
+
 class pluginEntry:
     mainClass = None
     commonName = None
@@ -8,4 +10,23 @@ class pluginEntry:
     receiverThread = None
 
     def __str__(self):
-        return self.commonName
\ No newline at end of file
+        return self.commonName
+
+class lazyPlugin(object):
+    """
+        Plugin discovered from the plugin manifest (see pluginFinder), carrying the attributes
+        needed for the menu. load() imports the plugin module and returns the Plugin class.
+    """
+    def __init__(self, moduleName:str, attributes:dict):
+        self.moduleName = moduleName
+        self.pluginClass = None
+        for name, value in attributes.items():
+            setattr(self, name, value)
+
+    def load(self):
+        if (self.pluginClass is None):
+            self.pluginClass = getattr(importlib.import_module(self.moduleName), 'Plugin')
+        return self.pluginClass
+
+    def __str__(self):
+        return self.shortName
@@ -14,6 +14,7 @@ cmaps = ['viridis', 'plasma', 'inferno', 'magma', 'cividis', 'Greys', 'Purples',
             'gist_rainbow', 'rainbow', 'jet', 'nipy_spectral', 'gist_ncar']
 
 GuidedScreeningThresholdOptions = ['OTSU','high','med','low','off']
+AnnotationLODOptions = [0, 4, 8, 16, 32, 64]
 
 def saveAndClose(ev, d: QDialog, elem:dict, settingsObject):
     cmap = cmaps[elem['combo_colorbar'].currentIndex()]
@@ -27,6 +28,8 @@ def saveAndClose(ev, d: QDialog, elem:dict, settingsObject):
     settingsObject.setValue('exactHostname',elem['exactHostname'].text() )
     settingsObject.setValue('exactUsername',elem['exactUsername'].text() )
     settingsObject.setValue('exactPassword',elem['exactPassword'].text() )
+    settingsObject.setValue('ProgressiveRendering', elem['progressive'].currentIndex())
+    settingsObject.setValue('AnnotationLODDownsample', AnnotationLODOptions[elem['combo_lod'].currentIndex()])
 
     d.close()
 
@@ -134,8 +137,29 @@ def settingsDialog(settingsObject):
     layout.addWidget(labelPassword, 7, 0)
     layout.addWidget(editPassword, 7, 1)
 
+    labelProgressive = QtWidgets.QLabel('Progressive rendering:')
+    c3 = QtWidgets.QComboBox()
+    for item in ['disabled','enabled']:
+        c3.addItem(item)
+    c3.setCurrentIndex(int(settingsObject.value('ProgressiveRendering', 1)))
+    elem['progressive'] = c3
+
+    layout.addWidget(labelProgressive, 8, 0)
+    layout.addWidget(c3, 8, 1)
+
+    labelLOD = QtWidgets.QLabel('Annotation density map beyond zoom:')
+    c4 = QtWidgets.QComboBox()
+    for item in AnnotationLODOptions:
+        c4.addItem('off' if item==0 else '%dx' % item)
+    lod = int(float(settingsObject.value('AnnotationLODDownsample', 16)))
+    c4.setCurrentIndex(AnnotationLODOptions.index(lod) if lod in AnnotationLODOptions else 0)
+    elem['combo_lod'] = c4
+
+    layout.addWidget(labelLOD, 9, 0)
+    layout.addWidget(c4, 9, 1)
+
     b1 = QPushButton("ok",d)
-    layout.addWidget(b1, 8, 1)
+    layout.addWidget(b1, 10, 1)
     b1.clicked.connect(partial(saveAndClose, d=d, elem=elem, settingsObject=settingsObject))
 
 
@@ -21,7 +21,8 @@ from PyQt6 import QtWidgets, QtCore, QtGui
 import cv2
 import os
 
-import SlideRunner.general.pluginFinder
+from SlideRunner.general.pluginProcess import instantiatePlugin
+from SlideRunner.general.types import lazyPlugin
 def defineMenu(self, MainWindow, pluginList, initial=True):
         if (initial):
                 self.menubar = QtWidgets.QMenuBar(MainWindow)
@@ -186,7 +187,8 @@ def definePluginMenu(self,pluginList):
 
         self.ui.pluginItems = list()
         for plugin in pluginList:
-                plugin.instance = plugin(self.progressBarQueue)
+                if not isinstance(plugin, lazyPlugin): # plugins from the manifest are instantiated when enabled
+                        plugin.instance = instantiatePlugin(plugin, self.progressBarQueue)
                 menuItem = pluginMenu.addAction(plugin.shortName, partial(self.togglePlugin, plugin))
                 menuItem.setCheckable(True)
                 menuItem.setEnabled(True)
@@ -26,6 +26,7 @@ import matplotlib.path as path
 import cv2
 from SlideRunner.gui import annotation as GUIannotation
 from SlideRunner.general import SlideRunnerPlugin
+from SlideRunner.processing.compositor import boundingRect
 from SlideRunner_dataAccess.annotations import *
 
 def doubleClick(self, event):
@@ -102,6 +103,7 @@ def moveImage(self, event):
     if (modifiers == Qt.KeyboardModifier.ControlModifier) and (self.dragPoint):
         cx,cy = self.screenToSlide((posx,posy))
         self.db.annotations[self.drag_id[0]].coordinates[self.drag_id[1],:] = [cx,cy]
+        self.db.annotationsChanged(self.drag_id[0])
         self.showImage()
 
     if (modifiers == Qt.KeyboardModifier.ShiftModifier) or (self.ui.clickToMove):
@@ -121,32 +123,35 @@ def moveImage(self, event):
 
     if (self.ui.mode == UIMainMode.MODE_ANNOTATE_AREA) & (self.ui.annotationMode>0):
         self.ui.annotationMode=2
-        tempimage = np.copy(self.displayedImage)
-        pt2 = (posx,posy)
+        pt1, pt2 = self.ui.anno_pt1, (posx,posy)
 
-        cv2.rectangle(img=tempimage, pt1=self.ui.anno_pt1, pt2=pt2, thickness=2, color=[127,127,127,255])
+        def rubberBand(tempimage):
+            cv2.rectangle(img=tempimage, pt1=pt1, pt2=pt2, thickness=2, color=[127,127,127,255])
+            return boundingRect([pt1, pt2], margin=2)
 
-        self.ui.MainImage.setPixmap(QPixmap.fromImage(self.toQImage(tempimage)))
+        self.showInteractiveLayer(rubberBand)
     if (self.ui.mode == UIMainMode.MODE_ANNOTATE_CIRCLE) & (self.ui.annotationMode>0):
         self.ui.annotationMode=2
-        tempimage = np.copy(self.displayedImage)
-        pt2 = (posx,posy)
-        radius = int(np.sqrt(np.square(pt2[1]-self.ui.anno_pt1[1])+np.square(pt2[0]-self.ui.anno_pt1[0])))
-        cv2.circle(img=tempimage, center=self.ui.anno_pt1, radius=radius, thickness=2, color=[127,127,127,255])
+        pt1, pt2 = self.ui.anno_pt1, (posx,posy)
+        radius = int(np.sqrt(np.square(pt2[1]-pt1[1])+np.square(pt2[0]-pt1[0])))
 
-        self.ui.MainImage.setPixmap(QPixmap.fromImage(self.toQImage(tempimage)))
+        def rubberBand(tempimage):
+            cv2.circle(img=tempimage, center=pt1, radius=radius, thickness=2, color=[127,127,127,255])
+            return boundingRect([pt1], margin=radius+2)
+
+        self.showInteractiveLayer(rubberBand)
 
     if (self.ui.mode == UIMainMode.MODE_ANNOTATE_WAND):
         if (self.ui.wandAnnotation.x is not None):
             self.ui.wandAnnotation.tolerance = min(100,max(2,np.abs(self.screenToSlide(getMouseEventPosition(self,event))[0]-self.ui.wandAnnotation.x)))
-            self.showImage()
+            self.showInteractiveLayer()
 
     if not (modifiers == Qt.KeyboardModifier.ShiftModifier) and (self.ui.mode == UIMainMode.MODE_ANNOTATE_POLYGON) & (self.ui.annotationMode>0):
         self.ui.moveDots+=1
         if (len(self.ui.annotationsList)>0) and all([abs(a-p)<3 for a,p in zip(self.slideToScreen(self.ui.annotationsList[-1]),getMouseEventPosition(self,event))]):
             return      
         self.ui.annotationsList.append(self.screenToSlide(getMouseEventPosition(self,event)))            
-        self.showImage()
+        self.showInteractiveLayer()
 
 
 def leftClickImage(self, event):
@@ -258,7 +263,7 @@ def leftClickImage(self, event):
             if (len(self.ui.annotationsList)>0) and all([abs(a-p)<3 for a,p in zip(self.slideToScreen(self.ui.annotationsList[-1]),getMouseEventPosition(self,event))]):
                 return      
             self.ui.annotationsList.append(self.screenToSlide(getMouseEventPosition(self,event)))            
-        self.showImage()
+        self.showInteractiveLayer()
 
 def getMouseEventPosition(self,event):
     """
@@ -33,7 +33,7 @@ import SlideRunner_dataAccess.annotations as annotations
 class Plugin(SlideRunnerPlugin.SlideRunnerPlugin): 
     version = 0.0
     shortName = 'High Power Field Visualization'
-    inQueue = Queue()
+    inQueue = SlideRunnerPlugin.PluginMailbox()
     outQueue = Queue()
     description = 'Display size of 1 HPF'
     pluginType = SlideRunnerPlugin.PluginTypes.WHOLESLIDE_PLUGIN
@@ -37,7 +37,7 @@ import openslide
 class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
     version = 0.1
     shortName = 'Mitosis Heatmap'
-    inQueue = Queue()
+    inQueue = SlideRunnerPlugin.PluginMailbox()
     outQueue = Queue()
     initialOpacity=0.6
     updateTimer=0.1
@@ -35,7 +35,7 @@ import matplotlib.path as path
 class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
     version = 0.1
     shortName = 'Object Detection Results'
-    inQueue = Queue()
+    inQueue = SlideRunnerPlugin.PluginMailbox()
     outQueue = Queue()
     initialOpacity=1.0
     updateTimer=0.1
@@ -101,7 +101,7 @@ class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
             [foo,self.ext] = os.path.splitext(oldArchive)
             self.ext = self.ext.upper()
 
-            self.annos = list()
+            self.annos = SlideRunnerPlugin.PluginAnnotationStore()
 
             if (self.ext=='.P'): # Pickled format - results for many slides
                 self.resultsArchive = pickle.load(open(oldArchive,'rb'))
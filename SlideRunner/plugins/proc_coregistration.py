@@ -372,7 +372,7 @@ class WSI_Matcher:
 class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
     version = 0.1
     shortName = 'Re-Stained WSI Registration (Jiang et al.)'
-    inQueue = Queue()
+    inQueue = SlideRunnerPlugin.PluginMailbox()
     outQueue = Queue()
     updateTimer=0.5
     outputType = SlideRunnerPlugin.PluginOutputType.RGB_OVERLAY
@@ -48,7 +48,7 @@ parameters = {
 class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
     version = 0.1
     shortName = 'Quad-Tree-based WSI Registration (Marzahl et al.)'
-    inQueue = Queue()
+    inQueue = SlideRunnerPlugin.PluginMailbox()
     outQueue = Queue()
     updateTimer=0.5
     outputType = SlideRunnerPlugin.PluginOutputType.RGB_OVERLAY
@@ -8,7 +8,7 @@ import numpy as np
 class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
     version = 0.1
     shortName = 'Countdown'
-    inQueue = Queue()
+    inQueue = SlideRunnerPlugin.PluginMailbox()
     outQueue = Queue()
     updateTimer=0.5
     description = 'Count database objects down to zero'
@@ -9,12 +9,13 @@ import numpy as np
 class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
     version = 0.1
     shortName = 'OTSU threshold'
-    inQueue = Queue()
+    inQueue = SlideRunnerPlugin.PluginMailbox()
     outQueue = Queue()
     updateTimer=0.5
     outputType = SlideRunnerPlugin.PluginOutputType.HEATMAP
     description = 'Apply simple OTSU threshold on the current image'
     pluginType = SlideRunnerPlugin.PluginTypes.IMAGE_PLUGIN
+    cacheResults = True
     
     def __init__(self, statusQueue:Queue):
         self.statusQueue = statusQueue
@@ -40,9 +41,10 @@ class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
 
             gray = cv2.cvtColor(rgb,cv2.COLOR_RGB2GRAY)
             # OTSU thresholding
-            ret, thresh = cv2.threshold(gray,0,255,cv2.THRESH_BINARY_INV+cv2.THRESH_OTSU)
+            thresh = self.overlayBuffer(gray.shape, np.uint8)
+            ret, _ = cv2.threshold(gray,0,1,cv2.THRESH_BINARY_INV+cv2.THRESH_OTSU, dst=thresh)
 
-            self.returnImage(np.float32(thresh/255.0), job.procId)
+            self.returnImage(thresh, job.procId)
             self.setMessage('OTSU calculation done.')
             print('OTSU plugin: done')
             self.setProgressBar(-1)
@@ -36,12 +36,13 @@ import matplotlib.pyplot as plt
 class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
     version = 0.1
     shortName = 'Positive Pixel Count (Aperio)'
-    inQueue = Queue()
+    inQueue = SlideRunnerPlugin.PluginMailbox()
     outQueue = Queue()
     initialOpacity=1.0
     outputType = SlideRunnerPlugin.PluginOutputType.RGB_IMAGE
     description = 'H&E Image normalization (Method by Macenko)'
     pluginType = SlideRunnerPlugin.PluginTypes.IMAGE_PLUGIN
+    cacheResults = True
     configurationList = list((SlideRunnerPlugin.PluginConfigurationEntry(uid=0, name='Hue value', initValue=0.04, minValue=0.0, maxValue=1.0),
                             SlideRunnerPlugin.PluginConfigurationEntry(uid=1, name='Hue width', initValue=0.08, minValue=0.0, maxValue=1.0),
                             SlideRunnerPlugin.PluginConfigurationEntry(uid=2, name='Saturation threshold', initValue=0.2, minValue=0.0, maxValue=1.0),
@@ -69,7 +70,8 @@ class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
                 quitSignal=True
                 continue
 
-            rgb = np.copy(image[:,:,0:3])
+            rgb = self.overlayBuffer(image.shape[0:2]+(3,), np.uint8)
+            np.copyto(rgb, image[:,:,0:3])
 
             # Convert to HSV
             hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)
@@ -127,7 +129,7 @@ class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
                 plt.hist(img_hsv[:,0],255)
                 plt.savefig('histo_limited.pdf')
 
-            self.returnImage(np.float32(rgb))
+            self.returnImage(rgb, job.procId)
             self.statusQueue.put((1, 'PPC: Total: %d    Weak: %d   Medium: %d   Strong: %d ' % (np.prod(rgb.shape[0:2]),np.sum(weak),np.sum(medium),np.sum(strong)) ))
 
 
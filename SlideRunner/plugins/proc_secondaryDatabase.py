@@ -37,7 +37,7 @@ from SlideRunner_dataAccess.database import Database, hex_to_rgb
 class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
     version = 0.1
     shortName = 'Secondary database visualization'
-    inQueue = Queue()
+    inQueue = SlideRunnerPlugin.PluginMailbox()
     outQueue = Queue()
     initialOpacity=1.0
     updateTimer=0.1
@@ -0,0 +1,53 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images.
+        In: Bildverarbeitung für die Medizin 2018.
+        Springer Vieweg, Berlin, Heidelberg, 2018. pp. 309-314.
+
+        This file:
+	   Whole-slide heatmap of hematoxylin-stained area (colour deconvolution per tile)
+
+"""
+
+import SlideRunner.general.SlideRunnerPlugin as SlideRunnerPlugin
+from queue import Queue
+import cv2
+import numpy as np
+
+# stain vectors (optical density) of hematoxylin, eosin and DAB (Ruifrok and Johnston, 2001)
+STAINS = np.array([[0.65, 0.70, 0.29],
+                   [0.07, 0.99, 0.11],
+                   [0.27, 0.57, 0.78]])
+UNMIXING = np.float32(np.linalg.inv(STAINS / np.linalg.norm(STAINS, axis=1, keepdims=True)))
+
+
+class Plugin(SlideRunnerPlugin.WholeSlideTilePlugin):
+    version = 0.1
+    shortName = 'Hematoxylin density (WSI)'
+    inQueue = SlideRunnerPlugin.PluginMailbox()
+    outQueue = Queue()
+    initialOpacity = 0.5
+    updateTimer = 0.1
+    description = 'Share of hematoxylin-stained area, computed for the whole slide'
+    tileSize = 512
+    resultSize = (16,16)
+    configurationList = list((
+                            SlideRunnerPlugin.PluginConfigurationEntry(uid='threshold', name='Hematoxylin threshold', initValue=0.3, minValue=0.0, maxValue=1.0),
+                            ))
+
+    def processTile(self, tile:np.ndarray, configuration:dict) -> np.ndarray:
+        rgb = np.float32(tile[:,:,0:3])
+        rgb[tile[:,:,3]==0] = 255 # outside of the slide
+        od = -np.log((rgb+1)/256)
+        hematoxylin = np.dot(od.reshape(-1,3), UNMIXING[:,0]).reshape(rgb.shape[0:2])
+        stained = np.float32(hematoxylin > configuration['threshold'])
+        return cv2.resize(stained, dsize=self.resultSize, interpolation=cv2.INTER_AREA)
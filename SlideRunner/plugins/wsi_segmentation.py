@@ -1,4 +1,6 @@
 import SlideRunner.general.SlideRunnerPlugin as SlideRunnerPlugin
+from SlideRunner.general.overlayRendering import classMapRenderer
+from SlideRunner.dataAccess.overlaysource import hdf5OverlaySource
 from threading import Thread
 from queue import Queue
 import cv2
@@ -12,7 +14,7 @@ import openslide
 class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
     version = 0.1
     shortName = 'WSI Segmentation Overlay'
-    inQueue = Queue()
+    inQueue = SlideRunnerPlugin.PluginMailbox()
     outQueue = Queue()
     initialOpacity = 0.6
     updateTimer = 0.1
@@ -41,6 +43,7 @@ class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
 
     def __init__(self, statusQueue: Queue):
         self.statusQueue = statusQueue
+        self.renderer = classMapRenderer(self.COLORS)
         self.p = Thread(target=self.queueWorker, daemon=True)
         self.p.start()
         pass
@@ -78,43 +81,30 @@ class Plugin(SlideRunnerPlugin.SlideRunnerPlugin):
             oldSlide = job.slideFilename
             oldCoordinates = job.coordinates
 
-            self.slideObj = openslide.open_slide(job.slideFilename)
+            if (slideChanged):
+                self.slideObj = openslide.open_slide(job.slideFilename)
 
             if (fileChanged):
-                self.resultsArchive = h5py.File(oldArchive, "r")
-                self.factor = 64
+                if (getattr(self, 'source', None) is not None):
+                    self.source.close()
+                self.source = hdf5OverlaySource(oldArchive, "segmentation")
                 if "openslide.bounds-x" in self.slideObj.properties:
                     new_dimensions = ((int(self.slideObj.properties["openslide.bounds-width"]) + int(
                         self.slideObj.properties["openslide.bounds-x"])), (
                                                   int(self.slideObj.properties["openslide.bounds-height"]) + int(
                                               self.slideObj.properties["openslide.bounds-y"])))
-                    self.ds = int(np.round(self.factor / (new_dimensions[0] / self.resultsArchive["segmentation"].shape[1])))
+                    self.factor = new_dimensions[0] / self.source.shape[1]
                 else:
-                    self.ds = int(np.round(self.factor / (self.slideObj.dimensions[0] / self.resultsArchive["segmentation"].shape[1])))
-                self.downsampledMap = self.resultsArchive["segmentation"][::self.ds, ::self.ds]
+                    self.factor = self.slideObj.dimensions[0] / self.source.shape[1]
 
                 self.scaleX = ((job.coordinates[2]) / job.currentImage.shape[1])
                 self.scaleY = ((job.coordinates[3]) / job.currentImage.shape[0])
                 print('Opened results container.')
-                print('Downsampled image: ', self.downsampledMap.shape)
-
-
-            if slideChanged:
-                self.slideObj = openslide.open_slide(job.slideFilename)
+                print('Segmentation map: ', self.source.shape, 'levels: ', [level.downsample for level in self.source.levels])
 
 
             print('returning overlay...')
-            current_shape = np.array(job.currentImage).shape
-            coords_overlay = np.int16(np.array(job.coordinates)/self.factor)
-            image = self.downsampledMap[
-                    max(coords_overlay[1], 0):min(coords_overlay[1] + coords_overlay[3], self.downsampledMap.shape[0]),
-                    max(coords_overlay[0], 0):min(coords_overlay[0] + coords_overlay[2],
-                                                  self.downsampledMap.shape[1])]
-            image = np.asarray([self.COLORS[i] for i in np.int16(image.flatten())],dtype=np.uint8).\
-                reshape((image.shape[0], image.shape[1], -1))
-            #plt.imsave("overlay_3dhistech_4373_161c.png", image[:,:,:3])
-            image = cv2.copyMakeBorder(image,np.abs(min(0, coords_overlay[1])),0,np.abs(min(0, coords_overlay[0])),0,cv2.BORDER_CONSTANT,value=(0,0,0,255))
-            image = cv2.copyMakeBorder(image,0,max(0,coords_overlay[3]-image.shape[0]),0,max(0,coords_overlay[2]-image.shape[1]),cv2.BORDER_CONSTANT,value=(0,0,0,255))
-            image = cv2.resize(image, dsize=(current_shape[1], current_shape[0]))
-
-            self.returnImage(np.float32(image[:,:,0:3]))
+            classMap, factor = self.source.view(job.coordinates, self.factor, job.currentImage.shape)
+            image = self.renderer.render(classMap, job.coordinates, factor, job.currentImage.shape,
+                                         dst=self.overlayBuffer(job.currentImage.shape[0:2]+(3,)))
+            self.returnImage(image)
@@ -15,5 +15,5 @@
 """
 
 
-__all__ = ['screening','thumbnail']
+__all__ = ['screening','thumbnail','tilecache','tiledreader','densitymap','compositor','tiledplugin','resultcache','stainnorm']
 
@@ -0,0 +1,168 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images.
+        In: Bildverarbeitung für die Medizin 2018.
+        Springer Vieweg, Berlin, Heidelberg, 2018. pp. 309-314.
+
+
+   This file: Layered composition of the main image
+
+   The displayed frame is composed of:
+
+       base          slide image of the viewport, including plugin overlays
+       annotations   premultiplied RGBA layer with all annotations, cached
+                     until the annotations or the viewport change
+       decorations   scale bar, label image and colour legend
+       interactive   rubber bands, polygons in progress and the wand
+
+   The interactive layer is drawn directly into the frame. Before it is drawn
+   again, only the rectangle it covered is restored from the composed image,
+   so moving the mouse does not copy or redraw the whole frame.
+
+   Composed image and frame are persistent buffers, reallocated only when the
+   size of the viewport changes. All full-frame passes are counted in
+   bytesCopied, so the copies per displayed frame can be logged.
+
+"""
+import cv2
+import numpy as np
+
+
+def boundingRect(points, margin:int=0):
+    """
+        returns the rectangle (x1,y1,x2,y2) enclosing all points, with a margin
+    """
+    points = np.asarray(points).reshape(-1,2)
+    if (points.shape[0]==0):
+        return None
+    x1, y1 = np.min(points, axis=0) - margin
+    x2, y2 = np.max(points, axis=0) + margin + 1
+    return (int(x1), int(y1), int(x2), int(y2))
+
+
+class layeredCompositor(object):
+
+    # background of a freshly drawn annotation layer. Its RGB part is not black,
+    # so that annotations drawn with an RGB color (i.e., alpha 0) can be told apart
+    background = [1,1,1,0]
+
+    def __init__(self):
+        self.annotations = None
+        self.annotationKey = None
+        self.inverseAlpha = None
+        self.annotationsEmpty = True
+        self.composed = None
+        self.frameValid = False
+        self.damage = None
+        self.buffers = dict()
+        self.bytesCopied = 0
+
+    def buffer(self, name:str, shape) -> np.ndarray:
+        """
+            returns a persistent buffer, which is reallocated only if the shape changed
+        """
+        buf = self.buffers.get(name)
+        if (buf is None) or (buf.shape != tuple(shape)):
+            buf = np.empty(shape, np.uint8)
+            self.buffers[name] = buf
+        return buf
+
+    def writableCopy(self, name:str, image:np.ndarray) -> np.ndarray:
+        """
+            copies image into the persistent buffer name, e.g. to modify it without touching the original
+        """
+        buf = self.buffer(name, image.shape)
+        np.copyto(buf, image)
+        self.bytesCopied += buf.nbytes
+        return buf
+
+    def resetStatistics(self) -> int:
+        """
+            returns the number of bytes copied since the last call
+        """
+        bytesCopied, self.bytesCopied = self.bytesCopied, 0
+        return bytesCopied
+
+    def invalidate(self):
+        """
+            forces the annotation layer to be redrawn for the next frame
+        """
+        self.annotationKey = None
+
+    def annotationLayer(self, shape, key, drawAnnotations) -> np.ndarray:
+        """
+            returns the annotation layer, calling drawAnnotations(layer) only
+            if the key or the shape of the frame changed
+        """
+        if (self.annotations is not None) and (self.annotations.shape == tuple(shape)) and (key is not None) and (self.annotationKey == key):
+            return self.annotations
+
+        layer = np.empty(shape, np.uint8)
+        layer[:,:] = self.background
+        drawAnnotations(layer)
+
+        untouched = np.all(layer == self.background, axis=2)
+        alpha = layer[:,:,3]
+        alpha[(alpha==0) & ~untouched] = 255
+        layer[untouched] = 0
+
+        self.annotations = layer
+        self.annotationsEmpty = bool(np.all(untouched))
+        self.inverseAlpha = cv2.cvtColor(np.ascontiguousarray(255-alpha), cv2.COLOR_GRAY2RGBA)
+        self.annotationKey = key
+        return layer
+
+    def composeAnnotations(self, base:np.ndarray) -> np.ndarray:
+        """
+            premultiplied alpha blending of the annotation layer over base, into the
+            persistent composed buffer. Decorations are drawn into the returned
+            image, before it is passed to setComposed.
+        """
+        composed = self.buffer('composed', base.shape)
+        if (self.annotations is None) or (self.annotationsEmpty) or (self.annotations.shape != base.shape):
+            np.copyto(composed, base)
+        else:
+            cv2.multiply(base, self.inverseAlpha, dst=composed, scale=1/255)
+            cv2.add(self.annotations, composed, dst=composed)
+        self.bytesCopied += composed.nbytes
+        return composed
+
+    def setComposed(self, composed:np.ndarray):
+        self.composed = composed
+        self.frameValid = False
+        self.damage = None
+
+    def drawInteractive(self, draw) -> np.ndarray:
+        """
+            replaces the interactive layer: restores the rectangle covered by
+            the last one and calls draw(frame), which returns the rectangle
+            (x1,y1,x2,y2) it has drawn into (or None).
+        """
+        if (self.composed is None):
+            return None
+        frame = self.buffer('frame', self.composed.shape)
+        if not (self.frameValid):
+            np.copyto(frame, self.composed)
+            self.bytesCopied += frame.nbytes
+            self.frameValid = True
+        elif (self.damage is not None):
+            x1, y1, x2, y2 = self.damage
+            frame[y1:y2, x1:x2] = self.composed[y1:y2, x1:x2]
+            self.bytesCopied += frame[y1:y2, x1:x2].nbytes
+
+        damage = draw(frame)
+        if (damage is not None):
+            x1, y1, x2, y2 = damage
+            h, w = frame.shape[0:2]
+            damage = (min(max(x1,0),w), min(max(y1,0),h), min(max(x2,0),w), min(max(y2,0),h))
+        self.damage = damage
+        return frame
@@ -0,0 +1,89 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images.
+        In: Bildverarbeitung für die Medizin 2018.
+        Springer Vieweg, Berlin, Heidelberg, 2018. pp. 309-314.
+
+
+   This file: Annotation density raster for zoomed-out (level-of-detail) display
+
+   Instead of drawing every single annotation, the annotation centers are
+   counted per class in square bins of the slide. Rendering a view only crops
+   and scales this raster, so it takes constant time regardless of the number
+   of annotations.
+
+"""
+import cv2
+import numpy as np
+
+
+class annotationDensityMap(object):
+
+    def __init__(self, centers:np.ndarray, labels:np.ndarray, binSize:int=64):
+        """
+            centers: (N,2) array of annotation centers (level 0 coordinates)
+            labels: (N,) array of class labels
+        """
+        self.binSize = binSize
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1,2)
+        labels = np.asarray(labels).reshape(-1)
+        valid = np.all(np.isfinite(centers), axis=1)
+        centers, labels = centers[valid], labels[valid]
+
+        self.classes = np.unique(labels)
+        bins = np.int64(np.clip(centers, 0, None) // binSize)
+        width = int(bins[:,0].max())+1 if bins.shape[0]>0 else 1
+        height = int(bins[:,1].max())+1 if bins.shape[0]>0 else 1
+        self.counts = np.zeros((len(self.classes), height, width), np.uint16)
+        np.add.at(self.counts, (np.searchsorted(self.classes, labels), bins[:,1], bins[:,0]), 1)
+        self.cachedLayer = (None, None)
+
+    def layer(self, colors:dict, activeClasses=None) -> np.ndarray:
+        """
+            returns the RGBA raster of the dominant active class per bin, with the
+            opacity growing with the number of annotations. Cached per class selection.
+        """
+        selected = tuple([k for k,label in enumerate(self.classes) if (label in colors) and ((activeClasses is None) or (label in activeClasses))])
+        key = (selected, tuple([tuple(colors[self.classes[k]]) for k in selected]))
+        if (self.cachedLayer[0] != key):
+            layer = np.zeros((self.counts.shape[1], self.counts.shape[2], 4), np.uint8)
+            if (len(selected)>0):
+                counts = self.counts[list(selected)]
+                total = counts.sum(axis=0, dtype=np.float32)
+                palette = np.uint8([colors[self.classes[k]] for k in selected])
+                layer = palette[np.argmax(counts, axis=0)]
+                layer[:,:,3] = np.where(total>0, 255*(0.4+0.6*np.log1p(total)/np.log1p(max(total.max(),1))), 0)
+            self.cachedLayer = (key, layer)
+        return self.cachedLayer[1]
+
+    def render(self, image:np.ndarray, leftUpper, rightLower, colors:dict, activeClasses=None) -> np.ndarray:
+        """
+            blends the density of all active classes into the RGBA image showing the
+            region from leftUpper to rightLower. colors maps class labels to RGBA colors.
+        """
+        layer = self.layer(colors, activeClasses)
+
+        # scale bins to screen pixels (pixel centers aligned). Only the screen pixels are sampled,
+        # so this does not depend on the size of the slide.
+        zoom = (rightLower[0]-leftUpper[0])/image.shape[1]
+        scale = self.binSize/zoom
+        M = np.float32([[scale, 0, -leftUpper[0]/zoom + 0.5*(scale-1)],
+                        [0, scale, -leftUpper[1]/zoom + 0.5*(scale-1)]])
+        layer = cv2.warpAffine(layer, M, dsize=(image.shape[1], image.shape[0]), flags=cv2.INTER_NEAREST,
+                               borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+        # alpha blending; the alpha channel of the image is combined as well (alpha + image alpha * (1-alpha)),
+        # so the density may also be rendered into a transparent layer
+        alpha = cv2.cvtColor(np.ascontiguousarray(layer[:,:,3]), cv2.COLOR_GRAY2RGBA)
+        layer[:,:,3] = 255
+        image[:] = cv2.add(cv2.multiply(image, cv2.bitwise_not(alpha), scale=1/255), cv2.multiply(layer, alpha, scale=1/255))
+        return image
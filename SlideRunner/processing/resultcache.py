@@ -0,0 +1,142 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images.
+        In: Bildverarbeitung für die Medizin 2018.
+        Springer Vieweg, Berlin, Heidelberg, 2018. pp. 309-314.
+
+
+   This file: Memoization of plugin results
+
+   Results of plugins (with cacheResults set) are stored per plugin, version,
+   configuration, slide and viewport, so that revisiting a view or toggling
+   a plugin does not trigger a recomputation.
+
+   The job sent to the plugin carries a procId, which the plugin passes back
+   with its result (returnImage(img, job.procId)). The result is stored under
+   the key registered for this procId. Results without a known procId are
+   not cached, neither are results of jobs requested without a key (e.g. jobs
+   computed on the coarse preview of a region). A result of a view that has
+   been superseded (by a newer request or a cache hit for the same plugin) is
+   still cached, but not displayed.
+
+   Results are kept in a byte-bounded LRU. Evicted results can optionally be
+   spilled to a directory, which is bounded as well.
+
+"""
+import hashlib
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+from SlideRunner.processing.tilecache import tileCache
+
+
+class pluginResultCache(object):
+
+    def __init__(self, maxBytes:int=128*1024*1024, spillDirectory:str=None, maxSpillBytes:int=1024*1024*1024, maxPending:int=256):
+        self.memory = tileCache(maxBytes, onEvict=self.spill if spillDirectory else None)
+        self.spillDirectory = spillDirectory
+        self.maxSpillBytes = maxSpillBytes
+        self.spilled = OrderedDict()
+        self.spilledBytes = 0
+        self.pending = OrderedDict()
+        self.latest = dict()
+        self.maxPending = maxPending
+        self.nextProcId = 1
+        self.lock = threading.Lock()
+        if (spillDirectory):
+            os.makedirs(spillDirectory, exist_ok=True)
+
+    @staticmethod
+    def key(shortName:str, version, configuration:dict, slideFilename:str, coordinates, shape, *view) -> str:
+        """
+            shortName and version of the plugin, its configuration (as gathered by the UI),
+            the slide, the viewport coordinates and image shape, and further view parameters
+            (e.g. rotation and z level)
+        """
+        configuration = sorted([(str(key), repr(value)) for key,value in (configuration or dict()).items()])
+        return hashlib.sha1(repr((shortName, str(version), configuration, slideFilename, tuple(coordinates), tuple(shape), view)).encode()).hexdigest()
+
+    def request(self, key:str, plugin:str) -> int:
+        """
+            returns the procId to send with the job computing the result for key. If key
+            is None, the result is only checked for being superseded, but not stored.
+        """
+        with self.lock:
+            procId = self.nextProcId
+            self.nextProcId += 1
+            self.pending[procId] = (key, plugin)
+            self.latest[plugin] = procId
+            while (len(self.pending) > self.maxPending):
+                self.pending.popitem(last=False)
+            return procId
+
+    def store(self, procId, image:np.ndarray) -> bool:
+        """
+            stores the result returned for procId. Returns False if the result belongs
+            to a superseded view and should not be displayed.
+        """
+        with self.lock:
+            entry = self.pending.pop(procId, None)
+        if (entry is None):
+            return True
+        key, plugin = entry
+        if (key is not None) and isinstance(image, np.ndarray):
+            # plugins may reuse their result buffers
+            self.memory.put(key, np.array(image))
+        return self.latest.get(plugin) == procId
+
+    def get(self, key:str, plugin:str=None) -> np.ndarray:
+        image = self.memory.get(key)
+        if (image is None) and (key in self.spilled):
+            try:
+                image = np.load(self.spilled[key][0])
+            except (OSError, ValueError):
+                return None
+            self.memory.put(key, image)
+        if (image is not None) and (plugin is not None):
+            # results of pending requests of this plugin are outdated now
+            with self.lock:
+                self.latest[plugin] = None
+        return image
+
+    def spill(self, key:str, image:np.ndarray):
+        with self.lock:
+            if (key in self.spilled):
+                self.spilled.move_to_end(key)
+                return
+            filename = os.path.join(self.spillDirectory, key+'.npy')
+            try:
+                np.save(filename, image)
+            except OSError as e:
+                print('Unable to spill plugin result: ',e)
+                return
+            self.spilled[key] = (filename, image.nbytes)
+            self.spilledBytes += image.nbytes
+            while (self.spilledBytes > self.maxSpillBytes):
+                _, (filename, nbytes) = self.spilled.popitem(last=False)
+                self.spilledBytes -= nbytes
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+    def clear(self):
+        self.memory.clear()
+        with self.lock:
+            for filename, _ in self.spilled.values():
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+            self.spilled = OrderedDict()
+            self.spilledBytes = 0
@@ -51,7 +51,7 @@ class screeningMap(object):
         self.mapWorkingCopy = np.copy(er)
 
 
-    def checkIsNew(self,coordinates,imgarea_w):
+    def checkIsNew(self,coordinates,imgarea_w, markScreened:bool=True):
         check_x = np.int16(np.floor((coordinates[0])*self.map.shape[1]))
         check_y = np.int16(np.floor((coordinates[1])*self.map.shape[0]))
         self.w_screeningmap = np.int16(np.floor(0.9*imgarea_w[0]/self.slideLevelDimensions[0][0]*self.mapWorkingCopy.shape[1]))
@@ -60,11 +60,38 @@ class screeningMap(object):
 
         sumMap = np.sum(self.mapWorkingCopy[check_y:check_y+self.h_screeningmap, check_x:check_x+self.w_screeningmap])
         if (sumMap>0):
-            self.mapWorkingCopy[check_y:check_y+self.h_screeningmap, check_x:check_x+self.w_screeningmap]=0
+            if (markScreened):
+                self.mapWorkingCopy[check_y:check_y+self.h_screeningmap, check_x:check_x+self.w_screeningmap]=0
             return True
 
         return False
-    
+
+    """
+        Predict the left upper corner (relative coordinates) of the next screening field,
+        following the same grid walk as the guided screening, without marking anything
+        as screened. Returns None if all fields have been covered.
+    """
+
+    def findNextField(self, leftUpper, imgarea_w, relOffset):
+        leftUpper = list(leftUpper)
+        step_x = imgarea_w[0]*0.9/self.slideLevelDimensions[0][0]
+        step_y = imgarea_w[1]*0.9/self.slideLevelDimensions[0][1]
+        while not self.checkIsNew(leftUpper, imgarea_w, markScreened=False):
+            leftUpper[0] += step_x
+
+            if (leftUpper[0] > 1):
+                ycoord = leftUpper[1]
+                if (leftUpper[1] == 1.0 - relOffset[1]):
+                    return None
+                leftUpper[1] += step_y
+                if (leftUpper[1]>1):
+                    leftUpper[1] = 1.0 - relOffset[1]
+                if (leftUpper[1]<ycoord):
+                    return None
+                leftUpper[0] = 0
+
+        return leftUpper
+
 
     def __init__(self,overview, mainImageSize, slideLevelDimensions, thumbNailSize, thresholding:str):
             super(screeningMap, self).__init__()        
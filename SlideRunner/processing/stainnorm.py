@@ -0,0 +1,139 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images.
+        In: Bildverarbeitung für die Medizin 2018.
+        Springer Vieweg, Berlin, Heidelberg, 2018. pp. 309-314.
+
+
+   This file: Stain normalization (Method by Macenko)
+
+   The stain matrix (optical density vectors of hematoxylin and eosin) and the
+   maximum stain concentrations are estimated once, e.g. from tissue tiles of
+   the slide (estimateSlideStains). Normalizing an image is then a projection
+   of its optical density onto the reference stains, which folds into a single
+   3x4 matrix applied per pixel:
+
+       normalized = I0 * exp(-OD * pinv(HE)^T * diag(maxCRef/maxC) * HRef^T)
+
+ References:
+ [1] M Macenko, M Niethammer, JS Marron, D Borland, JT Woosley, X Guan, C
+     Schmitt, NE Thomas. "A method for normalizing histology slides for
+     quantitative analysis". IEEE International Symposium on Biomedical
+     Imaging: From Nano to Macro, 2009 vol.9, pp.1107-1110, 2009.
+
+ Acknowledgements:
+     Inspired by the Stain normalization toolbox by WARWICK, which is available
+     for download at:
+     http://www2.warwick.ac.uk/fac/sci/dcs/research/tia/software/sntoolbox/
+
+"""
+import cv2
+import numpy as np
+
+I0 = 240
+# reference stain matrix (columns: H, E) and maximum concentrations
+HRef = np.array(((0.5626, 0.2159), (0.7201, 0.8012), (0.4062, 0.5581)))
+maxCRef = np.array((1.9705, 1.0308))
+
+# optical density of 8 bit intensities
+odTable = np.float32(-np.log((np.arange(256)+1)/I0))
+
+
+def quantile(x, q):
+    n = len(x)
+    y = np.sort(x)
+    return (np.interp(q, np.linspace(1 / (2 * n), (2 * n - 1) / (2 * n), n), y))
+
+
+def opticalDensity(rgb:np.ndarray) -> np.ndarray:
+    """
+        optical density (float32) of an uint8 RGB image or of (N,3) uint8 pixels
+    """
+    return odTable[rgb]
+
+
+class stainEstimate(object):
+    """
+        stain matrix HE (3x2, columns: H, E) and maximum stain concentrations maxC
+    """
+    def __init__(self, HE:np.ndarray, maxC:np.ndarray):
+        self.HE = HE
+        self.maxC = maxC
+
+    def transform(self, mode:int=0) -> np.ndarray:
+        """
+            3x4 matrix mapping optical density to log intensity of the normalized image.
+            mode: 0 (H&E), 1 (only E), 2 (only H)
+        """
+        scale = maxCRef / self.maxC
+        if (mode==1):
+            scale[0] = 0
+        elif (mode==2):
+            scale[1] = 0
+        T = -np.dot(HRef * scale, np.linalg.pinv(self.HE))
+        return np.float32(np.hstack((T, np.full((3,1), np.log(I0)))))
+
+
+def estimateStains(od:np.ndarray, beta:float=0.15, alpha:float=1, maxSamples:int=200000) -> stainEstimate:
+    """
+        estimates the stain matrix from optical density pixels (N,3), of which up to maxSamples are used.
+    """
+    od = np.reshape(od, (-1,3))
+    if (od.shape[0] > maxSamples):
+        od = od[::int(np.ceil(od.shape[0]/maxSamples))]
+    odHat = od[np.all(od > beta, axis=1)]
+    if (odHat.shape[0] < 2):
+        raise ValueError('Not enough stained pixels to estimate the stain matrix.')
+
+    # plane of the two largest principal components (eigh sorts ascending)
+    _, V = np.linalg.eigh(np.cov(odHat.T))
+    V = V[:, 1:3]
+    That = -np.dot(odHat, V)
+    phi = np.arctan2(That[:,1], That[:,0])
+    minPhi, maxPhi = quantile(phi, np.array((alpha, 100-alpha))/100)
+    vMin = -np.dot(V, np.array((np.cos(minPhi), np.sin(minPhi))))
+    vMax = -np.dot(V, np.array((np.cos(maxPhi), np.sin(maxPhi))))
+    HE = np.stack((vMin, vMax), axis=1) if (vMin[0] > vMax[0]) else np.stack((vMax, vMin), axis=1)
+
+    C = np.dot(np.float64(od), np.linalg.pinv(HE).T)
+    maxC = np.array((quantile(C[:,0], 0.99), quantile(C[:,1], 0.99)))
+    return stainEstimate(HE, maxC)
+
+
+def estimateSlideStains(slide, tiles:int=16, tileSize:int=256, beta:float=0.15, alpha:float=1) -> stainEstimate:
+    """
+        estimates the stain matrix of a slide (an opened slide object) from up to tiles tiles
+        (level 0) with tissue, according to the optical density of the slide thumbnail
+    """
+    thumbnail = np.array(slide.get_thumbnail((512,512)).convert('RGB'))
+    ys, xs = np.nonzero(np.all(opticalDensity(thumbnail) > beta, axis=2))
+    if (len(xs)==0):
+        return estimateStains(opticalDensity(thumbnail), beta, alpha)
+
+    scale = (slide.dimensions[0]/thumbnail.shape[1], slide.dimensions[1]/thumbnail.shape[0])
+    samples = list()
+    for idx in np.unique(np.linspace(0, len(xs)-1, tiles).astype(int)):
+        location = (int(xs[idx]*scale[0]-tileSize/2), int(ys[idx]*scale[1]-tileSize/2))
+        tile = np.array(slide.read_region(location, 0, (tileSize, tileSize)))
+        rgb = tile[:,:,0:3][tile[:,:,3]>0] # pixels within the slide
+        samples.append(opticalDensity(rgb))
+    return estimateStains(np.concatenate(samples), beta, alpha)
+
+
+def normalizeStains(rgb:np.ndarray, stains:stainEstimate, mode:int=0, dst:np.ndarray=None) -> np.ndarray:
+    """
+        normalizes an uint8 RGB image (h,w,3) to the reference stains. Returns an uint8 image,
+        written to dst if given.
+    """
+    od = cv2.LUT(np.ascontiguousarray(rgb), odTable)
+    normalized = cv2.exp(cv2.transform(od, stains.transform(mode)))
+    return cv2.convertScaleAbs(normalized, dst=dst)
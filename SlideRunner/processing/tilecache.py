@@ -0,0 +1,237 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images.
+        In: Bildverarbeitung für die Medizin 2018.
+        Springer Vieweg, Berlin, Heidelberg, 2018. pp. 309-314.
+
+
+   This file: Tile-pyramid viewport cache
+
+   The slide is split into fixed-size tiles per pyramid level. Tiles are kept
+   in a byte-bounded LRU cache and every viewport is composed from these tiles,
+   so that only tiles not seen before need to be read from the slide.
+   Missing tiles can be read in parallel by a pool of worker threads.
+
+"""
+import numpy as np
+from collections import OrderedDict
+import threading
+import queue
+import time
+
+
+class tileCache(object):
+    """
+        Byte-bounded LRU cache for slide tiles.
+
+        Keys are tuples (slide, level, zLevel, rotation, tx, ty), values are
+        RGBA numpy arrays.
+    """
+
+    def __init__(self, maxBytes:int=256*1024*1024, onEvict=None):
+        self.maxBytes = maxBytes
+        self.onEvict = onEvict
+        self.tiles = OrderedDict()
+        self.currentBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.tiles:
+                self.misses += 1
+                return None
+            self.tiles.move_to_end(key)
+            self.hits += 1
+            return self.tiles[key]
+
+    def put(self, key, tile:np.ndarray):
+        if (tile.nbytes > self.maxBytes):
+            return
+        evictedTiles = list()
+        with self.lock:
+            if key in self.tiles:
+                self.currentBytes -= self.tiles.pop(key).nbytes
+            self.tiles[key] = tile
+            self.currentBytes += tile.nbytes
+            while (self.currentBytes > self.maxBytes):
+                evictedKey, evicted = self.tiles.popitem(last=False)
+                self.currentBytes -= evicted.nbytes
+                evictedTiles.append((evictedKey, evicted))
+        if (self.onEvict is not None):
+            for evictedKey, evicted in evictedTiles:
+                self.onEvict(evictedKey, evicted)
+
+    def clear(self):
+        with self.lock:
+            self.tiles = OrderedDict()
+            self.currentBytes = 0
+
+    def __contains__(self, key):
+        return key in self.tiles
+
+    def __len__(self):
+        return len(self.tiles)
+
+
+class tiledViewport(object):
+    """
+        Composes viewport regions out of cached tiles of a fixed size.
+
+        Region requests follow the read_region convention of OpenSlide: location
+        is given in level 0 coordinates, size in pixels of the requested level.
+    """
+
+    def __init__(self, cache:tileCache=None, tileSize:int=512):
+        self.cache = tileCache() if cache is None else cache
+        self.tileSize = tileSize
+        self.tileLatencies = list()
+
+    def tileKeys(self, slidename, location, level, size, zLevel, rotated, downsample):
+        """
+            returns the keys of all tiles needed for the region and the region
+            origin in pixels of the requested level
+        """
+        ts = self.tileSize
+        origin = (int(np.floor(location[0]/downsample)), int(np.floor(location[1]/downsample)))
+        tx0, ty0 = origin[0]//ts, origin[1]//ts
+        tx1, ty1 = (origin[0]+size[0]-1)//ts, (origin[1]+size[1]-1)//ts
+        keys = [(slidename, level, zLevel, bool(rotated), tx, ty) for ty in range(ty0, ty1+1) for tx in range(tx0, tx1+1)]
+        return keys, origin
+
+    def readTile(self, slide, key):
+        """
+            reads a single tile from the slide and stores it in the cache
+        """
+        (_, level, zLevel, _, tx, ty) = key
+        t0 = time.time()
+        ds = slide.level_downsamples[level]
+        location = (int(tx*self.tileSize*ds), int(ty*self.tileSize*ds))
+        tile = np.array(slide.read_region(location, level, (self.tileSize, self.tileSize), zLevel=zLevel))
+        self.cache.put(key, tile)
+        self.tileLatencies.append((tx, ty, time.time()-t0))
+        return tile
+
+    def readTiles(self, slide, keys, isStale=None):
+        """
+            reads the given tiles one after another. Returns a dict (key -> tile),
+            or None if the read was abandoned.
+        """
+        tiles = dict()
+        for key in keys:
+            if (isStale is not None) and isStale():
+                return None
+            tiles[key] = self.readTile(slide, key)
+        return tiles
+
+    def readRegion(self, slide, slidename, location, level, size, zLevel=0, rotated=False, isStale=None):
+        """
+            returns the region as RGBA numpy array, reading only missing tiles
+
+            isStale is an optional callable, checked before every tile read. If it
+            returns True, the read is abandoned and None is returned.
+        """
+        keys, origin = self.tileKeys(slidename, location, level, size, zLevel, rotated, slide.level_downsamples[level])
+        self.tileLatencies = list()
+
+        tiles = dict()
+        missing = list()
+        for key in keys:
+            tile = self.cache.get(key)
+            if (tile is None):
+                missing.append(key)
+            else:
+                tiles[key] = tile
+
+        if (len(missing)>0):
+            newTiles = self.readTiles(slide, missing, isStale)
+            if (newTiles is None):
+                return None
+            tiles.update(newTiles)
+
+        return self.compose(tiles, origin, size)
+
+    def compose(self, tiles:dict, origin, size):
+        """
+            pastes tiles (dict: key -> tile) into a region of size starting at origin
+        """
+        ts = self.tileSize
+        region = np.zeros((size[1], size[0], 4), np.uint8)
+        for key, tile in tiles.items():
+            tx, ty = key[4], key[5]
+            # intersection of tile and region in level coordinates
+            x0, y0 = max(tx*ts, origin[0]), max(ty*ts, origin[1])
+            x1, y1 = min((tx+1)*ts, origin[0]+size[0]), min((ty+1)*ts, origin[1]+size[1])
+            if (x1<=x0) or (y1<=y0):
+                continue
+            region[y0-origin[1]:y1-origin[1], x0-origin[0]:x1-origin[0]] = tile[y0-ty*ts:y1-ty*ts, x0-tx*ts:x1-tx*ts]
+        return region
+
+
+class parallelTiledViewport(tiledViewport):
+    """
+        Tiled viewport that spreads the reads of missing tiles across a pool of
+        worker threads. Every worker holds its own slide handle, opened with
+        openSlide(slidename, rotated).
+    """
+
+    def __init__(self, openSlide, cache:tileCache=None, tileSize:int=512, numWorkers:int=4):
+        super().__init__(cache=cache, tileSize=tileSize)
+        self.openSlide = openSlide
+        self.jobs = queue.Queue()
+        self.handles = threading.local()
+        self.workers = [threading.Thread(target=self.worker, daemon=True) for _ in range(numWorkers)]
+        for worker in self.workers:
+            worker.start()
+
+    def slideHandle(self, slidename, rotated):
+        """
+            returns the slide handle of the calling worker thread
+        """
+        if (getattr(self.handles, 'slidename', None) != slidename):
+            self.handles.slide = self.openSlide(slidename, rotated)
+            self.handles.slidename = slidename
+        self.handles.slide.rotate = rotated
+        return self.handles.slide
+
+    def worker(self):
+        while (True):
+            key, isStale, results = self.jobs.get()
+            if (isStale is not None) and isStale():
+                results.put((key, None))
+                continue
+            try:
+                results.put((key, self.readTile(self.slideHandle(key[0], key[3]), key)))
+            except Exception as e:
+                results.put((key, e))
+
+    def readTiles(self, slide, keys, isStale=None):
+        """
+            reads the given tiles in parallel. Returns a dict (key -> tile),
+            or None if the read was abandoned.
+        """
+        results = queue.Queue()
+        for key in keys:
+            self.jobs.put((key, isStale, results))
+
+        tiles = dict()
+        abandoned = False
+        for _ in keys:
+            key, tile = results.get()
+            if isinstance(tile, Exception):
+                raise tile
+            elif tile is None:
+                abandoned = True
+            else:
+                tiles[key] = tile
+        return None if abandoned else tiles
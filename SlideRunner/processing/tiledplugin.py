@@ -0,0 +1,263 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images.
+        In: Bildverarbeitung für die Medizin 2018.
+        Springer Vieweg, Berlin, Heidelberg, 2018. pp. 309-314.
+
+
+   This file: Whole-slide execution of per-tile plugin functions
+
+   The slide is split into a grid of tiles (tileSize pixels on tileLevel). A
+   per-tile function maps each tile to a result block of resultSize pixels.
+   The blocks form a result raster of the whole slide, which is kept in an
+   on-disk cache (numpy memmaps) together with a map of the finished tiles.
+
+   The cache is keyed by a fingerprint of the slide file, the plugin name and
+   version and its configuration, so a slide that has been processed before
+   is shown immediately after reopening it, and an interrupted run continues
+   where it stopped. The results of the least recently opened slides are
+   removed when the cache directory exceeds cacheLimit bytes.
+
+   Tiles are processed by a pool of worker threads (each with its own slide
+   handle), optionally only tiles with tissue according to the screening map
+   of the slide thumbnail. Tiles close to the current viewport go first.
+   Tiles that fail are reported (error callback) and skipped for the rest of
+   the run, they are retried when the slide is processed again.
+
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from numpy.lib.format import open_memmap
+from SlideRunner_dataAccess.slide import RotatableOpenSlide
+from SlideRunner.processing.screening import screeningMap
+
+
+defaultCacheDirectory = os.path.join(os.path.expanduser('~'), '.sliderunner', 'tileresults')
+defaultCacheLimit = 10*2**30 # bytes
+
+
+def slideFingerprint(filename:str, chunkSize:int=1<<20) -> str:
+    """
+        hash of the size, the first and the last chunk of the slide file (hashing
+        the complete file would take longer than processing many slides)
+    """
+    size = os.path.getsize(filename)
+    fingerprint = hashlib.sha1(str(size).encode())
+    with open(filename, 'rb') as f:
+        fingerprint.update(f.read(chunkSize))
+        if (size > chunkSize):
+            f.seek(max(chunkSize, size-chunkSize))
+            fingerprint.update(f.read(chunkSize))
+    return fingerprint.hexdigest()
+
+
+def resultKey(fingerprint:str, name:str, version, configuration:dict, parameters:tuple) -> str:
+    configuration = sorted([(str(key), repr(value)) for key,value in (configuration or dict()).items()])
+    return hashlib.sha1(repr((fingerprint, name, str(version), configuration, parameters)).encode()).hexdigest()
+
+
+def evictResults(directory:str, limit:int, keep:str=None):
+    """
+        removes the results (subdirectories of directory) of the least recently opened slides
+        until all results together take at most limit bytes. The results of keep are kept.
+    """
+    if not (os.path.isdir(directory)):
+        return
+    results = list()
+    for entry in os.scandir(directory):
+        if (entry.is_dir()) and (entry.name != keep):
+            size = sum([f.stat().st_size for f in os.scandir(entry.path) if f.is_file()])
+            results.append((entry.stat().st_mtime, size, entry.path))
+    total = sum([size for _, size, _ in results])
+    if (keep is not None) and (os.path.isdir(os.path.join(directory, keep))):
+        total += sum([f.stat().st_size for f in os.scandir(os.path.join(directory, keep)) if f.is_file()])
+    for _, size, path in sorted(results):
+        if (total <= limit):
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+class tileResultCache(object):
+    """
+        Result raster of a slide (blocks of resultSize per tile) and the map of finished tiles, as memmaps in path
+    """
+    def __init__(self, path:str, gridShape, resultSize, channels:int=1, dtype=np.float32):
+        """
+            resultSize: (w,h) of the result block per tile, channels: up to 4, dtype: uint8 or float32
+        """
+        os.makedirs(path, exist_ok=True)
+        os.utime(path) # most recently opened, see evictResults
+        self.resultSize = tuple(resultSize)
+        shape = (gridShape[0]*resultSize[1], gridShape[1]*resultSize[0]) + ((channels,) if channels>1 else ())
+        self.results = self.open(os.path.join(path, 'results.npy'), shape, np.dtype(dtype))
+        self.done = self.open(os.path.join(path, 'done.npy'), tuple(gridShape), np.dtype(np.uint8))
+        if (self.results.shape != shape) or (self.done.shape != tuple(gridShape)):
+            # stale cache from an incompatible run
+            self.results = self.open(os.path.join(path, 'results.npy'), shape, np.dtype(dtype), create=True)
+            self.done = self.open(os.path.join(path, 'done.npy'), tuple(gridShape), np.dtype(np.uint8), create=True)
+
+    @staticmethod
+    def open(filename:str, shape, dtype, create:bool=False) -> np.ndarray:
+        if (os.path.exists(filename)) and not (create):
+            try:
+                array = open_memmap(filename, mode='r+')
+                if (array.dtype == dtype):
+                    return array
+            except ValueError:
+                pass
+        return open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+
+    def store(self, tx:int, ty:int, result:np.ndarray):
+        w, h = self.resultSize
+        self.results[ty*h:(ty+1)*h, tx*w:(tx+1)*w] = np.asarray(result).reshape(self.results[ty*h:(ty+1)*h, tx*w:(tx+1)*w].shape)
+        self.done[ty, tx] = 1
+
+    def flush(self):
+        self.results.flush()
+        self.done.flush()
+
+
+class tiledSlideProcessor(object):
+    """
+        Runs processTile(tile, configuration) -> result block over all tiles of a slide
+    """
+    def __init__(self, slideFilename:str, processTile, key:str, configuration:dict=None,
+                 tileSize:int=512, tileLevel:int=0, resultSize=(16,16), channels:int=1, dtype=np.float32,
+                 tissueOnly:bool=True, thresholding:str='OTSU', numWorkers:int=None,
+                 cacheDirectory:str=None, cacheLimit:int=defaultCacheLimit, progress=None, error=None):
+        self.slideFilename = slideFilename
+        self.processTile = processTile
+        self.configuration = configuration
+        self.tileSize = tileSize
+        self.resultSize = tuple(resultSize)
+        self.numWorkers = min(8, os.cpu_count() or 1) if numWorkers is None else numWorkers
+        self.progress = progress
+        self.error = error
+        self.handles = threading.local()
+
+        slide = RotatableOpenSlide(slideFilename, rotate=False)
+        self.tileLevel = min(tileLevel, len(slide.level_downsamples)-1)
+        self.downsample = slide.level_downsamples[self.tileLevel]
+        width, height = slide.level_dimensions[self.tileLevel]
+        self.gridShape = (int(np.ceil(height/tileSize)), int(np.ceil(width/tileSize)))
+        self.cache = tileResultCache(os.path.join(cacheDirectory or defaultCacheDirectory, key), self.gridShape, self.resultSize, channels, dtype)
+        evictResults(cacheDirectory or defaultCacheDirectory, cacheLimit, keep=key)
+        self.failed = np.zeros(self.gridShape, bool)
+
+        self.tissue = np.ones(self.gridShape, bool)
+        if (tissueOnly):
+            self.tissue = self.tissueTiles(slide, thresholding)
+
+        self.viewportCenter = None
+        self.stopped = threading.Event()
+        self.changed = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def tissueTiles(self, slide, thresholding:str) -> np.ndarray:
+        """
+            tiles with tissue, according to the screening map of the slide thumbnail
+        """
+        thumbnail = np.array(slide.get_thumbnail((1024,1024)).convert('RGB'))
+        tissueMap = screeningMap(thumbnail, (1,1), slide.level_dimensions, (thumbnail.shape[1], thumbnail.shape[0]), thresholding).map
+        # portion of the thumbnail covered by the tile grid (the last tiles may extend beyond the slide)
+        width, height = slide.level_dimensions[self.tileLevel]
+        gridW = int(np.ceil(self.gridShape[1]*self.tileSize/width*tissueMap.shape[1]))
+        gridH = int(np.ceil(self.gridShape[0]*self.tileSize/height*tissueMap.shape[0]))
+        tissueMap = cv2.copyMakeBorder(tissueMap, 0, max(0,gridH-tissueMap.shape[0]), 0, max(0,gridW-tissueMap.shape[1]), cv2.BORDER_CONSTANT, value=0)
+        tissueMap = cv2.resize(np.float32(tissueMap[0:gridH, 0:gridW]), dsize=(self.gridShape[1], self.gridShape[0]), interpolation=cv2.INTER_AREA)
+        return tissueMap > 0
+
+    def prioritize(self, coordinates):
+        """
+            process the tiles around the viewport (x,y,w,h, level 0 coordinates) first
+        """
+        x, y, w, h = coordinates
+        self.viewportCenter = ((x+w/2)/self.downsample/self.tileSize, (y+h/2)/self.downsample/self.tileSize)
+
+    def pendingTiles(self) -> list:
+        ty, tx = np.where(self.tissue & (self.cache.done == 0) & ~self.failed)
+        if (self.viewportCenter is not None) and (len(tx)>0):
+            order = np.argsort(np.square(tx+0.5-self.viewportCenter[0]) + np.square(ty+0.5-self.viewportCenter[1]))
+            tx, ty = tx[order], ty[order]
+        return list(zip(tx.tolist(), ty.tolist()))
+
+    def statistics(self) -> tuple:
+        """
+            tiles done (including failed tiles), tiles to process and failed tiles
+        """
+        return int(np.sum(self.tissue & ((self.cache.done != 0) | self.failed))), int(np.sum(self.tissue)), int(np.sum(self.failed))
+
+    def runTile(self, tx:int, ty:int):
+        if (self.stopped.is_set()):
+            return
+        if not hasattr(self.handles, 'slide'):
+            self.handles.slide = RotatableOpenSlide(self.slideFilename, rotate=False)
+        location = (int(tx*self.tileSize*self.downsample), int(ty*self.tileSize*self.downsample))
+        tile = np.array(self.handles.slide.read_region(location, self.tileLevel, (self.tileSize, self.tileSize)))
+        self.cache.store(tx, ty, self.processTile(tile, self.configuration))
+        self.changed.set()
+
+    def run(self):
+        with ThreadPoolExecutor(self.numWorkers) as pool:
+            while not (self.stopped.is_set()):
+                # batches, so that the order follows the viewport
+                batch = self.pendingTiles()[0:4*self.numWorkers]
+                if (len(batch)==0):
+                    break
+                t0 = time.time()
+                for (tx,ty), future in [((tx,ty), pool.submit(self.runTile, tx, ty)) for tx,ty in batch]:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.failed[ty, tx] = True
+                        if (self.error is not None):
+                            self.error(tx, ty, e)
+                self.cache.flush()
+                if (self.progress is not None):
+                    self.progress(*self.statistics()[0:2], len(batch)/max(time.time()-t0, 1e-6))
+        self.cache.flush()
+
+    @property
+    def finished(self) -> bool:
+        return not self.thread.is_alive()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def overlay(self, coordinates, shape, interpolation=cv2.INTER_LINEAR) -> np.ndarray:
+        """
+            result raster of the viewport (x,y,w,h, level 0 coordinates), scaled to shape (h,w)
+        """
+        scale = self.tileSize*self.downsample/self.resultSize[0]
+        x1, y1 = int(np.floor(coordinates[0]/scale)), int(np.floor(coordinates[1]/scale))
+        x2, y2 = int(np.ceil((coordinates[0]+coordinates[2])/scale)), int(np.ceil((coordinates[1]+coordinates[3])/scale))
+        results = self.cache.results
+        region = np.zeros((max(1,y2-y1), max(1,x2-x1)) + results.shape[2:], results.dtype)
+        sx1, sy1 = max(x1,0), max(y1,0)
+        sx2, sy2 = min(x2,results.shape[1]), min(y2,results.shape[0])
+        if (sx2>sx1) and (sy2>sy1):
+            region[sy1-y1:sy2-y1, sx1-x1:sx2-x1] = results[sy1:sy2, sx1:sx2]
+
+        # scale result pixels to screen pixels, pixel centers aligned
+        zoom = coordinates[2]/shape[1]
+        M = np.float32([[scale/zoom, 0, ((x1+0.5)*scale-coordinates[0])/zoom-0.5],
+                        [0, scale/zoom, ((y1+0.5)*scale-coordinates[1])/zoom-0.5]])
+        return cv2.warpAffine(region, M, dsize=(shape[1], shape[0]), flags=interpolation, borderMode=cv2.BORDER_REPLICATE)
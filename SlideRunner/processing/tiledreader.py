@@ -0,0 +1,135 @@
+"""
+
+        This is SlideRunner - An Open Source Annotation Tool
+        for Digital Histology Slides.
+
+         Marc Aubreville, Pattern Recognition Lab,
+         Friedrich-Alexander University Erlangen-Nuremberg
+         marc.aubreville@fau.de
+
+        If you use this software in research, please citer our paper:
+        M. Aubreville, C. Bertram, R. Klopfleisch and A. Maier:
+        SlideRunner - A Tool for Massive Cell Annotations in Whole Slide Images.
+        In: Bildverarbeitung für die Medizin 2018.
+        Springer Vieweg, Berlin, Heidelberg, 2018. pp. 309-314.
+
+
+   This file: Slide reader process composing viewports from cached tiles
+
+   Drop-in replacement for SlideRunner_dataAccess.slide.SlideReader, using the
+   same queue protocol: (slidename, location, level, size, id, rotated, zlevel)
+   in, (image, id) out. A slidename of -1 terminates the process.
+
+   Missing tiles of a region are read by a pool of worker threads, each with
+   its own slide handle. Per-region read statistics (including the latency of
+   every tile read) are published on statisticsQueue.
+
+   While no request is pending, tiles announced on prefetchQueue as lists of
+   regions (slidename, location, level, size, rotated, zlevel) are read into
+   the cache, most important region first. Prefetching stops as soon as a
+   new request arrives.
+
+   Pending requests are coalesced, so that only the newest one is read. The UI
+   publishes its latest request id in latestRequest; reads that became stale
+   in the meantime are abandoned and not sent back.
+
+"""
+import queue
+import multiprocessing
+import os
+import time
+from SlideRunner_dataAccess.slide import SlideReader, RotatableOpenSlide
+from SlideRunner.processing.tilecache import tileCache, parallelTiledViewport
+
+
+class TiledSlideReader(SlideReader):
+
+    def __init__(self, tileSize:int=512, cacheSize:int=256*1024*1024, numWorkers:int=None):
+        super().__init__()
+        self.tileSize = tileSize
+        self.cacheSize = cacheSize
+        self.numWorkers = min(16, os.cpu_count() or 1) if numWorkers is None else numWorkers
+        self.latestRequest = multiprocessing.Value('l', 0)
+        self.statisticsQueue = multiprocessing.Queue(10)
+        self.prefetchQueue = multiprocessing.Queue(10)
+
+    def isStale(self, id) -> bool:
+        return id < self.latestRequest.value
+
+    def publishStatistics(self, id, viewport, duration):
+        try:
+            self.statisticsQueue.put_nowait({'id' : id,
+                                             'duration' : duration,
+                                             'tilesRead' : len(viewport.tileLatencies),
+                                             'tileLatencies' : list(viewport.tileLatencies)})
+        except queue.Full:
+            pass
+
+    def receivePrefetchRequests(self, viewport, prefetchKeys:list) -> list:
+        """
+            returns the tile keys of the newest prefetch request (or the previous
+            keys, if there was none) that are not cached yet
+        """
+        regions = None
+        try:
+            while (True):
+                regions = self.prefetchQueue.get_nowait()
+        except queue.Empty:
+            pass
+
+        if (regions is None):
+            return prefetchKeys
+
+        keys = dict()
+        for (slidename, location, level, size, rotated, zlevel) in regions:
+            if (slidename != self.slidename) or (level<0) or (level>=len(self.slide.level_downsamples)):
+                continue
+            regionKeys,_ = viewport.tileKeys(slidename, location, level, size, zlevel, rotated, self.slide.level_downsamples[level])
+            keys.update({key:True for key in regionKeys if key not in viewport.cache})
+        return list(keys.keys())
+
+    def run(self):
+        viewport = parallelTiledViewport(openSlide=lambda slidename, rotated: RotatableOpenSlide(slidename, rotate=rotated),
+                                         cache=tileCache(self.cacheSize), tileSize=self.tileSize, numWorkers=self.numWorkers)
+        prefetchKeys = list()
+        while (True):
+            prefetchKeys = self.receivePrefetchRequests(viewport, prefetchKeys)
+            try:
+                (slidename, location, level, size, id, rotated, zlevel) = self.queue.get(True, 0.01 if len(prefetchKeys)>0 else 0.1)
+            except queue.Empty:
+                # idle: prefetch a batch of tiles, abandoned as soon as a new request arrives
+                batch, prefetchKeys = prefetchKeys[:self.numWorkers], prefetchKeys[self.numWorkers:]
+                batch = [key for key in batch if key not in viewport.cache]
+                if (len(batch)>0):
+                    try:
+                        viewport.readTiles(self.slide, batch, isStale=lambda: not self.queue.empty())
+                    except Exception as e:
+                        print('Prefetching of tiles failed: ',e)
+                continue
+
+            try:
+                while(True):
+                    (slidename, location, level, size, id, rotated, zlevel) = self.queue.get(True,0.01)
+            except queue.Empty:
+                pass
+
+            if (slidename==-1):
+                print('Exiting SlideReader thread')
+                return
+
+            if (slidename!=self.slidename):
+                self.slide = RotatableOpenSlide(slidename, rotate=rotated)
+                self.slidename = slidename
+
+            self.slide.rotate = rotated
+
+            if self.isStale(id):
+                continue
+
+            t0 = time.time()
+            img = viewport.readRegion(self.slide, slidename, location, level, size, zLevel=zlevel, rotated=rotated,
+                                      isStale=lambda: self.isStale(id))
+
+            if (img is not None):
+                self.outputQueue.put((img,id))
+                self.publishStatistics(id, viewport, time.time()-t0)
@@ -26,7 +26,7 @@ setup(name='SlideRunner',
       license='GPL',
       packages=find_packages(),
       package_data={
-        'SlideRunner': ['artwork/*.png', 'Slides.sqlite', 'plugins/*.py'],
+        'SlideRunner': ['artwork/*.png', 'Slides.sqlite', 'plugins/*.py', 'general/startupBudget.json'],
       }, 
       install_requires=[
           'openslide-python>=1.1.1', 'opencv-python>=3.1.0',
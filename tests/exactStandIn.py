@@ -0,0 +1,180 @@
+"""
+   Stand-in for an EXACT server, for testing the synchronization without a live server.
+
+   Implements the parts of the EXACT REST API (v1) used by ExactManager with an in-memory
+   store: image sets, images (multipart upload, retrieve), annotation types and annotations
+   (list with limit/offset paging, fields and unique_identifier__in filters, create, partial
+   update). Requests can be delayed and failed on purpose (before or after processing them),
+   and the number of concurrent requests is recorded.
+"""
+import json
+import re
+import threading
+import time
+import datetime
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class exactStandIn(object):
+
+    def __init__(self, delay:float=0.0, failures:int=0, lostReplies:int=0):
+        self.delay = delay # seconds per create/update request or upload
+        self.failures = failures # number of create/update requests or uploads answered with 503
+        self.lostReplies = lostReplies # number of create/update requests or uploads processed, but answered with 504
+        self.lock = threading.Lock()
+        self.annotations = dict()
+        self.annotationTypes = dict()
+        self.imageSets = dict()
+        self.images = dict()
+        self.users = {1 : {'id' : 1, 'username' : 'exactuser'}}
+        self.requests = list()
+        self.concurrent = 0
+        self.maxConcurrent = 0
+        self.nextId = 1
+
+        standIn = self
+        class handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+            def do_GET(self):
+                standIn.handle(self, 'GET')
+            def do_POST(self):
+                standIn.handle(self, 'POST')
+            def do_PATCH(self):
+                standIn.handle(self, 'PATCH')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def newId(self) -> int:
+        with self.lock:
+            self.nextId += 1
+            return self.nextId
+
+    def addImageSet(self, name:str, images:list) -> int:
+        imageSetId = self.newId()
+        self.imageSets[imageSetId] = {'id' : imageSetId, 'name' : name, 'team' : 1, 'product_set' : [1], 'set_tags' : [], 'images' : [{'id' : self.newId(), 'name' : image} for image in images]}
+        return imageSetId
+
+    def addAnnotationType(self, name:str, vector_type:int, product:int=1) -> int:
+        typeId = self.newId()
+        self.annotationTypes[typeId] = {'id' : typeId, 'name' : name, 'vector_type' : vector_type, 'product' : product, 'closed' : True, 'deleted' : False}
+        return typeId
+
+    def addAnnotation(self, **fields) -> int:
+        annoId = self.newId()
+        now = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%f")
+        annotation = {'id' : annoId, 'deleted' : False, 'description' : '', 'user' : 1, 'last_editor' : 1, 'time' : now, 'last_edit_time' : now,
+                      'uploaded_media_files' : [], 'annotationversion_set' : []}
+        annotation.update(fields)
+        self.annotations[annoId] = annotation
+        return annoId
+
+    def expanded(self, annotation:dict, expand:str) -> dict:
+        annotation = dict(annotation)
+        if ('annotation_type' in expand):
+            annotation['annotation_type'] = self.annotationTypes[annotation['annotation_type']]
+        if ('last_editor' in expand):
+            annotation['last_editor'] = self.users.get(annotation['last_editor'])
+        return annotation
+
+    def page(self, path:str, objects:list, query:dict) -> dict:
+        offset = int(query.get('offset', 0))
+        limit = int(query['limit']) if 'limit' in query else len(objects)
+        nextPage = None
+        if (offset+limit < len(objects)):
+            nextPage = '%s%s?limit=%d&offset=%d' % (self.url, path, limit, offset+limit)
+        return {'count' : len(objects), 'next' : nextPage, 'previous' : None, 'results' : objects[offset:offset+limit]}
+
+    def handle(self, request, method:str):
+        url = urlparse(request.path)
+        query = {key : ','.join(value) for key, value in parse_qs(url.query).items()}
+        data = request.rfile.read(int(request.headers.get('Content-Length', 0)))
+        if (request.headers.get('Content-Type', '').startswith('multipart/form-data')):
+            form = BytesParser().parsebytes(b'Content-Type: '+request.headers['Content-Type'].encode()+b'\r\n\r\n'+data)
+            body = {part.get_param('name', header='content-disposition') : (part.get_filename(), part.get_payload(decode=True)) for part in form.get_payload()}
+        else:
+            body = json.loads(data or b'null')
+        with self.lock:
+            self.requests.append((method, url.path))
+            self.concurrent += 1
+            self.maxConcurrent = max(self.maxConcurrent, self.concurrent)
+        try:
+            status, reply = self.respond(method, url.path, query, body)
+        finally:
+            with self.lock:
+                self.concurrent -= 1
+                if (self.modifies(method, url.path)) and (self.lostReplies > 0):
+                    self.lostReplies -= 1
+                    status, reply = 504, {'detail' : 'Gateway timeout'}
+        data = json.dumps(reply).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def modifies(self, method:str, path:str) -> bool:
+        return (method in ['POST','PATCH']) and (path.startswith('/api/v1/annotations/annotations/') or (path == '/api/v1/images/images/'))
+
+    def respond(self, method:str, path:str, query:dict, body):
+        if (self.modifies(method, path)):
+            time.sleep(self.delay)
+            with self.lock:
+                if (self.failures > 0):
+                    self.failures -= 1
+                    return 503, {'detail' : 'Service unavailable'}
+
+        if (path == '/api/v1/annotations/annotations/'):
+            if (method == 'GET'):
+                annotations = [anno for anno in self.annotations.values() if ('image' not in query) or (str(anno['image']) == query['image'])]
+                if ('unique_identifier__in' in query):
+                    annotations = [anno for anno in annotations if anno['unique_identifier'] in query['unique_identifier__in'].split(',')]
+                annotations = [self.expanded(anno, query.get('expand', '')) for anno in annotations]
+                if ('fields' in query):
+                    annotations = [{key : anno[key] for key in query['fields'].split(',')} for anno in annotations]
+                return 200, self.page(path, annotations, query)
+            annoId = self.addAnnotation(**body)
+            return 201, self.annotations[annoId]
+
+        match = re.match('^/api/v1/annotations/annotations/(\\d+)/$', path)
+        if (match is not None) and (method == 'PATCH'):
+            annotation = self.annotations.get(int(match.group(1)))
+            if (annotation is None):
+                return 404, {'detail' : 'Not found.'}
+            annotation.update(body)
+            return 200, annotation
+
+        if (path == '/api/v1/annotations/annotation_types/'):
+            if (method == 'GET'):
+                types = [anno_type for anno_type in self.annotationTypes.values() if ('product' not in query) or (str(anno_type['product']) == query['product'])]
+                return 200, self.page(path, types, query)
+            typeId = self.addAnnotationType(body['name'], body['vector_type'], body.get('product', 1))
+            return 201, self.annotationTypes[typeId]
+
+        if (path == '/api/v1/images/images/') and (method == 'POST'):
+            imageSet = self.imageSets[int(body['image_set'][1])]
+            filename, content = body['file_path']
+            image = {'id' : self.newId(), 'name' : filename, 'filename' : filename, 'image_set' : imageSet['id'], 'image_type' : 0,
+                     'width' : 1000, 'height' : 1000, 'mpp' : 0.25, 'objective_power' : 40, 'annotations' : [], 'size' : len(content)}
+            self.images[image['id']] = image
+            imageSet['images'].append({'id' : image['id'], 'name' : filename})
+            return 201, {'count' : 1, 'next' : None, 'previous' : None, 'results' : [image]}
+
+        match = re.match('^/api/v1/images/images/(\\d+)/$', path)
+        if (match is not None) and (int(match.group(1)) in self.images):
+            return 200, self.images[int(match.group(1))]
+
+        match = re.match('^/api/v1/images/image_sets/(\\d+)/$', path)
+        if (match is not None) and (int(match.group(1)) in self.imageSets):
+            return 200, self.imageSets[int(match.group(1))]
+
+        return 404, {'detail' : 'Not found.'}
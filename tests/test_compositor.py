@@ -0,0 +1,58 @@
+from SlideRunner.processing.compositor import *
+import numpy as np
+import cv2
+
+
+def test_annotation_layer_cached():
+    compositor = layeredCompositor()
+    calls = list()
+    def drawAnnotations(layer):
+        calls.append(1)
+        cv2.circle(layer, center=(20,20), radius=5, thickness=-1, color=[255,0,0,255])
+        cv2.putText(layer, 'x', (40,40), cv2.FONT_HERSHEY_PLAIN, 1, (0,0,0), 1)
+
+    layer = compositor.annotationLayer((64,64,4), ('viewport',1), drawAnnotations)
+    compositor.annotationLayer((64,64,4), ('viewport',1), drawAnnotations)
+    assert(len(calls)==1)
+    compositor.annotationLayer((64,64,4), ('viewport',2), drawAnnotations)
+    assert(len(calls)==2)
+
+    base = np.full((64,64,4), 200, np.uint8)
+    composed = compositor.composeAnnotations(base)
+    assert(np.all(composed[20,20]==[255,0,0,255]))
+    assert(np.all(composed[0,0]==base[0,0]))
+    # text drawn in RGB (without alpha) is kept
+    assert(np.any(np.all(composed[30:42,38:50,0:3]==0, axis=-1)))
+
+
+def test_interactive_layer_restored():
+    compositor = layeredCompositor()
+    composed = np.random.randint(0, 255, size=(100,120,4), dtype=np.uint8)
+    compositor.setComposed(composed)
+
+    def rubberBand(frame):
+        cv2.rectangle(frame, (10,10), (50,40), color=[127,127,127,255], thickness=2)
+        return boundingRect([(10,10),(50,40)], margin=2)
+
+    frame = compositor.drawInteractive(rubberBand)
+    assert(np.any(frame!=composed))
+    frame = compositor.drawInteractive(lambda frame: None)
+    assert(np.all(frame==composed))
+
+
+def test_frame_buffers_reused():
+    compositor = layeredCompositor()
+    compositor.annotationLayer((100,120,4), 'key', lambda layer: cv2.circle(layer, (10,10), 3, [255,0,0,255], -1))
+    base = np.zeros((100,120,4), np.uint8)
+    composed = compositor.composeAnnotations(base)
+    compositor.setComposed(composed)
+    frame = compositor.drawInteractive(lambda frame: None)
+    assert(compositor.resetStatistics()==2*base.nbytes)
+
+    # the next frame is composed into the same buffers, a small rubber band only restores its rectangle
+    assert(compositor.composeAnnotations(base) is composed)
+    compositor.setComposed(composed)
+    assert(compositor.drawInteractive(lambda frame: (0,0,10,10)) is frame)
+    compositor.resetStatistics()
+    compositor.drawInteractive(lambda frame: None)
+    assert(compositor.resetStatistics()==10*10*4)
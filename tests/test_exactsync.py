@@ -0,0 +1,285 @@
+import os
+import time
+import queue
+import datetime
+import tempfile
+from SlideRunner.dataAccess.exact import ExactManager, ExactSyncScheduler, transaction
+from SlideRunner_dataAccess.database import Database
+from tests.exactStandIn import exactStandIn
+
+
+def test_pipelined_sync():
+    server = exactStandIn(delay=0.02, failures=2)
+    imageset = server.addImageSet('Test-ImageSet', ['slide.svs'])
+    image = server.imageSets[imageset]['images'][0]['id']
+
+    DB = Database().create(':memory:')
+    slideuid = DB.insertNewSlide('slide.svs','')
+    DB.insertClass('Mitosis')
+    DB.insertAnnotator('exactuser')
+    DB.insertAnnotator('otherexpert') # only annotations of the expert marked as EXACT user are sent
+    DB.setExactPerson(1)
+    for k in range(40):
+        DB.insertNewSpotAnnotation(xpos_orig=10*k, ypos_orig=20, slideUID=slideuid, classID=1, annotator=1)
+    for k in range(3):
+        DB.insertNewSpotAnnotation(xpos_orig=10*k, ypos_orig=40, slideUID=slideuid, classID=1, annotator=2)
+
+    with open(os.devnull, 'w') as logfile:
+        exm = ExactManager('exactuser', 'pw', server.url, logfile=logfile, max_in_flight=8, backoff=0.01)
+        exm.sync(dataset_id=image, imageset_id=imageset, product_id=1, slideuid=slideuid, database=DB)
+
+        # all annotations created, several at a time, failed requests retried
+        assert(len(server.annotations)==40)
+        assert(1 < server.maxConcurrent <= 8)
+        assert(server.failures==0)
+
+        # exact_ids written back to the database
+        remote = {anno['unique_identifier'] : anno['id'] for anno in server.annotations.values()}
+        DB.loadIntoMemory(slideuid, zLevel=None)
+        for anno in DB.annotations.values():
+            if (anno.labels[0].annnotatorId==1):
+                assert(anno.labels[0].exact_id==remote[anno.guid])
+            else:
+                assert(anno.guid not in remote)
+
+        # local change is sent as an update, nothing is created again
+        annoId = [uid for uid, anno in DB.annotations.items() if anno.labels[0].annnotatorId==1][0]
+        DB.setLastModified(annoId, time.time()+10)
+        DB.commit()
+        numRequests = len(server.requests)
+        exm.sync(dataset_id=image, imageset_id=imageset, product_id=1, slideuid=slideuid, database=DB)
+        newRequests = [method for method, path in server.requests[numRequests:] if path.startswith('/api/v1/annotations/annotations/')]
+        assert(newRequests.count('PATCH')==1)
+        assert(newRequests.count('POST')==0)
+        assert(len(server.annotations)==40)
+        exm.terminate()
+
+    server.stop()
+
+
+def test_paged_import():
+    server = exactStandIn()
+    imageset = server.addImageSet('Test-ImageSet', ['slide.svs'])
+    image = server.imageSets[imageset]['images'][0]['id']
+    boxType = server.addAnnotationType('Mitosis', vector_type=1)
+    server.users[2] = {'id' : 2, 'username' : 'otherexpert'}
+    for k in range(25):
+        vector = {'x1' : 10*k, 'y1' : 10, 'x2' : 10*k+5, 'y2' : 15}
+        server.addAnnotation(annotation_type=boxType, image=image, vector=vector, unique_identifier='uuid-%d' % k)
+        if (k % 5 == 0): # second label of the same annotation
+            server.addAnnotation(annotation_type=boxType, image=image, vector=vector, unique_identifier='uuid-%d' % k, last_editor=2)
+
+    DB = Database().create(':memory:')
+    slideuid = DB.insertNewSlide('slide.svs','')
+    DB.insertAnnotator('exactuser')
+    DB.setExactPerson(1)
+    DB.deleteTriggers()
+
+    with open(os.devnull, 'w') as logfile:
+        exm = ExactManager('exactuser', 'pw', server.url, logfile=logfile, page_size=10)
+        exm._retrieve_and_insert(dataset_id=image, slideuid=slideuid, database=DB)
+        exm.terminate()
+
+    # three pages of remote annotations, grouped into one local annotation per uuid
+    assert([method for method, path in server.requests].count('GET')==3)
+    DB.loadIntoMemory(slideuid, zLevel=None)
+    assert(len(DB.annotations)==25)
+    assert(sorted([len(anno.labels) for anno in DB.annotations.values()])==[1]*20+[2]*5)
+    assert([name for name, uid in DB.getAllPersons()]==['exactuser','otherexpert'])
+    assert([cls[0] for cls in DB.getAllClasses()]==['Mitosis'])
+    server.stop()
+
+
+def test_incremental_sync():
+    server = exactStandIn()
+    imageset = server.addImageSet('Test-ImageSet', ['slide.svs'])
+    image = server.imageSets[imageset]['images'][0]['id']
+    boxType = server.addAnnotationType('Mitosis', vector_type=1)
+    server.users[2] = {'id' : 2, 'username' : 'otherexpert'}
+    for k in range(10):
+        server.addAnnotation(annotation_type=boxType, image=image, vector={'x1' : 10*k, 'y1' : 10, 'x2' : 10*k+5, 'y2' : 15},
+                             unique_identifier='uuid-%d' % k, last_editor=2)
+
+    DB = Database().create(':memory:')
+    slideuid = DB.insertNewSlide('slide.svs','')
+    DB.insertClass('Mitosis')
+    DB.insertAnnotator('exactuser')
+    DB.setExactPerson(1)
+    for k in range(10):
+        DB.insertNewAreaAnnotation(x1=10*k, y1=50, x2=10*k+5, y2=55, slideUID=slideuid, classID=1, annotator=1)
+
+    def annotationRequests(since:int):
+        return [(method, path) for method, path in server.requests[since:] if path.startswith('/api/v1/annotations/annotations/')]
+
+    with open(os.devnull, 'w') as logfile:
+        exm = ExactManager('exactuser', 'pw', server.url, logfile=logfile)
+        exm.sync(dataset_id=image, imageset_id=imageset, product_id=1, slideuid=slideuid, database=DB)
+        assert(len(server.annotations)==20)
+        DB.loadIntoMemory(slideuid, zLevel=None)
+        assert(len(DB.annotations)==20)
+
+        # nothing changed: only uuids and edit times of the remote annotations are retrieved
+        numRequests = len(server.requests)
+        exm.sync(dataset_id=image, imageset_id=imageset, product_id=1, slideuid=slideuid, database=DB)
+        assert(len(server.requests)==numRequests+1)
+
+        # one remote and one local change: only these are exchanged
+        remoteId = [anno['id'] for anno in server.annotations.values() if anno['unique_identifier']=='uuid-3'][0]
+        server.annotations[remoteId].update({'description' : 'edited', 'last_edit_time' : (datetime.datetime.now()+datetime.timedelta(seconds=60)).strftime("%Y-%m-%dT%H:%M:%S.%f")})
+        localId = [uid for uid, anno in DB.annotations.items() if anno.labels[0].annnotatorId==1][0]
+        DB.setLastModified(localId, time.time()+10)
+        DB.commit()
+        numRequests = len(server.requests)
+        exm.sync(dataset_id=image, imageset_id=imageset, product_id=1, slideuid=slideuid, database=DB)
+        requests = annotationRequests(numRequests)
+        assert([method for method, path in requests]==['GET','GET','PATCH'])
+        DB.loadIntoMemory(slideuid, zLevel=None)
+        assert(DB.annotations[DB.guids['uuid-3']].text=='edited')
+
+        # pushed by a collaborator after the last sync, but edited before it
+        server.addAnnotation(annotation_type=boxType, image=image, vector={'x1' : 500, 'y1' : 10, 'x2' : 505, 'y2' : 15}, unique_identifier='uuid-late',
+                             last_editor=2, last_edit_time=(datetime.datetime.now()-datetime.timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S.%f"))
+        exm.sync(dataset_id=image, imageset_id=imageset, product_id=1, slideuid=slideuid, database=DB)
+        DB.loadIntoMemory(slideuid, zLevel=None)
+        assert('uuid-late' in DB.guids)
+        exm.terminate()
+
+    server.stop()
+
+
+def test_scheduled_sync():
+    server = exactStandIn(delay=0.02)
+    imageset = server.addImageSet('Test-ImageSet', ['slide%d.svs' % k for k in range(3)])
+    images = [image['id'] for image in server.imageSets[imageset]['images']]
+
+    with tempfile.TemporaryDirectory() as tempdir, open(os.devnull, 'w') as logfile:
+        DB = Database().create(tempdir+os.sep+'test.sqlite')
+        DB.insertClass('Mitosis')
+        DB.insertAnnotator('exactuser')
+        DB.setExactPerson(1)
+        slides = list()
+        for image in images:
+            slideuid = DB.insertNewSlide('slide%d.svs' % len(slides),'')
+            for k in range(20):
+                DB.insertNewSpotAnnotation(xpos_orig=10*k, ypos_orig=20, slideUID=slideuid, classID=1, annotator=1)
+            slides.append((slideuid, f'{image}/1/{imageset}'))
+        DB.commit()
+
+        statusqueue = queue.Queue()
+        exm = ExactManager('exactuser', 'pw', server.url, logfile=logfile, num_threads=4)
+        failed = ExactSyncScheduler(exm, DB.dbfilename, statusqueue=statusqueue, max_slides=3).sync(slides)
+        exm.terminate()
+
+        # all slides synced, sharing the request limit and the annotation type created once
+        assert(failed==[])
+        assert(sorted([anno['image'] for anno in server.annotations.values()])==sorted(images*20))
+        assert(server.maxConcurrent <= 4)
+        assert(len(server.annotationTypes)==1)
+        progress = [value for status, value in list(statusqueue.queue) if status==0]
+        assert(progress[-1]==-1)
+
+        # exact_ids written back and triggers restored
+        DB = Database().open(DB.dbfilename)
+        assert(DB.execute('SELECT COUNT(*) FROM Annotations_label WHERE exact_id IS NULL').fetchone()[0]==0)
+        assert(DB.execute("SELECT COUNT(*) FROM sqlite_master WHERE type=='trigger'").fetchone()[0]>0)
+        DB.db.close()
+
+    server.stop()
+
+
+def test_upload():
+    server = exactStandIn(failures=1)
+    imageset = server.addImageSet('Test-ImageSet', [])
+
+    with tempfile.TemporaryDirectory() as tempdir, open(os.devnull, 'w') as logfile:
+        filename = tempdir+os.sep+'slide.svs'
+        with open(filename, 'wb') as f:
+            f.write(os.urandom(3*2**20))
+        DB = Database().create(tempdir+os.sep+'test.sqlite')
+
+        statusqueue = queue.Queue()
+        exm = ExactManager('exactuser', 'pw', server.url, logfile=logfile, statusqueue=statusqueue, backoff=0.01)
+        # streamed upload, retried after a server error
+        image = exm.upload_image_to_imageset(imageset, filename, database=DB)[0]
+        assert(server.failures==0)
+        assert(server.images[image.id]['size']==3*2**20)
+        assert([image['name'] for image in server.imageSets[imageset]['images']]==['slide.svs'])
+        assert(any([status==1 and 'MB/s' in msg for status, msg in list(statusqueue.queue)]))
+
+        # uploaded before: recognized by checksum, not uploaded again
+        numRequests = len(server.requests)
+        assert(exm.upload_image_to_imageset(imageset, filename, database=DB)[0].id==image.id)
+        assert([method for method, path in server.requests[numRequests:]]==['GET'])
+
+        # no longer on the server: uploaded again
+        del server.images[image.id]
+        assert(exm.upload_image_to_imageset(imageset, filename, database=DB)[0].id!=image.id)
+        assert(len(server.images)==1)
+        exm.terminate()
+        DB.db.close()
+
+    server.stop()
+
+
+def test_lost_replies():
+    server = exactStandIn(lostReplies=3)
+    imageset = server.addImageSet('Test-ImageSet', ['slide.svs'])
+    image = server.imageSets[imageset]['images'][0]['id']
+
+    with tempfile.TemporaryDirectory() as tempdir, open(os.devnull, 'w') as logfile:
+        DB = Database().create(':memory:')
+        slideuid = DB.insertNewSlide('slide.svs','')
+        DB.insertClass('Mitosis')
+        DB.insertAnnotator('exactuser')
+        DB.setExactPerson(1)
+        for k in range(5):
+            DB.insertNewSpotAnnotation(xpos_orig=10*k, ypos_orig=20, slideUID=slideuid, classID=1, annotator=1)
+
+        exm = ExactManager('exactuser', 'pw', server.url, logfile=logfile, max_in_flight=1, backoff=0.01)
+        # created annotations whose reply was lost are found by uuid, not created again
+        exm.sync(dataset_id=image, imageset_id=imageset, product_id=1, slideuid=slideuid, database=DB)
+        assert(server.lostReplies==0)
+        assert(len(server.annotations)==5)
+        remote = {anno['unique_identifier'] : anno['id'] for anno in server.annotations.values()}
+        DB.loadIntoMemory(slideuid, zLevel=None)
+        assert(all([anno.labels[0].exact_id==remote[anno.guid] for anno in DB.annotations.values()]))
+
+        # uploaded image whose reply was lost is found in the image set, not uploaded again
+        filename = tempdir+os.sep+'other.svs'
+        with open(filename, 'wb') as f:
+            f.write(os.urandom(2**20))
+        server.lostReplies = 1
+        image = exm.upload_image_to_imageset(imageset, filename)[0]
+        assert(len(server.images)==1)
+        assert(image.id in server.images)
+        exm.terminate()
+
+    server.stop()
+
+
+def test_transaction():
+    with tempfile.TemporaryDirectory() as tempdir:
+        DB = Database().create(tempdir+os.sep+'test.sqlite')
+        slideuid = DB.insertNewSlide('slide.svs','')
+        DB.insertClass('Mitosis')
+        DB.insertAnnotator('exactuser')
+        DB.loadIntoMemory(slideuid, zLevel=None)
+
+        # committed once, on success
+        with transaction(DB):
+            DB.insertNewSpotAnnotation(xpos_orig=10, ypos_orig=20, slideUID=slideuid, classID=1, annotator=1)
+            DB.insertAnnotator('otherexpert')
+        assert(len(DB.getAllPersons())==2)
+
+        # rolled back completely, if an exception is raised
+        try:
+            with transaction(DB):
+                DB.insertNewSpotAnnotation(xpos_orig=30, ypos_orig=20, slideUID=slideuid, classID=1, annotator=1)
+                DB.insertAnnotator('thirdexpert')
+                raise ValueError('page failed')
+        except ValueError:
+            pass
+        assert(len(DB.getAllPersons())==2)
+        assert(len(DB.annotations)==1)
+        assert(DB.execute('SELECT COUNT(*) FROM Annotations').fetchone()[0]==1)
+        DB.db.close()
@@ -0,0 +1,29 @@
+from SlideRunner.general.overlayRendering import *
+import numpy as np
+import cv2
+
+
+COLORS = [[255, 255, 255, 0], [255, 128, 0, 255], [0, 96, 0, 255]]
+
+
+def test_class_map_renderer():
+    classMap = np.random.default_rng(0).integers(0, 3, (50, 80))
+    renderer = classMapRenderer(COLORS)
+
+    # viewport partially left of and above the map
+    coordinates, factor, shape = (-640, -320, 2560, 1280), 64, (120, 240)
+    dst = np.zeros(shape+(3,), np.uint8)
+    image = renderer.render(classMap, coordinates, factor, shape, dst=dst)
+    assert(image is dst)
+
+    # reference: colourize, pad and resize
+    reference = np.asarray([COLORS[i] for i in classMap[0:15, 0:30].flatten()], np.uint8).reshape((15, 30, 4))
+    reference = cv2.copyMakeBorder(reference, 5, 0, 10, 0, cv2.BORDER_CONSTANT, value=(0,0,0,255))
+    reference = cv2.resize(reference, dsize=(shape[1], shape[0]), interpolation=cv2.INTER_NEAREST)
+    assert(np.all(image==reference[:,:,0:3]))
+
+    # transparent classes show the background
+    background = np.full(shape+(4,), 17, np.uint8)
+    image = renderer.render(classMap, coordinates, factor, shape, background=background)
+    assert(np.all(image[(reference[:,:,3]==0)]==17))
+    assert(np.all(image[(reference[:,:,3]>0)]==reference[:,:,0:3][(reference[:,:,3]>0)]))
@@ -0,0 +1,34 @@
+from SlideRunner.dataAccess.overlaysource import *
+from SlideRunner.general.overlayRendering import classMapRenderer
+import numpy as np
+import h5py
+import os
+
+
+def test_hdf5_overlay_source(tmp_path):
+    filename = os.path.join(str(tmp_path), 'results.hdf5')
+    labels = np.random.default_rng(0).integers(0, 4, (1000, 1500)).astype(np.uint8)
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('segmentation', data=labels, chunks=(128,128))
+        writePyramid(f, 'segmentation', downsamples=(4,))
+
+    source = hdf5OverlaySource(filename, 'segmentation')
+    assert([level.downsample for level in source.levels]==[1,4])
+
+    # only the chunks intersecting the region are read
+    assert(np.all(source.levels[0][100:300, 1400:1600]==labels[100:300, 1400:1600]))
+    assert(len(source.cache.tiles)==3*2)
+
+    # zoomed out: stored level 4, strided from it beyond
+    assert(source.level(1.5).downsample==1 and source.level(5).downsample==4)
+    level = source.level(9)
+    assert(level.downsample==8 and np.all(level[0:125, 0:188]==labels[::8, ::8]))
+
+    # viewport of the full slide (factor 16): at least one map pixel per screen pixel
+    classMap, factor = source.view((0, 0, 24000, 16000), 16, (500, 750))
+    assert(classMap.downsample==2 and factor==32)
+    classMap, factor = source.view((0, 0, 24000, 16000), 16, (125, 187))
+    assert(classMap.downsample==8)
+    image = classMapRenderer([[0,0,0],[1,1,1],[2,2,2],[3,3,3]]).render(classMap, (0, 0, 24000, 16000), factor, (125, 187))
+    assert(np.all(image[:,:,0]==labels[::8, ::8][:, 0:187]))
+    source.close()
@@ -0,0 +1,170 @@
+from SlideRunner.general.SlideRunnerPlugin import *
+from SlideRunner.general.pluginProcess import instantiatePlugin
+from SlideRunner_dataAccess.annotations import rectangularAnnotation, spotAnnotation, circleAnnotation, polygonAnnotation, imageAnnotation, annoCoordinate
+import numpy as np
+import os
+import threading
+from queue import Queue
+
+
+def test_annotation_store():
+    store = PluginAnnotationStore([rectangularAnnotation(0, 10, 10, 20, 20)])
+    for uid in range(1,200):
+        store.append(spotAnnotation(uid, 100*uid, 100))
+
+    assert(len(store)==200)
+    assert(store.minCoords.shape[0]>=200)
+
+    visible = store.visibleIndices(leftUpper=(0,0), rightLower=(260,200))
+    assert(visible.tolist()==[0,1,2])
+    assert([store[idx].uid for idx in visible]==[0,1,2])
+
+    # same result as the list-based visibility query
+    minCoords, maxCoords = generateMinMaxCoordsList(store.annotations)
+    assert([anno.uid for anno in getVisibleAnnotations((0,0), (260,200), store.annotations, minCoords, maxCoords)]==[0,1,2])
+
+    # bounding boxes of all annotation types, as given by the annotations
+    annos = [polygonAnnotation(0, np.array([[5,7],[1,9],[3,2]])), circleAnnotation(1, 50, 60, r=10), spotAnnotation(2, 5, 5),
+             rectangularAnnotation(3, 1, 2, 3, 4), polygonAnnotation(4, np.array([[0,0],[10,10]]))]
+    assert(annotationBoxes(annos).tolist()==[anno.minCoordinates().tolist()+anno.maxCoordinates().tolist() for anno in annos])
+
+    # annotations of other classes (e.g. whole image, subclasses with their own extent) as given by minCoordinates/maxCoordinates
+    class largeSpot(spotAnnotation):
+        def minCoordinates(self):
+            return annoCoordinate(self.x1-100, self.y1-100)
+        def maxCoordinates(self):
+            return annoCoordinate(self.x1+100, self.y1+100)
+    annos = [rectangularAnnotation(0, 1, 2, 3, 4), imageAnnotation(1, 0), largeSpot(2, 500, 500), spotAnnotation(3, 500, 500)]
+    assert(annotationBoxes(annos).tolist()==[[1,2,3,4], [0,0,np.inf,np.inf], [400,400,600,600], [475,475,525,525]])
+    store = PluginAnnotationStore(annos)
+    assert(store.visibleIndices(leftUpper=(1000,1000), rightLower=(1100,1100)).tolist()==[1])
+
+
+def test_plugin_mailbox():
+    mailbox = PluginMailbox(maxsize=2)
+    button = PushbuttonPluginConfigurationEntry(uid=0, name='Run')
+
+    mailbox.put(jobToQueueTuple(currentImage=np.zeros((2,2)), coordinates=(0,0,1,1)))
+    first = pluginJob(mailbox.get())
+    views = [jobToQueueTuple(currentImage=np.zeros((2,2)), coordinates=(k,0,1,1)) for k in range(1,4)]
+    for view in views:
+        mailbox.put(view)
+    mailbox.put(jobToQueueTuple(trigger=button))
+
+    # only the newest view is pending, older views and the job in progress are cancelled
+    assert(first.cancelled)
+    assert(mailbox.qsize()==2)
+    job = pluginJob(mailbox.get())
+    assert(job.coordinates==(3,0,1,1) and not job.cancelled)
+    assert(pluginJob(mailbox.get()).trigger is button)
+    assert(pluginJob(views[0]).cancelled and pluginJob(views[1]).cancelled)
+    assert(mailbox.statistics()['dropped']==2)
+
+    # jobs finished by the worker (which asks for the next one) are released, not cancelled
+    assert(len(mailbox.inProgress)==1)
+    finished = jobToQueueTuple(currentImage=np.zeros((2,2)), coordinates=(4,0,1,1))
+    mailbox.put(finished)
+    mailbox.get()
+    try:
+        mailbox.get_nowait()
+    except Empty:
+        pass
+    assert(len(mailbox.inProgress)==0)
+    mailbox.put(jobToQueueTuple(currentImage=np.zeros((2,2)), coordinates=(6,0,1,1)))
+    assert(not pluginJob(finished).cancelled)
+    mailbox.get()
+
+    # quit is never dropped and discards pending jobs
+    mailbox.put(jobToQueueTuple(coordinates=(5,0,1,1)))
+    mailbox.put(jobToQueueTuple(description=JobDescription.QUIT_PLUGIN_THREAD))
+    assert(pluginJob(mailbox.get(timeout=1)).jobDescription==JobDescription.QUIT_PLUGIN_THREAD)
+    assert(mailbox.empty())
+
+
+def test_shared_frame_ring():
+    ring = SharedFrameRing(slots=2)
+    image = np.arange(24, dtype=np.uint8).reshape(2,3,4)
+    frame = ring.publish(image)
+    # published once, mapped without copying by the receiver
+    assert(ring.publish(image) is frame and ring.bytesPublished==24)
+    assert(np.all(pluginJob(jobToQueueTuple(currentImage=frame)).currentImage==image))
+
+    overlay = ring.allocate((2,3), np.float16)
+    assert(SharedFrameRing.find(overlay).shape==(2,3) and SharedFrameRing.find(np.zeros((2,3), np.float16)) is None)
+
+    # retained slots are skipped, reused slots are detected
+    ring.retain(frame)
+    ring.allocate((2,3), np.float16)
+    assert(frame.array() is not None)
+    ring.release(frame)
+    ring.allocate((2,3), np.float16)
+    assert(frame.array() is None)
+
+    # received images are copies, unaffected by reuse of the slot
+    overlay = ring.allocate((2,3), np.float16)
+    overlay[:] = 0
+    received = receivedImage(SharedFrameRing.find(overlay))
+    overlay[:] = 1
+    assert(np.all(received==0))
+    frame = SharedFrameRing.find(overlay)
+    ring.allocate((2,3), np.float16)
+    ring.allocate((2,3), np.float16)
+    assert(receivedImage(frame) is None)
+    ring.close()
+
+
+class invertingPlugin(SlideRunnerPlugin):
+    shortName = 'Invert'
+    inQueue = PluginMailbox()
+    outQueue = Queue()
+    executionMode = PluginExecutionMode.PROCESS
+
+    def __init__(self, statusQueue):
+        self.statusQueue = statusQueue
+        threading.Thread(target=self.queueWorker, daemon=True).start()
+
+    def queueWorker(self):
+        while (True):
+            job = pluginJob(self.inQueue.get())
+            if (job.jobDescription == JobDescription.QUIT_PLUGIN_THREAD):
+                return
+            self.setMessage('pid %d' % os.getpid())
+            self.returnImage(255-job.currentImage, job.procId)
+
+
+def test_plugin_process():
+    statusQueue = Queue()
+    instance = instantiatePlugin(invertingPlugin, statusQueue)
+    image = np.random.RandomState(0).randint(0, 255, size=(64,48,4), dtype=np.uint8)
+    invertingPlugin.inQueue.put(jobToQueueTuple(currentImage=image, procId=7))
+
+    # the image is processed in the worker process and returned through shared memory
+    result, procId = invertingPlugin.outQueue.get(timeout=60)
+    assert(procId==7 and np.all(result==255-image))
+    shortName, status, value = statusQueue.get(timeout=10)
+    assert(status==StatusInformation.TEXT and value!='pid %d' % os.getpid())
+
+    invertingPlugin.inQueue.put(jobToQueueTuple(description=JobDescription.QUIT_PLUGIN_THREAD))
+    instance.processHost.process.join(timeout=30)
+    assert(instance.processHost.process.exitcode==0)
+
+
+def test_plugin_manifest(tmp_path):
+    import sys
+    from SlideRunner.general.pluginFinder import discoverPlugins
+    from SlideRunner.general.types import lazyPlugin
+    sys.modules.pop('SlideRunner.plugins.wsi_hematoxylin', None)
+    manifestFile = os.path.join(str(tmp_path), 'pluginmanifest.p')
+    plugins = {plugin.shortName : plugin for plugin in discoverPlugins('manifest', manifestFile)}
+
+    # discovered without importing the plugin module
+    plugin = plugins['Hematoxylin density (WSI)']
+    assert(isinstance(plugin, lazyPlugin))
+    assert('SlideRunner.plugins.wsi_hematoxylin' not in sys.modules)
+    assert(plugin.pluginType==PluginTypes.WHOLESLIDE_PLUGIN) # inherited from WholeSlideTilePlugin
+    assert(plugin.configurationList[0].uid=='threshold')
+    assert(os.path.exists(manifestFile))
+
+    # served from the manifest
+    assert(set(plugin.shortName for plugin in discoverPlugins('manifest', manifestFile))==set(plugins.keys()))
+    assert(plugin.load().shortName==plugin.shortName)
@@ -0,0 +1,37 @@
+from SlideRunner.processing.resultcache import *
+import numpy as np
+import os
+
+
+def test_plugin_result_cache(tmp_path):
+    cache = pluginResultCache(maxBytes=2*100, spillDirectory=str(tmp_path))
+    keys = [pluginResultCache.key('OTSU', 0.1, {'threshold':0.5}, 'slide.svs', (k*100,0,100,100), (10,10), False, 0) for k in range(4)]
+    assert(keys[0] == pluginResultCache.key('OTSU', 0.1, {'threshold':0.5}, 'slide.svs', (0,0,100,100), (10,10), False, 0))
+    assert(keys[0] != pluginResultCache.key('OTSU', 0.1, {'threshold':0.6}, 'slide.svs', (0,0,100,100), (10,10), False, 0))
+
+    # results are stored under the key of their request, outdated results are not displayed
+    first = cache.request(keys[0], 'OTSU')
+    second = cache.request(keys[1], 'OTSU')
+    assert(cache.store(first, np.full((10,10), 1, np.uint8)) == False)
+    assert(cache.store(second, np.full((10,10), 2, np.uint8)) == True)
+    assert(cache.store(None, np.zeros((10,10), np.uint8)) == True)
+    assert(cache.get(keys[0])[0,0]==1 and cache.get(keys[1])[0,0]==2)
+
+    # evicted results are spilled to disk and loaded again
+    cache.store(cache.request(keys[2], 'OTSU'), np.full((10,10), 3, np.uint8))
+    assert(len(cache.memory)==2 and len(os.listdir(str(tmp_path)))==1)
+    assert(cache.get(keys[0], 'OTSU')[0,0]==1)
+    assert(cache.get(keys[3]) is None)
+
+    # results requested without a key (computed on a preview) are displayed, but not stored
+    memorized = len(cache.memory)
+    preview = cache.request(None, 'OTSU')
+    assert(cache.store(preview, np.full((10,10), 5, np.uint8)) == True)
+    assert(len(cache.memory)==memorized)
+    assert(cache.get(keys[3]) is None)
+    # ... and superseded by the request of the full resolution region
+    preview = cache.request(None, 'OTSU')
+    full = cache.request(keys[3], 'OTSU')
+    assert(cache.store(preview, np.full((10,10), 5, np.uint8)) == False)
+    assert(cache.store(full, np.full((10,10), 4, np.uint8)) == True)
+    assert(cache.get(keys[3])[0,0]==4)
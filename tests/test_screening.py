@@ -20,3 +20,18 @@ def test_screening():
     # rectangle with (in total) 121 pixels was created
     assert((np.sum(map.mapHeatmap)/255)==121.0)
 
+
+
+def test_find_next_field():
+    overview = np.zeros((100,100,3),np.uint8)
+    overview[:,:,:] = 255
+    overview[60:80,60:80,:] = 0
+
+    map = screeningMap(overview=overview,mainImageSize=(500,500), slideLevelDimensions=[[1000,1000],[100,100]], thumbNailSize=(20,20), thresholding='OTSU')
+    workingCopy = np.copy(map.mapWorkingCopy)
+
+    leftUpper = map.findNextField([0,0], imgarea_w=(200,200), relOffset=(0.5,0.5))
+
+    # prediction does not mark anything as screened
+    assert(np.all(workingCopy==map.mapWorkingCopy))
+    assert(map.checkIsNew(leftUpper, (200,200)))
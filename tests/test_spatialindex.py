@@ -0,0 +1,115 @@
+from SlideRunner.dataAccess.spatialindex import *
+from SlideRunner.processing.densitymap import annotationDensityMap
+from SlideRunner_dataAccess.annotations import spotAnnotation, ViewingProfile
+import numpy as np
+import time
+
+
+def randomSpots(number, slideSize=(100000,80000), seed=0):
+    rng = np.random.RandomState(seed)
+    x = rng.randint(0, slideSize[0], size=number)
+    y = rng.randint(0, slideSize[1], size=number)
+    return {uid:spotAnnotation(uid, x1, y1) for uid,(x1,y1) in enumerate(zip(x,y), start=1)}
+
+
+def test_grid_query():
+    index = gridIndex(cellSize=100)
+    rng = np.random.RandomState(1)
+    boxes = dict()
+    for uid in range(500):
+        x1, y1 = rng.randint(0, 2000, size=2)
+        w, h = rng.randint(1, 400, size=2)
+        boxes[uid] = (x1, y1, x1+w, y1+h)
+        index.insert(uid, boxes[uid])
+    index.insert(500, (0, 0, np.inf, np.inf))
+    boxes[500] = (0, 0, np.inf, np.inf)
+
+    for uid in range(0, 500, 7):
+        index.remove(uid)
+        boxes.pop(uid)
+
+    for leftUpper, rightLower in [((0,0),(50,50)), ((330,720),(1240,990)), ((-500,-500),(5000,5000))]:
+        expected = sorted([uid for uid,(x1,y1,x2,y2) in boxes.items() if (x2 > leftUpper[0]) and (x1 < rightLower[0]) and (y2 > leftUpper[1]) and (y1 < rightLower[1])])
+        assert(index.query(leftUpper, rightLower)==expected)
+
+
+def test_spatial_database():
+    DB = SpatialDatabase()
+    DB.create(':memory:')
+    DB.insertAnnotator('John Doe')
+    DB.insertClass('Cell')
+    DB.insertNewSlide('BLA.tiff','blub/BLA.tiff')
+
+    uid1 = DB.insertNewSpotAnnotation(xpos_orig=500,ypos_orig=500, slideUID=1, classID=1, annotator=1)
+    uid2 = DB.insertNewPolygonAnnotation(np.array([[5000,5000],[5100,5000],[5100,5100]]), slideUID=1, classID=1, annotator=1)
+    DB.loadIntoMemory(1)
+
+    assert(list(DB.getVisibleAnnotations((0,0),(1000,1000)).keys())==[uid1])
+
+    # moving a polygon point updates the index
+    DB.annotations[uid2].coordinates[0,:] = [800,800]
+    DB.updatePolygonPoint(annoId=uid2, orderIdx=0, coords=[800,800])
+    assert(list(DB.getVisibleAnnotations((0,0),(1000,1000)).keys())==[uid1, uid2])
+
+    DB.removeAnnotation(uid1, onlyMarkDeleted=False)
+    assert(list(DB.getVisibleAnnotations((0,0),(1000,1000)).keys())==[uid2])
+
+
+def test_density_map():
+    density = annotationDensityMap(np.array([[10,10],[20,20],[200,10],[np.inf,np.inf]]), np.array([1,1,2,1]), binSize=64)
+    assert(density.counts.sum()==3)
+    assert(density.counts[0,0,0]==2 and density.counts[1,0,3]==1)
+
+    # one screen pixel per bin: only the active class is blended in
+    image = np.zeros((4,8,4), np.uint8)
+    density.render(image, (0,0), (512,256), colors={1:[255,0,0,255], 2:[0,255,0,255]}, activeClasses=[1])
+    assert(image[0,0,0]>0 and image[0,3,1]==0 and image[1,1,0]==0)
+
+
+def test_lod_annotate_image():
+    DB = SpatialDatabase()
+    DB.create(':memory:')
+    DB.insertAnnotator('John Doe')
+    DB.insertClass('Cell')
+    DB.insertNewSlide('BLA.tiff','blub/BLA.tiff')
+    uid1 = DB.insertNewSpotAnnotation(xpos_orig=500,ypos_orig=500, slideUID=1, classID=1, annotator=1)
+    DB.loadIntoMemory(1)
+
+    vp = DB.updateViewingProfile(ViewingProfile())
+    image = np.zeros((100,100,4), np.uint8)
+    DB.annotateImage(image, (0,0), (3200,3200), 32.0, vp, None, {0:{'Active':True}, 1:{'Active':True}}, lodDownsample=16)
+    assert(np.any(image[15,15,0:3]>0))
+    # visible annotations are still found on click
+    assert(list(DB.VA.keys())==[uid1])
+
+    # new annotations show up in the density map
+    DB.insertNewSpotAnnotation(xpos_orig=2500,ypos_orig=2500, slideUID=1, classID=1, annotator=1)
+    image = np.zeros((100,100,4), np.uint8)
+    DB.annotateImage(image, (0,0), (3200,3200), 32.0, vp, None, {0:{'Active':True}, 1:{'Active':True}}, lodDownsample=16)
+    assert(np.any(image[78,78,0:3]>0))
+
+
+if __name__ == '__main__':
+    # Benchmark: redraw of a fixed viewport containing 100 annotations, with a growing number of annotations on the slide
+    vp = ViewingProfile()
+    for number in [1000, 10000, 100000, 1000000]:
+        annotations = {uid:anno for uid,anno in randomSpots(number).items() if not ((49900<anno.x1<52100) and (39900<anno.y1<41100))}
+        annotations.update({number+k:spotAnnotation(number+k, 50000+10*k, 40000+10*k) for k in range(100)})
+        leftUpper, rightLower = (49990, 39990), (51990, 40990)
+        image = np.zeros((1000,2000,4), np.uint8)
+
+        for name, DB in [('linear', Database()), ('grid index', SpatialDatabase())]:
+            DB.annotations = annotations
+            DB.generateMinMaxCoordsList()
+            t0 = time.time()
+            for k in range(10):
+                DB.annotateImage(image, leftUpper, rightLower, 1.0, vp, None, {0:{'Active':True}})
+            print('%8d annotations, %-10s: %8.2f ms per redraw' % (number, name, (time.time()-t0)*100))
+
+        # zoomed out view of the whole slide, drawn as density map
+        image = np.zeros((800,1000,4), np.uint8)
+        DB.annotateImage(image, (0,0), (100000,80000), 100.0, vp, None, {0:{'Active':True}}, lodDownsample=16)
+        t0 = time.time()
+        for k in range(10):
+            DB.annotateImage(image, (0,0), (100000,80000), 100.0, vp, None, {0:{'Active':True}}, lodDownsample=16)
+        print('%8d annotations, %-10s: %8.2f ms per redraw' % (number, 'density', (time.time()-t0)*100))
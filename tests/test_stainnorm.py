@@ -0,0 +1,35 @@
+from SlideRunner.processing.stainnorm import *
+from SlideRunner_dataAccess.slide import RotatableOpenSlide
+import numpy as np
+import cv2
+import os
+
+
+def synthetic(h, w, seed=0):
+    rng = np.random.default_rng(seed)
+    H, E = np.array((0.65,0.70,0.29)), np.array((0.07,0.99,0.11))
+    od = rng.gamma(1.5,0.5,(h,w,1))*H + rng.gamma(1.5,0.4,(h,w,1))*E
+    od[rng.random((h,w))<0.3] = 0.02 # background
+    return np.uint8(np.clip(240*np.exp(-od),0,255)), H/np.linalg.norm(H), E/np.linalg.norm(E)
+
+
+def test_stain_normalization(tmp_path):
+    img, H, E = synthetic(300, 400)
+    stains = estimateStains(opticalDensity(img))
+    assert(np.dot(stains.HE[:,0], H)>0.99 and np.dot(stains.HE[:,1], E)>0.99)
+
+    dst = np.zeros(img.shape, np.uint8)
+    normalized = normalizeStains(img, stains, dst=dst)
+    assert(normalized is dst)
+    T = stains.transform()
+    assert(np.abs(np.float32(normalized)-np.clip(np.exp(opticalDensity(img) @ T[:,0:3].T + T[:,3]), 0, 255)).max() < 1)
+    # only E: no hematoxylin left, i.e. brighter in the red channel
+    assert(normalizeStains(img, stains, mode=1)[:,:,0].mean() > normalized[:,:,0].mean())
+
+    # estimate from tissue tiles of the slide
+    filename = os.path.join(str(tmp_path), 'slide.png')
+    slide = np.full((1000,1200,3), 240, np.uint8)
+    slide[200:800,300:1000] = synthetic(600, 700, seed=1)[0]
+    cv2.imwrite(filename, cv2.cvtColor(slide, cv2.COLOR_RGB2BGR))
+    slideStains = estimateSlideStains(RotatableOpenSlide(filename, rotate=False))
+    assert(np.all(np.sum(slideStains.HE*stains.HE, axis=0)>0.99))
@@ -0,0 +1,31 @@
+from SlideRunner.general.startupProfile import *
+import json
+import os
+import time
+
+
+def test_startup_profile(tmp_path):
+    profiler = startupProfiler()
+    with profiler.phase('imports'):
+        pass
+    profiler.enable(os.path.join(str(tmp_path), 'startup.json'))
+    with profiler.phase('imports'):
+        with profiler.phase('dependency checks'):
+            time.sleep(0.02)
+    with profiler.phase('imports'):
+        pass
+    profiler.finishWhen(['main window shown'])
+    assert(not profiler.finished)
+    profiler.mark('main window shown')
+    assert(profiler.finished)
+
+    durations = profiler.durations()
+    assert(len(profiler.phases)==3)
+    assert(durations['imports']>=durations['dependency checks']>=0.02)
+    assert(list(profiler.checkBudget({'dependency checks' : 0.01, 'imports' : 10}).keys())==['dependency checks'])
+
+    with open(os.path.join(str(tmp_path), 'startup.json')) as f:
+        report = json.load(f)
+    assert('main window shown' in report['marks'])
+    # the committed budget covers the reported phases
+    assert(set(durations.keys()) <= set(report['budget'].keys()))
@@ -0,0 +1,76 @@
+from SlideRunner.processing.tilecache import *
+import numpy as np
+
+
+class arraySlide(object):
+    """
+        minimal slide with two levels (1x, 2x) backed by a numpy array
+    """
+    def __init__(self, w=1000, h=700):
+        self.image = np.random.randint(0, 255, size=(h,w,4), dtype=np.uint8)
+        self.level_downsamples = [1, 2]
+        self.reads = 0
+
+    def read_region(self, location, level, size, zLevel=0):
+        self.reads += 1
+        ds = self.level_downsamples[level]
+        level_img = self.image[::ds, ::ds]
+        out = np.zeros((size[1], size[0], 4), np.uint8)
+        x0, y0 = int(location[0]/ds), int(location[1]/ds)
+        sx0, sy0 = max(0, x0), max(0, y0)
+        sx1, sy1 = min(level_img.shape[1], x0+size[0]), min(level_img.shape[0], y0+size[1])
+        if (sx1>sx0) and (sy1>sy0):
+            out[sy0-y0:sy1-y0, sx0-x0:sx1-x0] = level_img[sy0:sy1, sx0:sx1]
+        return out
+
+
+def test_lru_eviction():
+    cache = tileCache(maxBytes=3*64*64*4)
+    for i in range(3):
+        cache.put(('a',0,0,False,i,0), np.zeros((64,64,4),np.uint8))
+    cache.get(('a',0,0,False,0,0)) # mark first tile as recently used
+    cache.put(('a',0,0,False,3,0), np.zeros((64,64,4),np.uint8))
+
+    assert(len(cache)==3)
+    assert(cache.currentBytes<=cache.maxBytes)
+    assert(('a',0,0,False,0,0) in cache)
+    assert(('a',0,0,False,1,0) not in cache)
+
+
+def test_region_composition():
+    slide = arraySlide()
+    viewport = tiledViewport(tileCache(), tileSize=128)
+
+    for level, location, size in [(0, (0,0), (300,200)), (0, (77,301), (250,250)), (1, (-50,10), (200,100))]:
+        region = viewport.readRegion(slide, 'slide', location, level, size)
+        assert(np.all(region==slide.read_region(location, level, size)))
+
+    # panning by a few pixels is served from the cache
+    reads = slide.reads
+    viewport.readRegion(slide, 'slide', (80,305), 0, (240,240))
+    assert(slide.reads==reads)
+
+
+def test_stale_read_abandoned():
+    slide = arraySlide()
+    viewport = tiledViewport(tileCache(), tileSize=128)
+
+    assert(viewport.readRegion(slide, 'slide', (0,0), 0, (300,200), isStale=lambda: True) is None)
+    assert(slide.reads==0)
+
+
+def test_parallel_region_composition():
+    slide = arraySlide()
+    handles = list()
+    def openSlide(slidename, rotated):
+        handle = arraySlide()
+        handle.image = slide.image
+        handles.append(handle)
+        return handle
+
+    viewport = parallelTiledViewport(openSlide, tileCache(), tileSize=128, numWorkers=4)
+    region = viewport.readRegion(slide, 'slide', (77,301), 0, (500,350))
+
+    assert(np.all(region==slide.read_region((77,301), 0, (500,350))))
+    assert(len(viewport.tileLatencies)==sum([handle.reads for handle in handles]))
+    assert(slide.reads==1)
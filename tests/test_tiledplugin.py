@@ -0,0 +1,56 @@
+from SlideRunner.processing.tiledplugin import *
+import numpy as np
+import cv2
+import os
+
+
+def darkness(tile, configuration):
+    darkness.calls += 1
+    return cv2.resize(255-np.float32(tile[:,:,0:3]).mean(axis=2), dsize=(4,4), interpolation=cv2.INTER_AREA)
+
+
+def test_tiled_slide_processor(tmp_path):
+    slide = np.full((900,1100,3), 255, np.uint8)
+    slide[100:400,600:1000] = (120,60,140)
+    filename = os.path.join(str(tmp_path), 'slide.png')
+    cv2.imwrite(filename, slide)
+    key = resultKey(slideFingerprint(filename), 'darkness', 0.1, {'threshold' : 0.5}, ())
+
+    darkness.calls = 0
+    processor = tiledSlideProcessor(filename, darkness, key, tileSize=256, resultSize=(4,4), numWorkers=2, cacheDirectory=str(tmp_path))
+    processor.thread.join()
+    assert(processor.gridShape==(4,5))
+    # only tiles with tissue are processed
+    assert(darkness.calls==processor.statistics()[1]==4)
+    overlay = processor.overlay((0,0,1100,900), (90,110))
+    assert(overlay[25,80]>50 and overlay[70,20]==0)
+
+    # reopening serves the results from the cache
+    processor = tiledSlideProcessor(filename, darkness, key, tileSize=256, resultSize=(4,4), cacheDirectory=str(tmp_path))
+    processor.thread.join()
+    assert(darkness.calls==4)
+    assert(np.all(processor.overlay((0,0,1100,900), (90,110))==overlay))
+
+
+def test_tiled_slide_processor_failures(tmp_path):
+    slide = np.full((512,512,3), 120, np.uint8)
+    filename = os.path.join(str(tmp_path), 'slide.png')
+    cv2.imwrite(filename, slide)
+
+    def failing(tile, configuration):
+        raise ValueError('broken tile')
+
+    # failed tiles are reported and skipped, the run continues
+    errors = list()
+    processor = tiledSlideProcessor(filename, failing, 'failing', tileSize=256, resultSize=(4,4), tissueOnly=False,
+                                    cacheDirectory=str(tmp_path), error=lambda tx, ty, e: errors.append((tx, ty)))
+    processor.thread.join()
+    assert(sorted(errors)==[(0,0),(0,1),(1,0),(1,1)])
+    assert(processor.statistics()==(4,4,4))
+
+    # results of the least recently opened slides are evicted beyond the cache limit
+    os.utime(os.path.join(str(tmp_path), 'failing'), (0,0))
+    processor = tiledSlideProcessor(filename, darkness, 'darkness', tileSize=256, resultSize=(4,4), tissueOnly=False,
+                                    cacheDirectory=str(tmp_path), cacheLimit=1000)
+    processor.thread.join()
+    assert(sorted([entry.name for entry in os.scandir(str(tmp_path)) if entry.is_dir()])==['darkness'])